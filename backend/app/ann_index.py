@@ -0,0 +1,336 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .vectorstore import VECTORSTORE_DIR, load_vectorstore, vectorstore_exists, vectorstore_mtime
+from .retrieval import normalize_rows, normalize_query, top_k_indices
+from .catalog import ChapterCatalog, build_catalog, get_chapter_catalog, grade_key, normalize_chapter
+
+logger = logging.getLogger(__name__)
+
+# IVF index over every vectorstore in the tree, for "whole book" / "whole grade" retrieval.
+# Built offline with `python -m app.ann_index`; the backend only memory-maps the result.
+ANN_INDEX_DIR = os.getenv("ANN_INDEX_DIR", os.path.join(VECTORSTORE_DIR, "ann"))
+# Retrieval scopes of a generation request; all but "chapter" search this index
+RETRIEVAL_SCOPES = ("chapter", "book", "grade")
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "8"))  # inverted lists scanned per query
+# Filters that leave at most this many rows are searched exactly instead of through the lists
+ANN_EXACT_THRESHOLD = int(os.getenv("ANN_EXACT_THRESHOLD", "2048"))
+
+FORMAT_VERSION = 1
+FILTER_KEYS = ("grade", "subject", "book", "chapter")
+
+
+def _as_list(value) -> list:
+    if value is None:
+        return []
+    return list(value) if isinstance(value, (list, tuple, set)) else [value]
+
+
+def kmeans(vectors: np.ndarray, nlist: int, iterations: int = 10, seed: int = 0,
+           sample: int = 50000, batch_size: int = 8192) -> np.ndarray:
+    """
+    Spherical k-means on unit vectors: returns `nlist` unit centroids.
+    Trains on a random sample of at most `sample` rows; empty clusters are re-seeded from the sample.
+    """
+    rng = np.random.default_rng(seed)
+    n = vectors.shape[0]
+    train = vectors if n <= sample else vectors[np.sort(rng.choice(n, sample, replace=False))]
+    train = np.ascontiguousarray(train, dtype=np.float32)
+    nlist = max(1, min(nlist, train.shape[0]))
+    centroids = train[rng.choice(train.shape[0], nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assign = assign_lists(train, centroids, batch_size)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, train)
+        counts = np.bincount(assign, minlength=nlist)
+        empty = np.flatnonzero(counts == 0)
+        if empty.size:
+            sums[empty] = train[rng.choice(train.shape[0], empty.size, replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+def assign_lists(vectors: np.ndarray, centroids: np.ndarray, batch_size: int = 8192) -> np.ndarray:
+    """Nearest centroid (by cosine) of every row, computed in batches to bound memory."""
+    out = np.empty(vectors.shape[0], dtype=np.int64)
+    for start in range(0, vectors.shape[0], batch_size):
+        block = np.asarray(vectors[start:start + batch_size], dtype=np.float32)
+        out[start:start + batch_size] = np.argmax(block @ centroids.T, axis=1)
+    return out
+
+
+class AnnIndex:
+    """
+    Inverted-file (IVF) index over the normalized embeddings of many vectorstores.
+
+    Rows are stored grouped by their nearest centroid, so every inverted list is a contiguous
+    slice of `vectors`; `rows[i]` is (file id, row in that file, page). A query scores the
+    centroids, scans the `nprobe` best lists and keeps the top k rows that pass the filters.
+    When a filter leaves only a few rows, those rows are scored exactly instead.
+    """
+
+    def __init__(self, centroids: np.ndarray, vectors: np.ndarray, rows: np.ndarray, offsets: np.ndarray,
+                 files: List[Dict[str, Any]], catalog: Optional[ChapterCatalog] = None, path: Optional[str] = None):
+        self.centroids = centroids
+        self.vectors = vectors
+        self.rows = rows
+        self.offsets = offsets
+        self.files = files
+        self.catalog = catalog
+        self.path = path
+        self.exact_threshold = ANN_EXACT_THRESHOLD
+        self._file_ids = {f["file"]: i for i, f in enumerate(files)}
+        self._masks: "OrderedDict[tuple, Optional[np.ndarray]]" = OrderedDict()
+        self._masks_lock = threading.Lock()
+
+        # Files re-ingested (or removed) since the build: their row numbers may no longer match
+        self.stale_files = []
+        for f in files:
+            store_path = os.path.join(VECTORSTORE_DIR, f["file"])
+            if not vectorstore_exists(store_path) or vectorstore_mtime(store_path) != f.get("mtime"):
+                self.stale_files.append(f["file"])
+        if self.stale_files:
+            logger.warning("ANN index: %d vectorstore(s) changed since the build and are excluded, "
+                           "rebuild with `python -m app.ann_index`: %s", len(self.stale_files), self.stale_files[:5])
+        self._live_files = np.array([f["file"] not in self.stale_files for f in files], dtype=bool)
+
+    def __len__(self) -> int:
+        return int(self.rows.shape[0])
+
+    @property
+    def nlist(self) -> int:
+        return int(self.centroids.shape[0])
+
+    def filter_mask(self, filters: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """
+        Boolean mask over all rows for filters such as {"grade": "10", "book": ["first flight"]}.
+        Keys are ANDed, a list value matches any of its items. "chapter" values are resolved
+        through the chapter catalog to a file and page range. Returns None for "no filter".
+        """
+        filters = {k: v for k, v in (filters or {}).items() if v not in (None, "", [])}
+        unknown = set(filters) - set(FILTER_KEYS)
+        if unknown:
+            raise ValueError(f"Unknown ANN filter(s): {sorted(unknown)} (choose from {', '.join(FILTER_KEYS)})")
+        if not filters and not self.stale_files:
+            return None
+
+        key = tuple(sorted((k, tuple(_as_list(v))) for k, v in filters.items()))
+        with self._masks_lock:
+            if key in self._masks:
+                self._masks.move_to_end(key)
+                return self._masks[key]
+
+        file_ok = self._live_files.copy()
+        for name in ("grade", "subject", "book"):
+            if name not in filters:
+                continue
+            normalize = grade_key if name == "grade" else normalize_chapter
+            values = np.array([normalize(str(f.get(name) or "")) for f in self.files], dtype=object)
+            file_ok &= np.isin(values, [normalize(str(w)) for w in _as_list(filters[name])])
+        mask = file_ok[self.rows[:, 0]]
+
+        if "chapter" in filters:
+            grades = _as_list(filters.get("grade"))
+            if len(grades) != 1:
+                raise ValueError("A 'chapter' filter needs exactly one 'grade'")
+            catalog = self.catalog or get_chapter_catalog()
+            chapter_mask = np.zeros(len(self), dtype=bool)
+            for chapter in _as_list(filters["chapter"]):
+                entry = catalog.resolve(str(grades[0]), chapter)
+                file_id = self._file_ids.get(entry.file)
+                if file_id is None:
+                    continue
+                in_file = self.rows[:, 0] == file_id
+                if entry.pages:
+                    pages = self.rows[:, 2]
+                    in_file &= (pages >= entry.pages[0]) & (pages <= entry.pages[1])
+                chapter_mask |= in_file
+            mask &= chapter_mask
+
+        with self._masks_lock:
+            self._masks[key] = mask
+            while len(self._masks) > 128:
+                self._masks.popitem(last=False)
+        return mask
+
+    def search(self, query_vec: np.ndarray, k: int, filters: Optional[Dict[str, Any]] = None,
+               nprobe: Optional[int] = None, exact: bool = False) -> List[Tuple[str, int, float]]:
+        """Returns up to k (vectorstore file, row, score) triples, best first."""
+        if len(self) == 0 or k <= 0:
+            return []
+        q = normalize_query(query_vec)
+        mask = self.filter_mask(filters)
+        allowed = int(mask.sum()) if mask is not None else len(self)
+        if allowed == 0:
+            return []
+
+        if exact or allowed <= self.exact_threshold:
+            candidates = np.flatnonzero(mask) if mask is not None else np.arange(len(self))
+        else:
+            order = np.argsort(-(self.centroids @ q))
+            probe = max(1, min(nprobe or ANN_NPROBE, self.nlist))
+            while True:
+                lists = order[:probe]
+                candidates = np.concatenate([np.arange(self.offsets[i], self.offsets[i + 1]) for i in lists])
+                if mask is not None:
+                    candidates = candidates[mask[candidates]]
+                # A selective filter can leave the probed lists short of k rows: widen the probe
+                if candidates.shape[0] >= k or probe >= self.nlist:
+                    break
+                probe = min(probe * 2, self.nlist)
+
+        scores = np.asarray(self.vectors[candidates], dtype=np.float32) @ q
+        best = top_k_indices(scores, k)
+        return [(self.files[int(self.rows[candidates[i], 0])]["file"], int(self.rows[candidates[i], 1]),
+                 float(scores[i])) for i in best]
+
+    def scope_filters(self, scope: str, grade: str, names: Sequence[str] = ()) -> Dict[str, Any]:
+        """
+        Filters for a generation scope: "grade" searches every vectorstore of the grade,
+        "book" the named books (e.g. "first flight") or subjects (e.g. "EVS") of the grade.
+        """
+        grade = grade_key(grade)
+        if scope == "grade":
+            return {"grade": grade}
+        if scope != "book":
+            raise ValueError(f"Unknown retrieval scope: {scope} (choose {', '.join(RETRIEVAL_SCOPES)})")
+        in_grade = [f for f in self.files if f["grade"] == grade]
+        books = {normalize_chapter(f["book"]) for f in in_grade if f.get("book")}
+        subjects = {normalize_chapter(f["subject"]) for f in in_grade if f.get("subject")}
+        wanted = [normalize_chapter(n) for n in names]
+        if not wanted:
+            raise ValueError("Name the book or subject to search in 'chapter'")
+        if all(n in books for n in wanted):
+            return {"grade": grade, "book": wanted}
+        if all(n in subjects for n in wanted):
+            return {"grade": grade, "subject": wanted}
+        raise ValueError(
+            f"Unknown book or subject for grade {grade}: {', '.join(wanted)} "
+            f"(books: {', '.join(sorted(books)) or '-'}; subjects: {', '.join(sorted(subjects)) or '-'})"
+        )
+
+    def stats(self) -> dict:
+        sizes = np.diff(self.offsets)
+        return {
+            "rows": len(self),
+            "files": len(self.files),
+            "nlist": self.nlist,
+            "nprobe": ANN_NPROBE,
+            "list_size_mean": round(float(sizes.mean()), 1) if sizes.size else 0.0,
+            "list_size_max": int(sizes.max()) if sizes.size else 0,
+            "stale_files": len(self.stale_files),
+        }
+
+
+def build_index(root_dir: str = VECTORSTORE_DIR, out_dir: str = ANN_INDEX_DIR, nlist: Optional[int] = None,
+                iterations: int = 10, seed: int = 0) -> AnnIndex:
+    """Builds the IVF index over every vectorstore in the chapter catalog and writes it to out_dir."""
+    catalog = build_catalog(root_dir=root_dir)
+    files: List[Dict[str, Any]] = []
+    seen = set()
+    for chapter in catalog.chapters:
+        if chapter.file in seen:
+            continue
+        seen.add(chapter.file)
+        files.append({"file": chapter.file, "grade": chapter.grade, "subject": chapter.subject,
+                      "book": chapter.book})
+
+    blocks, row_blocks = [], []
+    for file_id, info in enumerate(files):
+        path = os.path.join(root_dir, info["file"])
+        store = load_vectorstore(path)
+        info["mtime"] = vectorstore_mtime(path)
+        info["rows"] = len(store)
+        if not len(store):
+            continue
+        blocks.append(normalize_rows(store.embeddings))
+        pages = [int(r.get("page", 0)) for r in store.records]
+        row_blocks.append(np.column_stack([np.full(len(store), file_id), np.arange(len(store)), pages]))
+    if not blocks:
+        raise ValueError(f"No vectorstores found under {root_dir}")
+    vectors = np.concatenate(blocks).astype(np.float32)
+    rows = np.concatenate(row_blocks).astype(np.int32)
+
+    nlist = nlist or max(1, int(np.sqrt(vectors.shape[0])))
+    centroids = kmeans(vectors, nlist, iterations=iterations, seed=seed)
+    assign = assign_lists(vectors, centroids)
+    order = np.argsort(assign, kind="stable")
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=centroids.shape[0]))]).astype(np.int64)
+
+    os.makedirs(out_dir, exist_ok=True)
+    np.save(os.path.join(out_dir, "centroids.npy"), centroids)
+    np.save(os.path.join(out_dir, "vectors.npy"), vectors[order])
+    np.save(os.path.join(out_dir, "rows.npy"), rows[order])
+    np.save(os.path.join(out_dir, "offsets.npy"), offsets)
+    with open(os.path.join(out_dir, "index.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "version": FORMAT_VERSION,
+            "dim": int(vectors.shape[1]),
+            "count": int(vectors.shape[0]),
+            "nlist": int(centroids.shape[0]),
+            "built_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "files": files,
+        }, f, ensure_ascii=False, indent=1)
+    return load_index(out_dir, catalog)
+
+
+def index_exists(index_dir: str = ANN_INDEX_DIR) -> bool:
+    return os.path.exists(os.path.join(index_dir, "index.json"))
+
+
+def load_index(index_dir: str = ANN_INDEX_DIR, catalog: Optional[ChapterCatalog] = None) -> AnnIndex:
+    if not index_exists(index_dir):
+        raise FileNotFoundError(f"ANN index not found in {index_dir}; build it with `python -m app.ann_index`")
+    with open(os.path.join(index_dir, "index.json"), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    load = lambda name: np.load(os.path.join(index_dir, name), mmap_mode="r")
+    return AnnIndex(
+        centroids=np.asarray(load("centroids.npy"), dtype=np.float32),
+        vectors=load("vectors.npy"),
+        rows=np.asarray(load("rows.npy")),
+        offsets=np.asarray(load("offsets.npy")),
+        files=meta["files"],
+        catalog=catalog,
+        path=index_dir,
+    )
+
+
+_index: Optional[AnnIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_ann_index() -> AnnIndex:
+    """Returns the process-wide ANN index, loading it on first use."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = load_index()
+    return _index
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Build the IVF index used for whole-book and whole-grade retrieval.")
+    parser.add_argument("root", nargs="?", default=VECTORSTORE_DIR, help="Vectorstore directory to index")
+    parser.add_argument("--out", default=ANN_INDEX_DIR, help="Directory to write the index to")
+    parser.add_argument("--nlist", type=int, default=None, help="Number of inverted lists (default: sqrt(rows))")
+    parser.add_argument("--iterations", type=int, default=10, help="k-means iterations")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    index = build_index(args.root, args.out, nlist=args.nlist, iterations=args.iterations, seed=args.seed)
+    print(f"Built ANN index in {time.perf_counter() - start:.1f}s: {index.stats()}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,357 @@
+import os
+import re
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from .export import PDFTextLayout, export_text
+from .render import template_fingerprint
+from .metrics import span
+
+BASE_DIR = os.path.dirname(os.path.dirname(__file__))  # backend/
+
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", os.path.join(BASE_DIR, "cache", "artifacts"))
+ARTIFACT_TTL = float(os.getenv("ARTIFACT_TTL", str(24 * 3600)))  # seconds since last use before a file is deleted
+ARTIFACT_MAX_BYTES = int(os.getenv("ARTIFACT_MAX_BYTES", str(1024 * 1024 * 1024)))
+ARTIFACT_SWEEP_INTERVAL = float(os.getenv("ARTIFACT_SWEEP_INTERVAL", "300"))
+ARTIFACT_CHUNK_BYTES = 64 * 1024
+
+EXTENSIONS = {"pdf": ".pdf", "docx": ".docx", "word": ".docx"}
+MEDIA_TYPES = {
+    ".pdf": "application/pdf",
+    ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+}
+ARTIFACT_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+logger = logging.getLogger(__name__)
+
+
+def artifact_id(text: str, filetype: str, use_pandoc: bool = False) -> str:
+    """Content address of an export: the same text, format and renderer (and pandoc template) get the same id."""
+    renderer = f"pandoc{template_fingerprint(filetype)}" if use_pandoc else "plain"
+    material = "\0".join([EXTENSIONS[filetype], renderer, text])
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()[:32]
+
+
+class Artifact:
+    """One exported file in the store."""
+
+    def __init__(self, artifact_id: str, path: str, cached: bool = False):
+        self.id = artifact_id
+        self.path = path
+        self.cached = cached
+        stat = os.stat(path)
+        self.size = stat.st_size
+        self.modified = stat.st_mtime
+
+    @property
+    def extension(self) -> str:
+        return os.path.splitext(self.path)[1]
+
+    @property
+    def filename(self) -> str:
+        return f"material-{self.id[:8]}{self.extension}"
+
+    @property
+    def media_type(self) -> str:
+        return MEDIA_TYPES.get(self.extension, "application/octet-stream")
+
+    @property
+    def etag(self) -> str:
+        # The id already is a hash of the content, so it makes a strong validator
+        return f'"{self.id}"'
+
+    @property
+    def download_url(self) -> str:
+        return f"/api/download/{self.id}"
+
+    def to_dict(self) -> Dict:
+        return {
+            "file_id": self.id,
+            "download_url": self.download_url,
+            "filename": self.filename,
+            "size": self.size,
+            "cached": self.cached,
+        }
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    The inclusive (start, end) byte range of a single-range "bytes=..." Range header, or None to
+    send the whole file (no header, another unit, or several ranges). Raises ValueError when
+    the range lies outside the file, which is answered with 416.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_text, _, end_text = header[len("bytes="):].strip().partition("-")
+    try:
+        if start_text == "":
+            # Suffix range: the last N bytes
+            length = int(end_text)
+            if length <= 0:
+                raise ValueError(header)
+            return max(0, size - length), size - 1
+        start = int(start_text)
+        end = int(end_text) if end_text else size - 1
+    except ValueError:
+        raise ValueError(f"Malformed range: {header}")
+    if start >= size or start > end:
+        raise ValueError(f"Range not satisfiable: {header}")
+    return start, min(end, size - 1)
+
+
+def iter_file(path: str, start: int = 0, end: Optional[int] = None,
+              chunk_size: int = ARTIFACT_CHUNK_BYTES) -> Iterator[bytes]:
+    """Yields bytes start..end (inclusive) of path in chunks; the open handle survives an eviction."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = (end - start + 1) if end is not None else None
+        while remaining is None or remaining > 0:
+            chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+
+class ArtifactStore:
+    """
+    Exported PDF/DOCX files kept on disk under their content address.
+
+    Exporting text that was exported before (same format and renderer) returns the existing
+    file instead of rendering it again, and concurrent identical exports render once. A file's
+    mtime is its last use: a background sweeper deletes files unused for ARTIFACT_TTL and then
+    the least recently used ones until the store is under ARTIFACT_MAX_BYTES.
+    Downloads are looked up by id only, so clients can never name a path on the server.
+    """
+
+    def __init__(self, root: str = ARTIFACT_DIR, ttl: float = ARTIFACT_TTL,
+                 max_bytes: int = ARTIFACT_MAX_BYTES, sweep_interval: float = ARTIFACT_SWEEP_INTERVAL):
+        self.root = root
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._building: Dict[str, threading.Lock] = {}
+        self._sweeper: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.hits = 0
+        self.misses = 0
+        self.downloads = 0
+        self.expired = 0
+        self.evicted = 0
+        self.last_sweep: Optional[float] = None
+
+    def _path(self, key: str, filetype: str) -> str:
+        return os.path.join(self.root, key + EXTENSIONS[filetype])
+
+    def _find(self, key: str) -> Optional[str]:
+        for suffix in set(EXTENSIONS.values()):
+            path = os.path.join(self.root, key + suffix)
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def _touch(self, path: str) -> bool:
+        try:
+            os.utime(path)  # mark as recently used for the sweeper
+            return True
+        except OSError:
+            return False  # swept in the meantime
+
+    def export(self, text: str, filetype: str = "pdf", use_pandoc: bool = False) -> Artifact:
+        """Returns the stored export of text, rendering it first if this content was never exported."""
+        if filetype not in EXTENSIONS:
+            raise ValueError(f"Unsupported file type: choose 'pdf' or 'docx' (or 'word'). Got: {filetype}")
+        key = artifact_id(text, filetype, use_pandoc)
+        path = self._path(key, filetype)
+        with self._lock:
+            if os.path.isfile(path) and self._touch(path):
+                self.hits += 1
+                return Artifact(key, path, cached=True)
+            build_lock = self._building.setdefault(key, threading.Lock())
+
+        with build_lock:
+            # Another request may have rendered the same content while we waited
+            if os.path.isfile(path) and self._touch(path):
+                with self._lock:
+                    self.hits += 1
+                return Artifact(key, path, cached=True)
+            with self._lock:
+                self.misses += 1
+            # Render next to the final path and rename, so downloads never see a half-written file
+            tmp_path = f"{path}.{threading.get_ident()}.tmp{EXTENSIONS[filetype]}"
+            try:
+                with span("export_render", filetype=filetype, pandoc=use_pandoc):
+                    export_text(text, filetype, use_pandoc, filename=tmp_path)
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                with self._lock:
+                    self._building.pop(key, None)
+        return Artifact(key, path)
+
+    def export_stream(self, pieces: Iterable[str], filetype: str = "pdf", use_pandoc: bool = False) -> Artifact:
+        """
+        Exports text that arrives in pieces, such as LLM tokens. Plain PDFs are laid out while the
+        pieces arrive and filed under the hash of the full text at the end (an identical stored
+        file wins and the new one is dropped); other formats are exported once the text is complete.
+        """
+        if filetype != "pdf" or use_pandoc:
+            return self.export("".join(pieces), filetype, use_pandoc)
+        tmp_path = os.path.join(self.root, f"stream-{uuid.uuid4().hex}.tmp.pdf")
+        layout = PDFTextLayout(tmp_path)
+        parts = []
+        try:
+            for piece in pieces:
+                parts.append(piece)
+                layout.feed(piece)
+        except BaseException:
+            layout.abort()
+            os.unlink(tmp_path)
+            raise
+        try:
+            with span("export_render", filetype=filetype, streamed=True):
+                layout.close()
+            key = artifact_id("".join(parts), filetype, use_pandoc)
+            path = self._path(key, filetype)
+            with self._lock:
+                if os.path.isfile(path) and self._touch(path):
+                    self.hits += 1
+                    return Artifact(key, path, cached=True)
+                self.misses += 1
+                os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        return Artifact(key, path)
+
+    def get(self, key: str) -> Optional[Artifact]:
+        """The artifact with this id, or None if it never existed or was swept."""
+        if not ARTIFACT_ID_PATTERN.match(key):
+            return None
+        path = self._find(key)
+        if path is None or not self._touch(path):
+            return None
+        with self._lock:
+            self.downloads += 1
+        return Artifact(key, path, cached=True)
+
+    # ---- SWEEPER ----
+
+    def sweep(self) -> Dict[str, int]:
+        """Deletes expired files, then least recently used ones while over the size limit."""
+        now = time.time()
+        entries = []
+        expired = evicted = 0
+        for name in os.listdir(self.root):
+            full = os.path.join(self.root, name)
+            try:
+                stat = os.stat(full)
+            except OSError:
+                continue
+            if ".tmp" in name:
+                # Leftover of a render killed mid-write; live renders finish well within the TTL
+                if now - stat.st_mtime > self.ttl:
+                    self._unlink(full)
+                continue
+            if now - stat.st_mtime > self.ttl:
+                if self._unlink(full):
+                    expired += 1
+                continue
+            entries.append((stat.st_mtime, stat.st_size, full))
+        total = sum(size for _, size, _ in entries)
+        for _, size, full in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if self._unlink(full):
+                evicted += 1
+                total -= size
+        with self._lock:
+            self.expired += expired
+            self.evicted += evicted
+            self.last_sweep = now
+        if expired or evicted:
+            logger.info("Artifact store: swept %d expired and %d evicted file(s), %d bytes left", expired, evicted, total)
+        return {"expired": expired, "evicted": evicted, "bytes": total}
+
+    @staticmethod
+    def _unlink(path: str) -> bool:
+        try:
+            os.unlink(path)
+            return True
+        except OSError:
+            return False
+
+    def start_sweeper(self) -> None:
+        with self._lock:
+            if self._sweeper is not None:
+                return
+            self._stop.clear()
+            self._sweeper = threading.Thread(target=self._sweep_loop, name="artifact-sweeper", daemon=True)
+            self._sweeper.start()
+
+    def stop_sweeper(self) -> None:
+        self._stop.set()
+        with self._lock:
+            sweeper, self._sweeper = self._sweeper, None
+        if sweeper is not None:
+            sweeper.join(timeout=5.0)
+
+    def _sweep_loop(self) -> None:
+        while True:
+            try:
+                self.sweep()
+            except Exception as ex:
+                logger.exception("Artifact sweep failed: %s", ex)
+            if self._stop.wait(self.sweep_interval):
+                return
+
+    def stats(self) -> dict:
+        files = 0
+        total = 0
+        for name in os.listdir(self.root):
+            if ".tmp" in name:
+                continue
+            try:
+                total += os.path.getsize(os.path.join(self.root, name))
+                files += 1
+            except OSError:
+                continue
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "dir": self.root,
+                "files": files,
+                "bytes": total,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "downloads": self.downloads,
+                "expired": self.expired,
+                "evicted": self.evicted,
+                "rendering": len(self._building),
+                "last_sweep": self.last_sweep,
+            }
+
+
+_store: Optional[ArtifactStore] = None
+_store_lock = threading.Lock()
+
+
+def get_artifact_store() -> ArtifactStore:
+    """Returns the process-wide artifact store (the sweeper starts with ArtifactStore.start_sweeper())."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ArtifactStore()
+    return _store
@@ -0,0 +1,284 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from .embeddings import get_embedding_service
+from .providers import get_provider
+from .generation_cache import get_generation_cache
+from .prompts import get_token_accounting
+from .paper import iter_sectioned_paper, section_concurrency
+from .materialized import get_materialized_retrieval
+from .rag_pipeline import chapter_top_k, plan_cache_key, plan_retrieval, render_prompt, retrieve_chunks
+from .metrics import span
+
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+# LLM calls in flight per batch job (the global LLM_MAX_CONCURRENCY cap still applies on top)
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
+BATCH_JOB_TTL = float(os.getenv("BATCH_JOB_TTL", str(24 * 3600)))  # finished jobs stay pollable this long
+
+logger = logging.getLogger(__name__)
+
+
+class BatchItem:
+    """One generation spec of a batch job and its outcome."""
+
+    def __init__(self, position: int, request):
+        self.position = position
+        self.request = request
+        self.status = "queued"  # queued -> retrieved -> running -> done | error
+        self.cached = False
+        self.output: Optional[str] = None
+        self.error: Optional[str] = None
+        self.prompt = None  # BuiltPrompt
+        self.paper = None  # (plan, chunks) of a Grade 10 paper written section by section instead
+        self.cache_key: Optional[str] = None
+        self.finished_at: Optional[float] = None
+
+    def to_dict(self, include_output: bool = True) -> Dict[str, Any]:
+        item = {
+            "index": self.position,
+            "status": self.status,
+            "grade": self.request.grade,
+            "chapter": self.request.chapter,
+            "material_type": self.request.material_type,
+            "cached": self.cached,
+        }
+        if self.error is not None:
+            item["error"] = self.error
+        if include_output and self.output is not None:
+            item["output"] = self.output
+        return item
+
+
+class BatchJob:
+    """
+    A list of generation specs processed together: one retrieval pass for all of them,
+    then concurrent LLM calls. Finished items are recorded in completion order so the
+    results can be streamed while the job is still running.
+    """
+
+    def __init__(self, requests: List[Any], concurrency: int = BATCH_LLM_CONCURRENCY):
+        self.id = uuid.uuid4().hex
+        self.items = [BatchItem(i, r) for i, r in enumerate(requests)]
+        self.concurrency = max(1, concurrency)
+        self.status = "queued"  # queued -> retrieving -> generating -> done
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self._completed: List[int] = []
+        self._lock = threading.Lock()
+        self._free_slots = self.concurrency
+        self._slots = threading.Condition()
+
+    @property
+    def done(self) -> bool:
+        return self.status == "done"
+
+    @contextmanager
+    def llm_slots(self, count: int):
+        """
+        Holds `count` of the job's `concurrency` LLM slots: a sectioned paper has several section
+        calls in flight, so it is charged for all of them and the job stays within its budget.
+        """
+        count = max(1, min(count, self.concurrency))
+        with self._slots:
+            while self._free_slots < count:
+                self._slots.wait()
+            self._free_slots -= count
+        try:
+            yield count
+        finally:
+            with self._slots:
+                self._free_slots += count
+                self._slots.notify_all()
+
+    def finish_item(self, item: BatchItem, output: Optional[str] = None, error: Optional[str] = None) -> None:
+        with self._lock:
+            item.output = output
+            item.error = error
+            item.status = "error" if error is not None else "done"
+            item.finished_at = time.time()
+            self._completed.append(item.position)
+
+    def completed_since(self, cursor: int) -> Tuple[List[BatchItem], bool]:
+        """Items finished after the first `cursor` ones, and whether the whole job had finished."""
+        with self._lock:
+            return [self.items[i] for i in self._completed[cursor:]], self.done
+
+    def summary(self, include_items: bool = True, include_output: bool = True) -> Dict[str, Any]:
+        with self._lock:
+            counts: Dict[str, int] = {}
+            for item in self.items:
+                counts[item.status] = counts.get(item.status, 0) + 1
+            summary = {
+                "job_id": self.id,
+                "status": self.status,
+                "total": len(self.items),
+                "completed": len(self._completed),
+                "counts": counts,
+                "created_at": self.created_at,
+                "finished_at": self.finished_at,
+            }
+            if include_items:
+                summary["items"] = [item.to_dict(include_output) for item in self.items]
+        return summary
+
+
+def retrieve_batch(job: BatchJob) -> None:
+    """
+    Builds the prompt of every item in one pass: all queries are embedded in a single
+    encode call, and each distinct chapter index scores all the queries that need it
+    with one matrix product. Items served by the materialized lookup table are neither
+    embedded nor scored. Items whose chapters cannot be resolved fail individually.
+    """
+    plans = []
+    for item in job.items:
+        try:
+            plans.append((item, plan_retrieval(item.request)))
+        except Exception as ex:
+            job.finish_item(item, error=str(ex))
+    if not plans:
+        return
+
+    materialized = get_materialized_retrieval()
+    chapter_hits: List[Optional[List[Any]]] = [materialized.lookup(plan) for _, plan in plans]
+    live = [p for p, hits in enumerate(chapter_hits) if hits is None]
+    vec_rows = {p: j for j, p in enumerate(live)}  # plan position -> row of query_vecs
+    query_vecs = get_embedding_service().encode([plans[p][1].user_query for p in live]) if live else None
+
+    # (file, page ranges) -> (index, [(plan position, entry position, k)])
+    searches: Dict[tuple, Tuple[Any, List[Tuple[int, int, int]]]] = {}
+    for p in live:
+        plan = plans[p][1]
+        chapter_hits[p] = [None] * len(plan.chapter_indexes)
+        for e, (key, _, index) in enumerate(plan.chapter_indexes):
+            refs = searches.setdefault(key, (index, []))[1]
+            refs.append((p, e, chapter_top_k(plan, index)))
+    with span("score", batch=len(plans), indexes=len(searches)):
+        for index, refs in searches.values():
+            results = index.search_many(query_vecs[[vec_rows[p] for p, _, _ in refs]], [k for _, _, k in refs])
+            for (p, e, _), hits in zip(refs, results):
+                chapter_hits[p][e] = hits
+
+    for p, (item, plan) in enumerate(plans):
+        try:
+            hits = chapter_hits[p] if plan.scope == "chapter" else None
+            query_vec = query_vecs[vec_rows[p]] if p in vec_rows else None
+            chunks = retrieve_chunks(plan, query_vec, chapter_hits=hits)
+            if plan.sectioned:
+                item.paper = (plan, chunks)
+                item.cache_key = plan_cache_key(plan, [chunk_id for chunk in chunks for chunk_id in chunk.ids])
+            else:
+                with span("prompt_build"):
+                    item.prompt = render_prompt(plan, chunks)
+                item.cache_key = plan_cache_key(plan, item.prompt.chunk_ids)
+            item.status = "retrieved"
+        except Exception as ex:
+            job.finish_item(item, error=str(ex))
+
+
+def generate_item(job: BatchJob, item: BatchItem) -> None:
+    cache = get_generation_cache()
+    try:
+        if not getattr(item.request, "fresh", False):
+            cached = cache.get(item.cache_key)
+            if cached is not None:
+                item.cached = True
+                if item.prompt is not None:
+                    get_token_accounting().record(item.prompt, cached, cached=True, label=f"batch {job.id[:8]}#{item.position}")
+                job.finish_item(item, output=cached)
+                return
+        item.status = "running"
+        llm = get_provider(getattr(item.request, "provider", None))
+        with span("llm_call", provider=llm.name, batch=job.id[:8]):
+            if item.paper is not None:
+                plan, chunks = item.paper
+                with job.llm_slots(section_concurrency()) as slots:
+                    response = "".join(iter_sectioned_paper(plan.grade, plan.chapter_label, plan.difficulty, chunks,
+                                                            llm, concurrency=slots))
+            else:
+                with job.llm_slots(1):
+                    response = llm.complete(item.prompt.text)
+        if not response:
+            raise ValueError(f"{llm.name} returned an empty response. Please check the prompt and context.")
+        if item.prompt is not None:
+            get_token_accounting().record(item.prompt, response, label=f"batch {job.id[:8]}#{item.position}")
+        cache.set(item.cache_key, response)
+        job.finish_item(item, output=response)
+    except Exception as ex:
+        logger.warning("Batch %s item %d failed: %s", job.id, item.position, ex)
+        job.finish_item(item, error=str(ex))
+    finally:
+        item.prompt = item.paper = None  # prompts can be large; keep only the output around
+
+
+def run_batch(job: BatchJob) -> None:
+    try:
+        job.status = "retrieving"
+        start = time.perf_counter()
+        retrieve_batch(job)
+        pending = [item for item in job.items if item.status == "retrieved"]
+        logger.info("Batch %s: retrieval for %d items in %.2fs", job.id, len(job.items), time.perf_counter() - start)
+
+        job.status = "generating"
+        with ThreadPoolExecutor(max_workers=job.concurrency, thread_name_prefix=f"batch-{job.id[:8]}") as pool:
+            for item in pending:
+                pool.submit(generate_item, job, item)
+    except Exception as ex:
+        logger.exception("Batch %s failed: %s", job.id, ex)
+        for item in job.items:
+            if item.status not in ("done", "error"):
+                job.finish_item(item, error=f"Batch failed: {ex}")
+    finally:
+        job.finished_at = time.time()
+        job.status = "done"
+
+
+class BatchJobs:
+    """In-memory registry of batch jobs; each job runs on its own background thread."""
+
+    def __init__(self, ttl: float = BATCH_JOB_TTL):
+        self.ttl = ttl
+        self._jobs: Dict[str, BatchJob] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, requests: List[Any], concurrency: Optional[int] = None) -> BatchJob:
+        if not requests:
+            raise ValueError("A batch needs at least one item.")
+        if len(requests) > BATCH_MAX_ITEMS:
+            raise ValueError(f"A batch can have at most {BATCH_MAX_ITEMS} items (got {len(requests)}).")
+        concurrency = min(concurrency or BATCH_LLM_CONCURRENCY, BATCH_LLM_CONCURRENCY)
+        job = BatchJob(requests, concurrency)
+        with self._lock:
+            self._sweep()
+            self._jobs[job.id] = job
+        threading.Thread(target=run_batch, args=(job,), name=f"batch-{job.id[:8]}", daemon=True).start()
+        return job
+
+    def get(self, job_id: str) -> Optional[BatchJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _sweep(self) -> None:
+        # Caller must hold self._lock
+        cutoff = time.time() - self.ttl
+        for job_id in [j.id for j in self._jobs.values() if j.finished_at and j.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+
+_jobs: Optional[BatchJobs] = None
+_jobs_lock = threading.Lock()
+
+
+def get_batch_jobs() -> BatchJobs:
+    """Returns the process-wide batch job registry."""
+    global _jobs
+    if _jobs is None:
+        with _jobs_lock:
+            if _jobs is None:
+                _jobs = BatchJobs()
+    return _jobs
@@ -0,0 +1,227 @@
+import os
+import json
+import bisect
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from .vectorstore import VECTORSTORE_DIR, META_SUFFIX, LEGACY_SUFFIX, base_path, vectorstore_exists
+
+logger = logging.getLogger(__name__)
+
+# Hand-maintained list of chapters: grade, name, vectorstore file and (optionally) the page range
+# of the chapter inside that file, for files that hold more than one chapter
+CHAPTER_MANIFEST_PATH = os.getenv("CHAPTER_MANIFEST_PATH", os.path.join(VECTORSTORE_DIR, "chapters.json"))
+
+
+def normalize_chapter(text: str) -> str:
+    return text.strip().lower().replace("’", "'").replace("‘", "'").replace("–", "-").replace("—", "-")
+
+
+def grade_key(grade: str) -> str:
+    """'Grade 10' -> '10'."""
+    return ''.join(filter(str.isdigit, str(grade)))
+
+
+def _tokens(text: str) -> List[str]:
+    return [t for t in "".join(c if c.isalnum() or c == "'" else " " for c in text).split() if t]
+
+
+def _subject_for(rel_path: str) -> str:
+    top = rel_path.split("/", 1)[0]
+    if top == "evs":
+        return "EVS"
+    if top == "eng":
+        return "English Grammar"
+    return rel_path.split("/")[1] if top.startswith("Grade ") and "/" in rel_path else top
+
+
+def _grade_for(rel_path: str) -> str:
+    """Grade of a vectorstore from its place in the tree: 'evs/2/...', 'eng/1/...' or 'Grade 9/...'."""
+    top, _, rest = rel_path.partition("/")
+    if top.startswith("Grade "):
+        return grade_key(top)
+    return grade_key(rest.split("/", 1)[0])
+
+
+class Chapter:
+    """One catalog entry: where a chapter's vectors live and which pages of the file belong to it."""
+
+    def __init__(self, grade: str, name: str, file: str, pages: Optional[Tuple[int, int]] = None,
+                 subject: Optional[str] = None, book: Optional[str] = None):
+        self.grade = grade
+        self.name = normalize_chapter(name)
+        self.file = file
+        self.pages = tuple(pages) if pages else None
+        self.subject = subject or _subject_for(file)
+        self.book = book
+
+    @property
+    def path(self) -> str:
+        return os.path.join(VECTORSTORE_DIR, self.file)
+
+    @property
+    def title(self) -> str:
+        """Name without the 'book: ' prefix used by the English readers."""
+        if self.book and self.name.startswith(self.book + ": "):
+            return self.name[len(self.book) + 2:]
+        return self.name
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "grade": self.grade,
+            "name": self.name,
+            "title": self.title,
+            "subject": self.subject,
+            "book": self.book,
+            "file": self.file,
+            "pages": list(self.pages) if self.pages else None,
+        }
+
+
+class ChapterCatalog:
+    """
+    Chapter -> vectorstore lookup, built once from the manifest and the vectorstore tree.
+
+    Lookups try, in order: the exact normalized name, the title without its book prefix,
+    a substring of a catalog name (the old CHAPTER_FILE_MAP fallback) and finally names that
+    contain every query word as a word prefix. The last two go through a per-grade sorted
+    token list, so only names sharing a word with the query are looked at.
+    """
+
+    def __init__(self, chapters: List[Chapter]):
+        self.chapters: List[Chapter] = []
+        self._exact: Dict[str, Dict[str, Chapter]] = {}
+        self._titles: Dict[str, Dict[str, Chapter]] = {}
+        self._postings: Dict[str, Dict[str, List[int]]] = {}  # grade -> token -> chapter positions
+        self._sorted_tokens: Dict[str, List[str]] = {}
+        for chapter in chapters:
+            self._add(chapter)
+        for grade, postings in self._postings.items():
+            self._sorted_tokens[grade] = sorted(postings)
+
+    def _add(self, chapter: Chapter) -> None:
+        exact = self._exact.setdefault(chapter.grade, {})
+        if chapter.name in exact:
+            return
+        position = len(self.chapters)
+        self.chapters.append(chapter)
+        exact[chapter.name] = chapter
+        self._titles.setdefault(chapter.grade, {}).setdefault(chapter.title, chapter)
+        postings = self._postings.setdefault(chapter.grade, {})
+        for token in set(_tokens(chapter.name)):
+            postings.setdefault(token, []).append(position)
+
+    def __len__(self) -> int:
+        return len(self.chapters)
+
+    def grades(self) -> List[str]:
+        return sorted(self._exact, key=lambda g: int(g) if g.isdigit() else 0)
+
+    def list_chapters(self, grade: Optional[str] = None) -> List[Chapter]:
+        """Chapters of one grade (all grades if None), in manifest order."""
+        if grade is None:
+            return list(self.chapters)
+        return list(self._exact.get(grade_key(grade), {}).values())
+
+    def _prefix_matches(self, grade: str, word: str) -> set:
+        tokens = self._sorted_tokens.get(grade, [])
+        postings = self._postings.get(grade, {})
+        matches = set()
+        i = bisect.bisect_left(tokens, word)
+        while i < len(tokens) and tokens[i].startswith(word):
+            matches.update(postings[tokens[i]])
+            i += 1
+        return matches
+
+    def resolve(self, grade: str, chapter: str) -> Chapter:
+        """Returns the catalog entry for a requested chapter or raises ValueError."""
+        grade = grade_key(grade)
+        key = normalize_chapter(chapter)
+        found = self._exact.get(grade, {}).get(key) or self._titles.get(grade, {}).get(key)
+        if found is not None:
+            return found
+
+        words = _tokens(key)
+        if words:
+            candidates = None
+            for word in words:
+                matches = self._prefix_matches(grade, word)
+                candidates = matches if candidates is None else candidates & matches
+                if not candidates:
+                    break
+            if candidates:
+                ordered = [self.chapters[i] for i in sorted(candidates)]
+                for entry in ordered:
+                    if key in entry.name:
+                        return entry
+                return min(ordered, key=lambda c: len(c.name))
+        raise ValueError(f"Cannot match chapter name to any vectorstore file: {chapter}")
+
+    def stats(self) -> dict:
+        files = {c.file for c in self.chapters}
+        return {
+            "chapters": len(self.chapters),
+            "files": len(files),
+            "shared_files": sum(1 for f in files if sum(c.file == f for c in self.chapters) > 1),
+            "grades": self.grades(),
+        }
+
+
+def _tree_files(root_dir: str) -> List[str]:
+    """Relative '<name>_vectors.json' paths of every vectorstore (binary or legacy JSON) under root_dir."""
+    found = set()
+    for dirpath, _, filenames in os.walk(root_dir):
+        for name in filenames:
+            if not (name.endswith("_vectors" + META_SUFFIX) or name.endswith("_vectors" + LEGACY_SUFFIX)):
+                continue
+            rel = os.path.relpath(os.path.join(dirpath, name), root_dir).replace(os.sep, "/")
+            found.add(base_path(rel) + LEGACY_SUFFIX)
+    return sorted(found)
+
+
+def build_catalog(manifest_path: str = CHAPTER_MANIFEST_PATH, root_dir: str = VECTORSTORE_DIR) -> ChapterCatalog:
+    """
+    Manifest entries whose vectorstore exists, plus every vectorstore in the tree that the
+    manifest does not mention (listed under its file name so it can still be requested).
+    """
+    chapters = []
+    listed = set()
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        for item in manifest.get("chapters", []):
+            rel = item["file"]
+            if not vectorstore_exists(os.path.join(root_dir, rel)):
+                logger.warning("Chapter catalog: skipping '%s' (grade %s), missing %s", item["name"], item["grade"], rel)
+                continue
+            chapters.append(Chapter(grade_key(item["grade"]), item["name"], rel, item.get("pages"),
+                                    item.get("subject"), item.get("book")))
+            listed.add(base_path(rel))
+    else:
+        logger.warning("Chapter manifest not found: %s", manifest_path)
+
+    for rel in _tree_files(root_dir):
+        if base_path(rel) in listed:
+            continue
+        name = os.path.basename(base_path(rel))
+        if name.endswith("_vectors"):
+            name = name[:-len("_vectors")]
+        chapters.append(Chapter(_grade_for(rel), name, rel))
+
+    return ChapterCatalog(chapters)
+
+
+_catalog: Optional[ChapterCatalog] = None
+_catalog_lock = threading.Lock()
+
+
+def get_chapter_catalog() -> ChapterCatalog:
+    """Returns the process-wide chapter catalog, building it on first use."""
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = build_catalog()
+                logger.info("Chapter catalog: %d chapters", len(_catalog))
+    return _catalog
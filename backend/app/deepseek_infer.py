@@ -1,16 +1,19 @@
 import os
+import json
+import logging
+from typing import Iterator
 from dotenv import load_dotenv
 load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))  # Ensure .env is loaded
-import requests
+from . import llm_client
 
-DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"
+logger = logging.getLogger(__name__)
+
+# Overridable so the client can be pointed at a local stub server
+DEEPSEEK_API_URL = os.getenv("DEEPSEEK_API_URL", "https://api.deepseek.com/v1/chat/completions")
 MODEL_NAME = "deepseek-reasoner"  # or "deepseek-chat" according to your purchase
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")  # <--- FIXED HERE
 
-def ask_deepseek(prompt: str, system_prompt: str = None, stream: bool = False, max_tokens: int = 2048, **kwargs) -> str:
-    """
-    Sends a prompt to the DeepSeek cloud API and returns the response.
-    """
+def _build_request(prompt: str, system_prompt: str, stream: bool, max_tokens: int, **kwargs):
     if not DEEPSEEK_API_KEY:
         raise ValueError("DeepSeek API key not set in environment variable DEEPSEEK_API_KEY.")
 
@@ -31,23 +34,57 @@ def ask_deepseek(prompt: str, system_prompt: str = None, stream: bool = False, m
         "stream": stream,
     }
     payload.update(kwargs)
+    return headers, payload
+
+def parse_sse_line(line) -> str:
+    """
+    Returns the content delta carried by one server-sent-events line of a streamed completion.
+    Blank lines, keep-alive comments, "data: [DONE]" and reasoning-only chunks give "".
+    """
+    if isinstance(line, bytes):
+        line = line.decode("utf-8")
+    line = line.strip()
+    if not line.startswith("data:"):
+        return ""
+    data = line[len("data:"):].strip()
+    if not data or data == "[DONE]":
+        return ""
+    chunk = json.loads(data)
+    choices = chunk.get("choices") or []
+    if not choices:
+        return ""
+    return (choices[0].get("delta") or {}).get("content") or ""
 
-    response = requests.post(DEEPSEEK_API_URL, headers=headers, json=payload, stream=stream)
-    if not response.ok:
-        raise RuntimeError(f"DeepSeek API response code: {response.status_code} {response.text}")
+def is_sse_done(line) -> bool:
+    if isinstance(line, bytes):
+        line = line.decode("utf-8")
+    return line.strip() == "data: [DONE]"
 
+def stream_deepseek(prompt: str, system_prompt: str = None, max_tokens: int = 2048, **kwargs) -> Iterator[str]:
+    """
+    Sends a prompt to the DeepSeek cloud API with streaming enabled and yields
+    content deltas as they arrive.
+    """
+    headers, payload = _build_request(prompt, system_prompt, True, max_tokens, **kwargs)
+    for line in llm_client.stream_lines(DEEPSEEK_API_URL, payload, headers):
+        if is_sse_done(line):
+            break
+        delta = parse_sse_line(line)
+        if delta:
+            yield delta
+
+def ask_deepseek(prompt: str, system_prompt: str = None, stream: bool = False, max_tokens: int = 2048, **kwargs) -> str:
+    """
+    Sends a prompt to the DeepSeek cloud API and returns the response.
+    With stream=True the response is read incrementally (see stream_deepseek) and joined.
+    """
     if stream:
-        output = ""
-        for line in response.iter_lines():
-            if line:
-                try:
-                    data = line.decode('utf-8')
-                    import json
-                    chunk = json.loads(data)
-                    output += chunk["choices"][0]["delta"].get("content", "")
-                except Exception:
-                    continue
-        return output
-    else:
-        data = response.json()
-        return data["choices"][0]["message"]["content"]
\ No newline at end of file
+        return "".join(stream_deepseek(prompt, system_prompt=system_prompt, max_tokens=max_tokens, **kwargs))
+
+    headers, payload = _build_request(prompt, system_prompt, False, max_tokens, **kwargs)
+    data = llm_client.post_json(DEEPSEEK_API_URL, payload, headers)
+    usage = data.get("usage")
+    if usage:
+        # Billed counts, to compare against the local estimates logged by the prompt builder
+        logger.info("DeepSeek usage: prompt=%s completion=%s", usage.get("prompt_tokens"), usage.get("completion_tokens"))
+    return data["choices"][0]["message"]["content"]
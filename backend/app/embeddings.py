@@ -0,0 +1,161 @@
+import os
+import threading
+import time
+from typing import List, Optional, Union
+
+import numpy as np
+
+from .metrics import span
+
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+# How long the batcher waits for more encode calls to arrive before running a forward pass,
+# and the most texts it will put into one pass.
+BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "5"))
+MAX_BATCH_SIZE = int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", "64"))
+
+
+class _PendingEncode:
+    """One caller's encode request waiting in the batch queue."""
+
+    __slots__ = ("texts", "done", "result", "error")
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.done = threading.Event()
+        self.result: Optional[np.ndarray] = None
+        self.error: Optional[BaseException] = None
+
+
+class EmbeddingService:
+    """
+    Process-wide wrapper around the SentenceTransformer model.
+    The model is loaded once (at startup or on first use) and encode calls that arrive
+    close together from concurrent requests are coalesced into a single forward pass.
+    """
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL, batch_window_ms: float = BATCH_WINDOW_MS,
+                 max_batch_size: int = MAX_BATCH_SIZE):
+        self.model_name = model_name
+        self.batch_window = batch_window_ms / 1000.0
+        self.max_batch_size = max(1, max_batch_size)
+        self._model = None
+        self._load_lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._pending: List[_PendingEncode] = []
+        self._worker: Optional[threading.Thread] = None
+
+    @property
+    def is_warm(self) -> bool:
+        return self._model is not None
+
+    def load(self):
+        """Loads the model if it is not loaded yet. Safe to call from many threads."""
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    # Imported here: sentence_transformers pulls in torch, which would
+                    # otherwise add seconds to every import of the app
+                    from sentence_transformers import SentenceTransformer
+                    with span("model_load", model=self.model_name):
+                        self._model = SentenceTransformer(self.model_name)
+        return self._model
+
+    def warm_in_background(self) -> threading.Thread:
+        """Starts loading the model on a daemon thread so app startup isn't blocked."""
+        thread = threading.Thread(target=self.load, name="embedding-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def encode(self, texts: Union[str, List[str]]) -> np.ndarray:
+        """
+        Encodes one text or a list of texts and returns a float32 array of shape (n, dim).
+        Blocks until the batch containing these texts has been run.
+        """
+        if isinstance(texts, str):
+            texts = [texts]
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        self.load()
+        pending = _PendingEncode(list(texts))
+        with span("encode", texts=len(texts)):
+            with self._cond:
+                self._ensure_worker()
+                self._pending.append(pending)
+                self._cond.notify()
+            pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def stats(self) -> dict:
+        with self._cond:
+            queued = len(self._pending)
+        return {
+            "model": self.model_name,
+            "warm": self.is_warm,
+            "queued_requests": queued,
+            "batch_window_ms": self.batch_window * 1000.0,
+            "max_batch_size": self.max_batch_size,
+        }
+
+    # ---- BATCHING WORKER ----
+
+    def _ensure_worker(self) -> None:
+        # Caller must hold self._cond
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+            self._worker.start()
+
+    def _take_batch(self) -> List[_PendingEncode]:
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            # Give close-together callers a chance to join this forward pass
+            deadline = time.monotonic() + self.batch_window
+            while self._queued_texts() < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(timeout=remaining)
+            batch, size = [], 0
+            while self._pending and (not batch or size + len(self._pending[0].texts) <= self.max_batch_size):
+                item = self._pending.pop(0)
+                batch.append(item)
+                size += len(item.texts)
+            return batch
+
+    def _queued_texts(self) -> int:
+        return sum(len(p.texts) for p in self._pending)
+
+    def _run(self) -> None:
+        while True:
+            batch = self._take_batch()
+            texts = [t for item in batch for t in item.texts]
+            try:
+                vectors = np.asarray(self._model.encode(texts, convert_to_numpy=True), dtype=np.float32)
+                start = 0
+                for item in batch:
+                    item.result = vectors[start:start + len(item.texts)]
+                    start += len(item.texts)
+            except Exception as excep:
+                for item in batch:
+                    item.error = excep
+            finally:
+                for item in batch:
+                    item.done.set()
+
+
+_service: Optional[EmbeddingService] = None
+_service_lock = threading.Lock()
+
+
+def get_embedding_service() -> EmbeddingService:
+    """Returns the process-wide embedding service, creating it on first use."""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = EmbeddingService()
+    return _service
@@ -1,131 +1,273 @@
 import tempfile
 import os
+import zlib
 import subprocess
-from docx import Document
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
+from functools import lru_cache
+from typing import List, Optional
+
+# A4 in points, computed as in reportlab.lib.pagesizes. python-docx and reportlab are only
+# imported by the functions that use them, so importing the app loads neither
+_CM = 72.0 / 2.54
+A4 = (21 * _CM, 29.7 * _CM)
 
 def export_to_docx(text: str, filename: str) -> str:
     """
     Exports the given text to a word (.docx) file (plain text, for non-math subjects).
     Returns the path to the saved file.
     """
+    from docx import Document
     doc = Document()
     for para in text.split('\n'):
         doc.add_paragraph(para)
     doc.save(filename)
     return filename
 
-def export_to_pdf(text: str, filename: str) -> str:
+# ---- PDF LAYOUT ----
+# Plain-text PDFs use the standard Helvetica font, so glyph widths come from the built-in
+# AFM metrics and pages can be written out one at a time instead of building the whole document.
+PDF_FONT = "Helvetica"
+PDF_FONT_SIZE = 12
+PDF_MARGIN = 40
+PDF_LINE_HEIGHT = 14
+
+@lru_cache(maxsize=4096)
+def _glyph_width(char: str, font: str, size: float) -> float:
+    from reportlab.pdfbase import pdfmetrics
+    return pdfmetrics.stringWidth(char, font, size)
+
+def text_width(text: str, font: str = PDF_FONT, size: float = PDF_FONT_SIZE) -> float:
+    """Width of text in points, summed from cached per-glyph widths."""
+    return sum(_glyph_width(ch, font, size) for ch in text)
+
+def _pdf_safe(text: str) -> str:
+    """Replaces characters the WinAnsi-encoded standard fonts cannot show."""
+    return text.encode("cp1252", errors="replace").decode("cp1252")
+
+def wrap_line(line: str, max_width: float, font: str = PDF_FONT, size: float = PDF_FONT_SIZE) -> List[str]:
+    """
+    Greedy line breaking: every word is measured once and words are added to the current
+    line while they fit. Words wider than a whole line are broken between characters.
+    """
+    space = _glyph_width(" ", font, size)
+    lines: List[str] = []
+    current: List[str] = []
+    current_width = 0.0
+    for word in line.split(" "):
+        if not current and not word and lines:
+            continue  # drop the spaces a wrap leaves at the start of the next line
+        width = text_width(word, font, size)
+        if current and current_width + space + width <= max_width:
+            current.append(word)
+            current_width += space + width
+            continue
+        if current:
+            lines.append(" ".join(current))
+            current = []
+            if not word:
+                continue
+        # The word starts a new line; break it between characters while it is wider than a line
+        while width > max_width:
+            cut, cut_width = 0, 0.0
+            for ch in word:
+                ch_width = _glyph_width(ch, font, size)
+                if cut and cut_width + ch_width > max_width:
+                    break
+                cut += 1
+                cut_width += ch_width
+            lines.append(word[:cut])
+            word = word[cut:]
+            width = text_width(word, font, size)
+        current, current_width = [word], width
+    lines.append(" ".join(current))
+    return lines
+
+class PDFStreamWriter:
+    """
+    Minimal PDF writer for plain text: each page is compressed and written to the output as
+    soon as it is finished, so memory stays at one page regardless of document length.
+    `out` is a file path or a binary file-like object (only write() is needed).
+    """
+
+    def __init__(self, out, pagesize=A4, font: str = PDF_FONT, size: float = PDF_FONT_SIZE):
+        self._own_file = isinstance(out, (str, os.PathLike))
+        self._out = open(out, "wb") if self._own_file else out
+        self.width, self.height = pagesize
+        self.font = font
+        self.size = size
+        self._offsets = {}  # object number -> byte offset
+        self._written = 0
+        self._page_ids: List[int] = []
+        self._next_id = 4  # 1 catalog, 2 page tree, 3 font
+        self._ops: List[bytes] = []
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        self._object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        self._object(3, f"<< /Type /Font /Subtype /Type1 /BaseFont /{font} /Encoding /WinAnsiEncoding >>".encode())
+
+    @property
+    def page_count(self) -> int:
+        return len(self._page_ids)
+
+    def _write(self, data: bytes) -> None:
+        self._out.write(data)
+        self._written += len(data)
+
+    def _object(self, number: int, body: bytes) -> None:
+        self._offsets[number] = self._written
+        self._write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+
+    def draw_line(self, x: float, y: float, text: str) -> None:
+        escaped = text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+        self._ops.append(b"1 0 0 1 %.2f %.2f Tm (" % (x, y) + escaped.encode("cp1252", errors="replace") + b") Tj")
+
+    def end_page(self) -> None:
+        content = zlib.compress(b"BT /F1 %g Tf\n" % self.size + b"\n".join(self._ops) + b"\nET")
+        self._ops = []
+        stream_id, page_id = self._next_id, self._next_id + 1
+        self._next_id += 2
+        self._object(stream_id, b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(content)
+                     + content + b"\nendstream")
+        self._object(page_id, (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {self.width:.2f} {self.height:.2f}] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {stream_id} 0 R >>"
+        ).encode())
+        self._page_ids.append(page_id)
+
+    def close(self) -> None:
+        if self._ops or not self._page_ids:
+            self.end_page()
+        kids = " ".join(f"{i} 0 R" for i in self._page_ids)
+        self._object(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(self._page_ids)} >>".encode())
+        xref_offset = self._written
+        size = self._next_id
+        xref = [b"xref\n0 %d\n" % size, b"0000000000 65535 f \n"]
+        xref.extend(b"%010d 00000 n \n" % self._offsets[i] for i in range(1, size))
+        self._write(b"".join(xref))
+        self._write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (size, xref_offset))
+        if self._own_file:
+            self._out.close()
+        else:
+            self._out.flush()
+
+    def abort(self) -> None:
+        if self._own_file:
+            self._out.close()
+
+class PDFTextLayout:
+    """
+    Lays out plain text on A4 pages as it arrives: feed() takes pieces of text (such as LLM
+    tokens) and every paragraph is laid out once the blank line ending it has been received,
+    so the PDF is mostly written by the time the last piece comes in.
+    Same layout as before: 40 pt margins, 14 pt lines, an empty line between paragraphs.
+    """
+
+    def __init__(self, out):
+        self.writer = PDFStreamWriter(out)
+        width, height = A4
+        self.max_width = width - 2 * PDF_MARGIN
+        self.top = height - PDF_MARGIN
+        self.y = self.top
+        self._pending = ""
+
+    def feed(self, text: str) -> None:
+        self._pending += text
+        while '\n\n' in self._pending:
+            para, self._pending = self._pending.split('\n\n', 1)
+            self._paragraph(para)
+
+    def _paragraph(self, para: str) -> None:
+        for line in _pdf_safe(para).split('\n'):
+            for l in wrap_line(line, self.max_width):
+                if self.y < PDF_MARGIN + PDF_LINE_HEIGHT:
+                    self.writer.end_page()
+                    self.y = self.top
+                self.writer.draw_line(PDF_MARGIN, self.y, l)
+                self.y -= PDF_LINE_HEIGHT
+        self.y -= PDF_LINE_HEIGHT  # EXTRA SPACING BETWEEN PARAGRAPHS
+
+    def close(self) -> int:
+        """Lays out the last paragraph, finishes the file and returns the number of pages."""
+        self._paragraph(self._pending)
+        self._pending = ""
+        self.writer.close()
+        return self.writer.page_count
+
+    def abort(self) -> None:
+        """Stops without finishing the document (the text source failed); closes a file opened by path."""
+        self.writer.abort()
+
+def render_pdf(text: str, out) -> int:
+    """
+    Lays out plain text on A4 pages and writes them to `out` (path or binary stream) as they fill.
+    Returns the number of pages.
+    """
+    layout = PDFTextLayout(out)
+    layout.feed(text)
+    return layout.close()
+
+def export_to_pdf(text: str, filename) -> str:
     """
     Exports the given text to a PDF file (plain text, for non-math subjects).
+    `filename` may also be a binary stream, which receives the pages as they are laid out.
     Returns the path to the saved file.
     """
-    c = canvas.Canvas(filename, pagesize=A4)
-    width, height = A4
-    margin = 40
-    x = margin
-    y = height - margin
-    line_height = 14
-
-    # SIMPLE WORD WRAPPING AND NEWLINES
-    for para in text.split('\n\n'):
-        for line in para.split('\n'):
-            lines = []
-            while len(line) > 0:
-                if c.stringWidth(line) < (width - 2 * margin):
-                    lines.append(line)
-                    line = ""
-                else:
-                    # FINDING THE APPROXIMATE WRAPPING POSITION
-                    wrap_pos = min(len(line), int((width - 2 * margin) / 7))
-                    # ATTEMPT TO WRAP AT THE LAST SPACE BEFORE wrap_pos
-                    space_pos = line.rfind(' ', 0, wrap_pos)
-                    if space_pos == -1:
-                        space_pos = wrap_pos
-                    lines.append(line[:space_pos])
-                    line = line[space_pos:].lstrip()
-
-            for l in lines:
-                if y < margin + line_height:
-                    c.showPage()
-                    y = height - margin
-                c.drawString(x, y, l)  
-                y -= line_height
-        y -= line_height  # EXTRA SPACING BETWEEN PARAGRAPHS
-
-    c.save()
+    render_pdf(text, filename)
     return filename
 
-def export_with_pandoc(text: str, filename: str, filetype: str) -> str:
+# ---- PANDOC ----
+PANDOC_PATH = os.getenv("PANDOC_PATH", "pandoc")
+PANDOC_PDF_ENGINE = os.getenv("PANDOC_PDF_ENGINE", "xelatex")
+PANDOC_TIMEOUT = float(os.getenv("PANDOC_TIMEOUT", "120"))
+
+def export_with_pandoc(text: str, filename: str, filetype: str, template: Optional[str] = None) -> str:
     """
     Uses Pandoc to export Markdown (with LaTeX math) to PDF or DOCX (for math/science subjects).
+    `template` is a LaTeX template for PDFs or a reference .docx for Word files.
     Returns the path to the saved file.
     """
-    # Write the text to a temporary markdown file
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".md", mode="w", encoding="utf-8") as temp_md:
-        # If the text does not use $...$ or $$...$$ for math, but uses \(...\) or \[...\], convert:
-        # (Uncomment below if you want auto-conversion, otherwise expect $...$ input)
-        # import re
-        # text = re.sub(r'\\\((.*?)\\\)', r'$\1$', text)
-        # text = re.sub(r'\\\[(.*?)\\\]', r'$$\1$$', text)
-        temp_md.write(text)
-        temp_md.flush()
-        md_path = temp_md.name
-
+    # Expects math as $...$ / $$...$$; \(...\) and \[...\] are not converted
     # Determine output extension and Pandoc format
     if filetype == "pdf":
         out_ext = ".pdf"
-        pandoc_args = ["pandoc", md_path, "-o", filename, "--pdf-engine=xelatex"]
+        extra_args = [f"--pdf-engine={PANDOC_PDF_ENGINE}"] + ([f"--template={template}"] if template else [])
     elif filetype in ("docx", "word"):
         out_ext = ".docx"
-        pandoc_args = ["pandoc", md_path, "-o", filename]
+        extra_args = [f"--reference-doc={template}"] if template else []
     else:
-        os.unlink(md_path)
         raise ValueError(f"Unsupported file type: choose 'pdf' or 'docx' (or 'word'). Got: {filetype}")
 
     # Make sure filename has the correct extension
     if not filename.endswith(out_ext):
         filename += out_ext
 
-    # Run Pandoc
+    # Run Pandoc, feeding the markdown on stdin
+    pandoc_args = [PANDOC_PATH, "--from=markdown", "-o", filename] + extra_args
     try:
-        subprocess.run(pandoc_args, check=True)
+        subprocess.run(pandoc_args, input=text.encode("utf-8"), check=True, capture_output=True,
+                       timeout=PANDOC_TIMEOUT)
     except subprocess.CalledProcessError as e:
-        os.unlink(md_path)
-        raise RuntimeError(f"Pandoc failed: {e}")
-
-    # Clean up the temporary markdown file
-    os.unlink(md_path)
+        raise RuntimeError(f"Pandoc failed: {e.stderr.decode('utf-8', errors='replace').strip() or e}")
+    except subprocess.TimeoutExpired:
+        raise RuntimeError(f"Pandoc timed out after {PANDOC_TIMEOUT:.0f}s")
     return filename
 
-def export_text(text: str, filetype: str = "pdf", use_pandoc: bool = False) -> str:
+def export_text(text: str, filetype: str = "pdf", use_pandoc: bool = False, filename: Optional[str] = None) -> str:
     """
     Exports text to either a PDF or Word File.
-    - If use_pandoc is True, uses Pandoc (for math subjects).
+    - If use_pandoc is True, renders through the Pandoc service (for math subjects), which falls
+      back to the plain export when pandoc is not installed.
     - If use_pandoc is False, uses plain export (for non-math subjects).
-    Returns the path to the saved file.
+    Writes to filename when given (the artifact store passes its own path), otherwise to a new
+    temporary file that the caller must delete. Returns the path to the saved file.
     """
-    # -- AUTO-CONVERT \(...\) to $...$ and \[...\] to $$...$$ for Pandoc if needed --
-    # For best results, your frontend should send math as $...$ and $$...$$ for block/inline math.
-    # If you want auto-conversion, uncomment below:
-    # import re
-    # if use_pandoc:
-    #     text = re.sub(r'\\\((.*?)\\\)', r'$\1$', text)
-    #     text = re.sub(r'\\\[(.*?)\\\]', r'$$\1$$', text)
-
     if use_pandoc:
-        suffix = ".pdf" if filetype == "pdf" else ".docx"
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
-            filename = temp_file.name
-        return export_with_pandoc(text, filename, filetype)
-    else:
+        # Imported here because the render service itself builds on the exporters above
+        from .render import get_render_service
+        return get_render_service().export(text, filetype, filename)
+    if filetype not in ("pdf", "docx", "word"):
+        raise ValueError(f"Unsupported file type: choose 'pdf' or 'docx' (or 'word'). Got: {filetype}")
+    if filename is None:
         with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{filetype}') as temp_file:
             filename = temp_file.name
-        if filetype == "pdf":
-            return export_to_pdf(text, filename)
-        elif filetype == "docx" or filetype == "word":
-            return export_to_docx(text, filename)
-        else:
-            os.unlink(filename)  # CLEANING UP THE TEMP FILE OF UNSUPPORTED TYPE
-            raise ValueError(f"Unsupported file type: choose 'pdf' or 'docx' (or 'word'). Got: {filetype}")
\ No newline at end of file
+    if filetype == "pdf":
+        return export_to_pdf(text, filename)
+    return export_to_docx(text, filename)
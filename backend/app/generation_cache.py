@@ -0,0 +1,209 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+BASE_DIR = os.path.dirname(os.path.dirname(__file__))  # backend/
+
+# "memory", "sqlite", "tiered" (memory in front of sqlite) or "none"
+GENERATION_CACHE_BACKEND = os.getenv("GENERATION_CACHE_BACKEND", "memory").strip().lower()
+GENERATION_CACHE_TTL = float(os.getenv("GENERATION_CACHE_TTL", str(7 * 24 * 3600)))
+GENERATION_CACHE_MAX_ENTRIES = int(os.getenv("GENERATION_CACHE_MAX_ENTRIES", "512"))
+GENERATION_CACHE_PATH = os.getenv("GENERATION_CACHE_PATH", os.path.join(BASE_DIR, "cache", "generations.sqlite3"))
+
+
+def make_cache_key(request_fields: Dict[str, Any], chunk_ids: List[str], template_version: str) -> str:
+    """
+    Content address of one generation: the normalized request, the IDs of the retrieved
+    chunks and the prompt template version. Any change to one of them is a different key.
+    """
+    material = json.dumps(
+        {"request": request_fields, "chunks": list(chunk_ids), "template": template_version},
+        sort_keys=True, ensure_ascii=False, separators=(",", ":"),
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class MemoryBackend:
+    """In-process LRU with per-entry expiry."""
+
+    def __init__(self, max_entries: int = GENERATION_CACHE_MAX_ENTRIES):
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, ttl: float) -> None:
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteBackend:
+    """On-disk store that survives restarts and is shared by every worker on the box."""
+
+    def __init__(self, path: str = GENERATION_CACHE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS generations ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, expires REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self.get_with_expiry(key)
+        return entry[0] if entry is not None else None
+
+    def get_with_expiry(self, key: str) -> Optional[Tuple[str, float]]:
+        """(value, expiry timestamp) of a live entry, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires FROM generations WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] <= time.time():
+                self._conn.execute("DELETE FROM generations WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            return row[0], row[1]
+
+    def set(self, key: str, value: str, ttl: float) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO generations (key, value, created, expires) VALUES (?, ?, ?, ?)",
+                (key, value, now, now + ttl),
+            )
+            self._conn.execute("DELETE FROM generations WHERE expires <= ?", (now,))
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM generations").fetchone()[0]
+
+
+class TieredBackend:
+    """Memory LRU in front of SQLite; disk hits are promoted into memory."""
+
+    def __init__(self, memory: MemoryBackend, disk: SQLiteBackend):
+        self.memory = memory
+        self.disk = disk
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.memory.get(key)
+        if value is None:
+            entry = self.disk.get_with_expiry(key)
+            if entry is None:
+                return None
+            # Promoted for the rest of the entry's lifetime on disk, not a fresh TTL
+            value, expires = entry
+            self.memory.set(key, value, expires - time.time())
+        return value
+
+    def set(self, key: str, value: str, ttl: float) -> None:
+        self.memory.set(key, value, ttl)
+        self.disk.set(key, value, ttl)
+
+    def __len__(self) -> int:
+        return len(self.disk)
+
+
+class GenerationCache:
+    """Front end over a backend that also keeps hit/miss counters."""
+
+    def __init__(self, backend=None, ttl: float = GENERATION_CACHE_TTL, backend_name: str = "memory"):
+        self.backend = backend
+        self.backend_name = backend_name if backend is not None else "none"
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    def get(self, key: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, value: str) -> None:
+        if not self.enabled or not value:
+            return
+        self.backend.set(key, value, self.ttl)
+        with self._lock:
+            self.stores += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "backend": self.backend_name,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+        if self.enabled:
+            stats["entries"] = len(self.backend)
+        return stats
+
+
+def create_backend(name: str = GENERATION_CACHE_BACKEND):
+    if name == "none":
+        return None
+    if name == "memory":
+        return MemoryBackend()
+    if name == "sqlite":
+        return SQLiteBackend()
+    if name == "tiered":
+        return TieredBackend(MemoryBackend(), SQLiteBackend())
+    raise ValueError(f"Unknown GENERATION_CACHE_BACKEND: {name} (choose memory, sqlite, tiered or none)")
+
+
+_cache: Optional[GenerationCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_generation_cache() -> GenerationCache:
+    """Returns the process-wide generation cache, configured from the environment."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = GenerationCache(create_backend(), backend_name=GENERATION_CACHE_BACKEND)
+    return _cache
@@ -0,0 +1,289 @@
+import os
+import json
+import time
+import uuid
+import logging
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+BASE_DIR = os.path.dirname(os.path.dirname(__file__))  # backend/
+
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", os.path.join(BASE_DIR, "cache", "jobs.sqlite3"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_QUEUED_PER_CLIENT = int(os.getenv("JOB_MAX_QUEUED_PER_CLIENT", "20"))
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", str(7 * 24 * 3600)))  # finished jobs are deleted after this
+
+FINISHED_STATES = ("done", "error", "cancelled")
+
+logger = logging.getLogger(__name__)
+
+
+class JobCancelled(Exception):
+    """Raised inside a running handler once its job has been cancelled."""
+
+
+class QueueFull(Exception):
+    """A client already has JOB_MAX_QUEUED_PER_CLIENT jobs waiting."""
+
+
+class JobContext:
+    """
+    Handed to a job handler: reports progress and checks for cancellation.
+    progress() raises JobCancelled if the job was cancelled, so handlers stop at their
+    next stage boundary (a call already in flight, such as the LLM request, runs to completion).
+    """
+
+    def __init__(self, queue: "JobQueue", job_id: str):
+        self.queue = queue
+        self.job_id = job_id
+
+    @property
+    def cancelled(self) -> bool:
+        return self.queue.cancel_requested(self.job_id)
+
+    def progress(self, stage: str, percent: Optional[int] = None) -> None:
+        if self.cancelled:
+            raise JobCancelled(self.job_id)
+        self.queue.update_progress(self.job_id, stage, percent)
+
+
+class JobQueue:
+    """
+    In-process job queue with its state in SQLite, so queued and finished jobs survive a restart.
+
+    Worker threads pick the next job client by client: among clients with queued jobs, the one
+    served least recently goes first, and within a client jobs run oldest first. One client
+    submitting a hundred jobs therefore cannot starve another that submits one.
+    Jobs that were running when the process died are queued again on start.
+    """
+
+    def __init__(self, path: str = JOB_DB_PATH, workers: int = JOB_WORKERS):
+        self.path = path
+        self.workers = max(1, workers)
+        self.handlers: Dict[str, Callable[[Dict[str, Any], JobContext], Any]] = {}
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, kind TEXT NOT NULL, client TEXT NOT NULL, payload TEXT NOT NULL,"
+            " status TEXT NOT NULL, stage TEXT, progress INTEGER NOT NULL DEFAULT 0,"
+            " result TEXT, error TEXT, cancel_requested INTEGER NOT NULL DEFAULT 0,"
+            " created REAL NOT NULL, started REAL, finished REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_queued ON jobs (status, client, created)")
+        self._conn.commit()
+        self._last_served: Dict[str, float] = {}
+        self._threads: List[threading.Thread] = []
+        self._stopping = False
+        self.completed = 0
+        self.failed = 0
+
+    def register(self, kind: str, handler: Callable[[Dict[str, Any], JobContext], Any]) -> None:
+        """Registers handler(payload, context) -> JSON-serializable result for a job kind."""
+        self.handlers[kind] = handler
+
+    # ---- LIFECYCLE ----
+
+    def start(self) -> None:
+        with self._lock:
+            if self._threads:
+                return
+            self._stopping = False
+            requeued = self._conn.execute(
+                "UPDATE jobs SET status = 'queued', stage = NULL, progress = 0, started = NULL"
+                " WHERE status = 'running'"
+            ).rowcount
+            self._conn.execute("DELETE FROM jobs WHERE status IN ('done', 'error', 'cancelled') AND finished < ?",
+                               (time.time() - JOB_RESULT_TTL,))
+            self._conn.commit()
+            if requeued:
+                logger.info("Job queue: re-queued %d job(s) interrupted by a restart", requeued)
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        with self._lock:
+            self._stopping = True
+            self._wakeup.notify_all()
+            threads, self._threads = self._threads, []
+        for thread in threads:
+            thread.join(timeout)
+
+    # ---- CLIENT API ----
+
+    def submit(self, kind: str, payload: Dict[str, Any], client: str = "anonymous") -> str:
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            queued = self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE client = ? AND status = 'queued'", (client,)
+            ).fetchone()[0]
+            if queued >= JOB_MAX_QUEUED_PER_CLIENT:
+                raise QueueFull(f"Client {client} already has {queued} queued jobs (limit {JOB_MAX_QUEUED_PER_CLIENT}).")
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, client, payload, status, created) VALUES (?, ?, ?, ?, 'queued', ?)",
+                (job_id, kind, client, json.dumps(payload, ensure_ascii=False), time.time()),
+            )
+            self._conn.commit()
+            self._wakeup.notify()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            ahead = None
+            if row["status"] == "queued":
+                ahead = self._conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created < ?", (row["created"],)
+                ).fetchone()[0]
+        job = {
+            "job_id": row["id"],
+            "kind": row["kind"],
+            "status": row["status"],
+            "stage": row["stage"],
+            "progress": row["progress"],
+            "created_at": row["created"],
+            "started_at": row["started"],
+            "finished_at": row["finished"],
+        }
+        if ahead is not None:
+            job["queued_ahead"] = ahead
+        if row["result"] is not None:
+            job["result"] = json.loads(row["result"])
+        if row["error"] is not None:
+            job["error"] = row["error"]
+        return job
+
+    def cancel(self, job_id: str) -> Optional[str]:
+        """Cancels a queued job at once and flags a running one; returns the job's status, None if unknown."""
+        with self._lock:
+            row = self._conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            status = row["status"]
+            if status == "queued":
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'cancelled', finished = ? WHERE id = ? AND status = 'queued'",
+                    (time.time(), job_id),
+                )
+                status = "cancelled"
+            elif status == "running":
+                self._conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+                status = "cancelling"
+            self._conn.commit()
+        return status
+
+    def cancel_requested(self, job_id: str) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def update_progress(self, job_id: str, stage: str, percent: Optional[int] = None) -> None:
+        with self._lock:
+            if percent is None:
+                self._conn.execute("UPDATE jobs SET stage = ? WHERE id = ?", (stage, job_id))
+            else:
+                self._conn.execute("UPDATE jobs SET stage = ?, progress = ? WHERE id = ?", (stage, int(percent), job_id))
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            per_client = dict(self._conn.execute(
+                "SELECT client, COUNT(*) FROM jobs WHERE status = 'queued' GROUP BY client"
+            ).fetchall())
+            oldest = self._conn.execute("SELECT MIN(created) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            return {
+                "workers": self.workers,
+                "queue_depth": counts.get("queued", 0),
+                "running": counts.get("running", 0),
+                "oldest_queued_seconds": round(now - oldest, 1) if oldest else 0.0,
+                "queued_per_client": per_client,
+                "counts": counts,
+                "completed_since_start": self.completed,
+                "failed_since_start": self.failed,
+            }
+
+    # ---- WORKERS ----
+
+    def _claim(self) -> Optional[sqlite3.Row]:
+        # Caller must hold self._lock
+        clients = [r[0] for r in self._conn.execute(
+            "SELECT DISTINCT client FROM jobs WHERE status = 'queued'"
+        ).fetchall()]
+        if not clients:
+            return None
+        client = min(clients, key=lambda c: self._last_served.get(c, 0.0))
+        row = self._conn.execute(
+            "SELECT * FROM jobs WHERE status = 'queued' AND client = ? ORDER BY created LIMIT 1", (client,)
+        ).fetchone()
+        now = time.time()
+        claimed = self._conn.execute(
+            "UPDATE jobs SET status = 'running', started = ? WHERE id = ? AND status = 'queued'", (now, row["id"])
+        ).rowcount
+        self._conn.commit()
+        self._last_served[client] = now
+        return row if claimed else None
+
+    def _finish(self, job_id: str, status: str, result: Any = None, error: Optional[str] = None) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished = ?,"
+                " progress = CASE WHEN ? = 'done' THEN 100 ELSE progress END WHERE id = ?",
+                (status, json.dumps(result, ensure_ascii=False) if result is not None else None, error,
+                 time.time(), status, job_id),
+            )
+            self._conn.commit()
+            if status == "done":
+                self.completed += 1
+            elif status == "error":
+                self.failed += 1
+
+    def _worker(self) -> None:
+        while True:
+            with self._lock:
+                row = None
+                while not self._stopping:
+                    row = self._claim()
+                    if row is not None:
+                        break
+                    self._wakeup.wait(timeout=1.0)
+                if self._stopping:
+                    return
+            job_id = row["id"]
+            handler = self.handlers.get(row["kind"])
+            try:
+                if handler is None:
+                    raise ValueError(f"No handler registered for job kind: {row['kind']}")
+                result = handler(json.loads(row["payload"]), JobContext(self, job_id))
+                self._finish(job_id, "done", result=result)
+            except JobCancelled:
+                self._finish(job_id, "cancelled")
+            except Exception as ex:
+                logger.exception("Job %s (%s) failed: %s", job_id, row["kind"], ex)
+                self._finish(job_id, "error", error=str(ex))
+
+
+_queue: Optional[JobQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """Returns the process-wide job queue (workers start with JobQueue.start())."""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue()
+    return _queue
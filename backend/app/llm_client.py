@@ -0,0 +1,257 @@
+import os
+import time
+import random
+import socket
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Iterator, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .metrics import LLM_IN_FLIGHT, UPSTREAM_ERRORS
+
+# Shared settings for every upstream LLM call (DeepSeek cloud, Ollama, ...)
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "300"))  # deepseek-reasoner can think for minutes
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1.0"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "30"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", str(max(LLM_MAX_CONCURRENCY, 10))))
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class LLMHTTPError(RuntimeError):
+    """Non-retryable (or retries exhausted) error response from an upstream LLM API."""
+
+    def __init__(self, status_code: int, body: str):
+        super().__init__(f"LLM API response code: {status_code} {body}")
+        self.status_code = status_code
+        self.body = body
+
+
+class Cancelled(RuntimeError):
+    """An upstream call abandoned through its CancelScope."""
+
+
+_local = threading.local()
+
+
+class CancelScope:
+    """
+    Lets another thread abandon the upstream calls of the thread that entered the scope: a call
+    that has not been sent yet is never sent (and gives up its place in the limiter queue), and
+    the connection of a call in progress is shut down instead of waiting for its next line.
+    """
+
+    def __init__(self):
+        self.cancelled = threading.Event()
+        self._responses = set()
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "CancelScope":
+        _local.scope = self
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        _local.scope = None
+
+    def cancel(self) -> None:
+        self.cancelled.set()
+        with self._lock:
+            responses = list(self._responses)
+        for response in responses:
+            _abort(response)
+
+    def check(self) -> None:
+        if self.cancelled.is_set():
+            raise Cancelled("LLM call cancelled")
+
+    def track(self, response: requests.Response) -> None:
+        with self._lock:
+            self._responses.add(response)
+        if self.cancelled.is_set():
+            _abort(response)
+            self.check()
+
+    def untrack(self, response: requests.Response) -> None:
+        with self._lock:
+            self._responses.discard(response)
+
+
+def current_scope() -> Optional[CancelScope]:
+    return getattr(_local, "scope", None)
+
+
+def _abort(response: requests.Response) -> None:
+    # Shutting the socket down wakes up a thread blocked reading it; close() alone may not
+    sock = getattr(getattr(response.raw, "_connection", None), "sock", None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    try:
+        response.close()
+    except Exception:
+        pass
+
+
+def retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    """Parses a Retry-After header given either as seconds or as an HTTP date."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """Seconds to wait before retry number `attempt` (0-based): Retry-After if given, else jittered exponential."""
+    hinted = retry_after_seconds(retry_after)
+    if hinted is not None:
+        return min(hinted, LLM_BACKOFF_MAX)
+    delay = min(LLM_BACKOFF_BASE * (2 ** attempt), LLM_BACKOFF_MAX)
+    return delay * (0.5 + random.random() / 2)
+
+
+class InFlightLimiter:
+    """
+    Global cap on in-flight upstream calls, shared by every provider.
+    """
+
+    def __init__(self, limit: int = LLM_MAX_CONCURRENCY):
+        self.limit = max(1, limit)
+        self._sem = threading.BoundedSemaphore(self.limit)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+
+    def acquire(self, scope: Optional[CancelScope] = None) -> None:
+        """Waits for a slot; raises Cancelled (without taking one) if `scope` is cancelled meanwhile."""
+        if scope is None:
+            self._sem.acquire()
+        else:
+            while not self._sem.acquire(timeout=0.05):
+                scope.check()
+            if scope.cancelled.is_set():
+                self._sem.release()
+                scope.check()
+        self._count(1)
+
+    def release(self) -> None:
+        self._count(-1)
+        self._sem.release()
+
+    def _count(self, change: int) -> None:
+        with self._lock:
+            self.in_flight += change
+
+
+limiter = InFlightLimiter()
+LLM_IN_FLIGHT.set_function(lambda: limiter.in_flight)
+
+
+def record_upstream_error(url: str, reason: str) -> None:
+    """Counts one failed attempt against an upstream host (retried attempts included)."""
+    UPSTREAM_ERRORS.inc(upstream=urlparse(url).hostname or url, reason=reason)
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Process-wide requests session with a keep-alive connection pool."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=LLM_POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+# ---- SYNC ENTRY POINTS ----
+
+def _send(url: str, payload: Dict[str, Any], headers: Dict[str, str], stream: bool) -> requests.Response:
+    """POSTs with retries on connection errors and 429/5xx. Caller holds the limiter."""
+    session = get_session()
+    scope = current_scope()
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        if scope is not None:
+            scope.check()  # no (further) attempt once the caller has given up
+        try:
+            response = session.post(url, json=payload, headers=headers, stream=stream,
+                                    timeout=(LLM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT))
+        except (requests.ConnectionError, requests.Timeout) as excep:
+            record_upstream_error(url, "timeout" if isinstance(excep, requests.Timeout) else "connect")
+            if attempt == LLM_MAX_RETRIES:
+                raise
+            time.sleep(backoff_delay(attempt))
+            continue
+        if response.ok:
+            return response
+        record_upstream_error(url, f"http_{response.status_code}")
+        if response.status_code in RETRY_STATUS_CODES and attempt < LLM_MAX_RETRIES:
+            retry_after = response.headers.get("Retry-After")
+            response.close()
+            time.sleep(backoff_delay(attempt, retry_after))
+            continue
+        body = response.text
+        response.close()
+        raise LLMHTTPError(response.status_code, body)
+    raise RuntimeError("unreachable")
+
+
+def post_json(url: str, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """POSTs a JSON payload and returns the decoded JSON response."""
+    limiter.acquire(current_scope())
+    try:
+        response = _send(url, payload, headers or {}, stream=False)
+        return response.json()
+    finally:
+        limiter.release()
+
+
+def stream_lines(url: str, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> Iterator[bytes]:
+    """
+    POSTs a JSON payload and yields the response body line by line as it arrives.
+    Retries only happen before the first byte; the in-flight slot is held until the stream ends.
+    Inside a CancelScope, cancelling it stops the call before it is sent or closes the stream.
+    """
+    scope = current_scope()
+    limiter.acquire(scope)
+    try:
+        response = _send(url, payload, headers or {}, stream=True)
+        with response:
+            if scope is not None:
+                scope.track(response)
+            try:
+                for line in response.iter_lines():
+                    yield line
+            except Exception as excep:
+                if scope is not None and scope.cancelled.is_set():
+                    raise Cancelled("LLM stream cancelled") from excep
+                if isinstance(excep, requests.RequestException):
+                    record_upstream_error(url, "stream")
+                raise
+            finally:
+                if scope is not None:
+                    scope.untrack(response)
+    finally:
+        limiter.release()
+
+
+def stats() -> dict:
+    return {"in_flight": limiter.in_flight, "max_concurrency": limiter.limit}
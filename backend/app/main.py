@@ -1,24 +1,54 @@
 import os
-import traceback
+import asyncio
+import logging
+import threading
+
+# First, so the startup report's clock covers the imports below
+from .startup import get_startup_report
+startup_report = get_startup_report()
+
 from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, FileResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Match
 from pydantic import BaseModel
 from typing import List, Optional, Union
 from dotenv import load_dotenv
 import json
 import time
+from types import SimpleNamespace
 
 # --- Load environment variables from .env file in parent directory (backend/.env)
 load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
 
-from .rag_pipeline import generate_material
-from .export import export_text
-from ollama_client import query_deepseek
+from .logging_config import configure_logging
+configure_logging()
+
+from .rag_pipeline import generate_material, stream_material
+from .embeddings import get_embedding_service
+from .vectorstore_cache import get_vectorstore_cache
+from .generation_cache import get_generation_cache
+from .catalog import get_chapter_catalog
+from .prompts import get_token_accounting
+from .batch import get_batch_jobs
+from .jobs import QueueFull, get_job_queue
+from .artifacts import EXTENSIONS, get_artifact_store, iter_file, parse_range
+from .render import PRELOAD_PANDOC, RenderQueueFull, get_render_service
+from .metrics import CONTENT_TYPE, HTTP_IN_FLIGHT, HTTP_REQUEST_SECONDS, render_metrics
+from .ann_index import RETRIEVAL_SCOPES, get_ann_index, index_exists
+from .materialized import get_materialized_retrieval
+from . import providers
+
+startup_report.milestone("imported")
 
 # Railway will provide PORT in the environment
 PORT = int(os.environ.get("PORT", 8000))
 
+logger = logging.getLogger(__name__)
+
+# Load the embedding model when the app starts instead of on the first request ("0" = lazy)
+PRELOAD_EMBEDDING_MODEL = os.getenv("PRELOAD_EMBEDDING_MODEL", "1") != "0"
+
 # --- CORS Setup ---
 # Read allowed origins as a comma-separated list from FRONTEND_URL
 ALLOWED_ORIGINS = [origin.strip() for origin in os.getenv("FRONTEND_URL", "http://localhost:5173").split(",")]
@@ -37,6 +67,91 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def route_label(request: Request) -> str:
+    """Route template of a request (e.g. /api/jobs/{job_id}), so ids never become metric labels."""
+    for route in app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return getattr(route, "path", "unknown")
+    return "unmatched"
+
+@app.middleware("http")
+async def http_metrics(request: Request, call_next):
+    """Latency histogram and in-flight gauge per route; streamed responses count as in flight until they end."""
+    route = route_label(request)
+    start = time.perf_counter()
+    status = 500
+    HTTP_IN_FLIGHT.inc(route=route)
+    streaming = False
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        body = getattr(response, "body_iterator", None)
+        if body is not None:
+            async def tracked_body():
+                try:
+                    async for chunk in body:
+                        yield chunk
+                finally:
+                    HTTP_IN_FLIGHT.dec(route=route)
+            response.body_iterator = tracked_body()
+            streaming = True
+        return response
+    finally:
+        if not streaming:
+            HTTP_IN_FLIGHT.dec(route=route)
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, method=request.method, route=route, status=status)
+
+@app.on_event("startup")
+def warm_embedding_model():
+    if PRELOAD_EMBEDDING_MODEL:
+        startup_report.warm_in_background("embedding_model", get_embedding_service().load)
+
+@app.on_event("startup")
+def build_chapter_catalog():
+    with startup_report.phase("chapter_catalog"):
+        get_chapter_catalog()
+
+@app.on_event("startup")
+def warm_ann_index():
+    # The index is built at image build time (scripts/prebuild.py); loading it maps the files
+    if index_exists():
+        startup_report.warm_in_background("ann_index", get_ann_index)
+
+@app.on_event("startup")
+def load_materialized_retrieval():
+    with startup_report.phase("materialized_retrieval"):
+        get_materialized_retrieval()
+
+@app.on_event("startup")
+def warm_render_service():
+    if PRELOAD_PANDOC:
+        get_render_service().warm_in_background()
+
+@app.on_event("startup")
+def start_artifact_sweeper():
+    get_artifact_store().start_sweeper()
+
+@app.on_event("startup")
+def start_job_queue():
+    queue = get_job_queue()
+    queue.register("generate", run_generate_job)
+    queue.register("export", run_export_job)
+    queue.start()
+
+@app.on_event("startup")
+def startup_complete():
+    # Registered last, so it runs after the other startup hooks
+    startup_report.serving()
+
+@app.on_event("shutdown")
+def stop_job_queue():
+    get_job_queue().stop()
+
+@app.on_event("shutdown")
+def stop_artifact_sweeper():
+    get_artifact_store().stop_sweeper()
+
 ## --- DATA MODELS ---
 class GenerateRequest(BaseModel):
     grade: str  # "Grade 1", ..., "Grade 12"
@@ -45,22 +160,46 @@ class GenerateRequest(BaseModel):
     difficulty: str  # "Easy", "Medium", "Difficult"
     stream: Optional[str] = None # Only for Grades 11 and 12
     max_marks: Optional[int] = None  # Only required for Question Paper
+    top_k: Optional[int] = None  # Context chunks retrieved per chapter (default 2)
+    fresh: bool = False  # Skip the generation cache and always call DeepSeek
+    scope: str = "chapter"  # "chapter", "book" (whole textbook named in chapter) or "grade" (whole grade)
+    provider: Optional[str] = None  # "deepseek" or "ollama"; LLM_PROVIDER when omitted
+    sectioned: Optional[bool] = None  # Grade 10 question papers: write sections concurrently (PAPER_SECTIONED when omitted)
 
 class GenerateResponse(BaseModel):
     output: str
 
+class GenerateBatchRequest(BaseModel):
+    items: List[GenerateRequest]
+    concurrency: Optional[int] = None  # LLM calls in flight for this job (capped by BATCH_LLM_CONCURRENCY)
+
+class GenerateBatchResponse(BaseModel):
+    job_id: str
+    status: str
+    total: int
+
+class GenerateExportRequest(GenerateRequest):
+    filetype: str = "pdf"  # "pdf" or "docx"
+    use_pandoc: bool = False  # Render through Pandoc/XeLaTeX (for math); falls back to plain export
+
 class ExportRequest(BaseModel):
     text: str
     filetype: str = "pdf"  # "pdf" or "docx"
+    use_pandoc: bool = False  # Render through Pandoc/XeLaTeX (for math); falls back to plain export
 
 class ExportResponse(BaseModel):
-    file_path: str
+    file_id: str  # Content address: identical text and format always get the same id
+    download_url: str  # /api/download/{file_id}
+    filename: str
+    size: int
+    cached: bool = False  # True when this content had been exported before
 
 class DeepseekRequest(BaseModel):
     materialType: Optional[str] = "worksheet"
     grade: Optional[str] = "X"
     chapter: Optional[str] = "General"
     difficulty: Optional[str] = "medium"
+    provider: Optional[str] = None  # "deepseek" or "ollama"; LLM_PROVIDER when omitted
 
 class DeepseekResponse(BaseModel):
     output: str
@@ -79,14 +218,35 @@ def get_material_types():
 def get_difficulty_levels():
     return ["Easy", "Medium", "Difficult"]
 
+@app.get("/api/chapters")
+def get_chapters(grade: Optional[str] = None):
+    """Chapters that have a vectorstore, optionally for one grade ("Grade 10" or "10")."""
+    catalog = get_chapter_catalog()
+    return [chapter.to_dict() for chapter in catalog.list_chapters(grade)]
+
 def build_prompt(data: DeepseekRequest) -> str:
     return (
         f"Generate a {data.materialType or 'worksheet'} for grade {data.grade or 'X'},"
         f' chapter "{data.chapter or "General"}", with {data.difficulty or "medium"} difficulty.'
     )
 
-@app.post("/api/generate", response_model=GenerateResponse)
-def generate(generate_req: GenerateRequest):
+def check_scope(scope: Optional[str], chapters: List[str]) -> None:
+    """Rejects a retrieval scope the request cannot be served with, before any work is done."""
+    scope = (scope or "chapter").strip().lower()
+    if scope not in RETRIEVAL_SCOPES:
+        raise HTTPException(status_code=400, detail=f"Unknown scope: choose one of {', '.join(RETRIEVAL_SCOPES)}.")
+    if scope == "book" and not chapters:
+        raise HTTPException(status_code=400, detail="Name the book or subject to search in 'chapter'.")
+    if scope != "chapter" and not index_exists():
+        raise HTTPException(status_code=503, detail=f"scope={scope} needs the ANN index, which is not built on this "
+                                                    "instance; build it with `python -m app.ann_index`.")
+
+def check_provider(provider: Optional[str]) -> None:
+    if provider and provider.strip().lower() not in providers.PROVIDERS:
+        raise HTTPException(status_code=400, detail=f"Unknown provider: choose one of {', '.join(providers.PROVIDERS)}.")
+
+def normalize_generate_request(generate_req: GenerateRequest) -> GenerateRequest:
+    """Validates a generation request and returns a copy with the chapters as a list."""
     # Validate max_marks for Question Paper
     if generate_req.material_type.strip().lower() == "question paper" and not generate_req.max_marks:
         raise HTTPException(status_code=400, detail="max_marks is required for Question Paper.")
@@ -101,56 +261,287 @@ def generate(generate_req: GenerateRequest):
     else:
         chapters_list = []
 
+    check_scope(generate_req.scope, chapters_list)
+
+    check_provider(generate_req.provider)
+
     # Make a copy of the request with chapters as a list
-    updated_generate_req = generate_req.copy(update={"chapter": chapters_list})
+    return generate_req.copy(update={"chapter": chapters_list})
 
+@app.post("/api/generate", response_model=GenerateResponse)
+def generate(generate_req: GenerateRequest):
+    updated_generate_req = normalize_generate_request(generate_req)
     try:
         output = generate_material(updated_generate_req)
         return {"output": output}
     except Exception as excep:
-        print("Error in /api/generate:", excep)
-        traceback.print_exc()
+        logger.exception("Error in /api/generate: %s", excep)
         raise HTTPException(status_code=500, detail=str(excep))
 
+@app.post("/api/generate_batch", response_model=GenerateBatchResponse)
+def generate_batch(batch_req: GenerateBatchRequest):
+    """
+    Starts a batch job and returns its id at once. Poll /api/generate_batch/{job_id} for
+    per-item status, or stream finished items from /api/generate_batch/{job_id}/results.
+    """
+    items = []
+    for i, item in enumerate(batch_req.items):
+        try:
+            items.append(normalize_generate_request(item))
+        except HTTPException as excep:
+            raise HTTPException(status_code=excep.status_code, detail=f"Item {i}: {excep.detail}")
+    try:
+        job = get_batch_jobs().submit(items, batch_req.concurrency)
+    except ValueError as excep:
+        raise HTTPException(status_code=400, detail=str(excep))
+    return {"job_id": job.id, "status": job.status, "total": len(job.items)}
+
+@app.get("/api/generate_batch/{job_id}")
+def generate_batch_status(job_id: str, include_output: bool = True):
+    job = get_batch_jobs().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown batch job: {job_id}")
+    return job.summary(include_output=include_output)
+
+@app.get("/api/generate_batch/{job_id}/results")
+async def generate_batch_results(job_id: str):
+    """Streams one JSON line per item as items finish; the stream ends when the job is done."""
+    job = get_batch_jobs().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown batch job: {job_id}")
+
+    async def result_lines():
+        cursor = 0
+        while True:
+            items, finished = job.completed_since(cursor)
+            cursor += len(items)
+            for item in items:
+                yield json.dumps(item.to_dict()) + "\n"
+            if finished and not items:
+                break
+            if not items:
+                await asyncio.sleep(0.25)
+
+    return StreamingResponse(result_lines(), media_type="application/x-ndjson")
+
 @app.post("/api/deepseek_generate", response_model=DeepseekResponse)
 def deepseek_generate(deepseek_req: DeepseekRequest):
     """Endpoint migrated from Flask for Deepseek prompt-based generation."""
+    try:
+        llm = providers.get_provider(deepseek_req.provider)
+    except ValueError as excep:
+        raise HTTPException(status_code=400, detail=str(excep))
     try:
         prompt = build_prompt(deepseek_req)
-        result = query_deepseek(prompt)
+        result = llm.complete(prompt)
         return {"output": result}
     except Exception as excep:
-        print("Error in /api/deepseek_generate:", excep)
-        traceback.print_exc()
+        logger.exception("Error in /api/deepseek_generate: %s", excep)
         raise HTTPException(status_code=500, detail=str(excep))
 
 @app.post("/api/export", response_model=ExportResponse)
 def export(export_req: ExportRequest):
     try:
-        file_path = export_text(export_req.text, export_req.filetype)
-        return {"file_path": file_path}
+        artifact = get_artifact_store().export(export_req.text, export_req.filetype, export_req.use_pandoc)
+        return artifact.to_dict()
+    except RenderQueueFull as excep:
+        raise HTTPException(status_code=503, detail=str(excep))
+    except ValueError as excep:
+        raise HTTPException(status_code=400, detail=str(excep))
     except Exception as excep:
-        print("Error in /api/export:", excep)
-        traceback.print_exc()
+        logger.exception("Error in /api/export: %s", excep)
         raise HTTPException(status_code=500, detail=str(excep))
 
-@app.get("/api/download")
-def download_file(file_path: str):
+def artifact_headers(artifact) -> dict:
+    return {
+        "ETag": artifact.etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, max-age=3600",
+        "Content-Disposition": f'attachment; filename="{artifact.filename}"',
+        "X-File-Id": artifact.id,
+    }
+
+@app.post("/api/generate_export")
+def generate_export(export_req: GenerateExportRequest):
+    """
+    Generates material and returns it as a PDF/DOCX file in one request, so the text never
+    travels back to the server for /api/export. Plain PDFs are laid out while DeepSeek is still
+    streaming; other formats are rendered once the text is complete. The file is kept in the
+    artifact store as well: its id is in the X-File-Id header and /api/download/{id} serves it again.
+    """
+    if export_req.filetype not in EXTENSIONS:
+        raise HTTPException(status_code=400, detail=f"Unsupported file type: choose 'pdf' or 'docx' (or 'word'). Got: {export_req.filetype}")
+    updated_req = normalize_generate_request(export_req)
+    store = get_artifact_store()
     try:
-        return FileResponse(
-            path=file_path, 
-            filename=os.path.basename(file_path), 
-            media_type='application/octet-stream'
-        )
+        if export_req.filetype == "pdf" and not export_req.use_pandoc:
+            artifact = store.export_stream(stream_material(updated_req), "pdf")
+        else:
+            artifact = store.export(generate_material(updated_req), export_req.filetype, export_req.use_pandoc)
+    except RenderQueueFull as excep:
+        raise HTTPException(status_code=503, detail=str(excep))
     except Exception as excep:
-        raise HTTPException(status_code=404, detail=f"File not found: {excep}")
+        logger.exception("Error in /api/generate_export: %s", excep)
+        raise HTTPException(status_code=500, detail=str(excep))
+    headers = artifact_headers(artifact)
+    headers["Content-Length"] = str(artifact.size)
+    return StreamingResponse(iter_file(artifact.path), media_type=artifact.media_type, headers=headers)
+
+@app.get("/api/download/{file_id}")
+def download_file(file_id: str, request: Request):
+    """Streams an exported file by id; supports If-None-Match (304) and single byte ranges (206)."""
+    artifact = get_artifact_store().get(file_id)
+    if artifact is None:
+        raise HTTPException(status_code=404, detail="File not found or expired, export it again.")
+    headers = artifact_headers(artifact)
+    if request.headers.get("if-none-match") in (artifact.etag, "*"):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if if_range is not None and if_range != artifact.etag:
+        range_header = None  # the client's partial copy is of other content: send it all
+    try:
+        byte_range = parse_range(range_header, artifact.size)
+    except ValueError as excep:
+        headers["Content-Range"] = f"bytes */{artifact.size}"
+        raise HTTPException(status_code=416, detail=str(excep), headers=headers)
+
+    if byte_range is None:
+        headers["Content-Length"] = str(artifact.size)
+        return StreamingResponse(iter_file(artifact.path), media_type=artifact.media_type, headers=headers)
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{artifact.size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(iter_file(artifact.path, start, end), status_code=206,
+                             media_type=artifact.media_type, headers=headers)
+
+@app.get("/api/providers")
+def provider_stats():
+    """Default and hedge providers, recent first-token latencies and the current hedging deadlines."""
+    return {"providers": list(providers.PROVIDERS), **providers.stats()}
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus scrape endpoint: stage latency histograms, in-flight gauges and upstream error counters."""
+    return Response(render_metrics(), media_type=CONTENT_TYPE)
 
 @app.get("/api/health")
 def health_check():
-    return {"status": "ok"}
+    embedder = get_embedding_service()
+    return {
+        "status": "ok",
+        "embedding_model": embedder.model_name,
+        "embedding_model_warm": embedder.is_warm,
+    }
+
+@app.get("/api/ready")
+def readiness_check():
+    """
+    Readiness (unlike /api/health, which only says the process is up): 200 once the startup
+    hooks have run and the embedding model and ANN index are loaded, 503 until then.
+    The body is the startup report, with the time each step took.
+    """
+    report = startup_report.to_dict()
+    return JSONResponse(report, status_code=200 if report["ready"] else 503)
+
+@app.get("/api/cache/vectorstores")
+def vectorstore_cache_stats():
+    """Hit/miss/eviction counters and memory use of the loaded-vectorstore cache."""
+    return get_vectorstore_cache().stats()
+
+@app.get("/api/cache/generations")
+def generation_cache_stats():
+    """Hit rate and size of the generated-materials cache."""
+    return get_generation_cache().stats()
+
+@app.get("/api/cache/renders")
+def render_cache_stats():
+    """Pandoc availability, worker pool load and render counters."""
+    return get_render_service().stats()
+
+@app.get("/api/tokens")
+def token_stats():
+    """Estimated prompt, context and completion tokens sent to DeepSeek, and what the budgeter dropped."""
+    return get_token_accounting().stats()
+
+@app.get("/api/cache/materialized")
+def materialized_retrieval_stats():
+    """Size of the precomputed retrieval table and how often it answered instead of live retrieval."""
+    return get_materialized_retrieval().stats()
+
+@app.get("/api/cache/artifacts")
+def artifact_store_stats():
+    """Disk usage, dedupe hit rate and sweeper counters of the exported-files store."""
+    return get_artifact_store().stats()
+
+# ----------- BACKGROUND JOBS -----------
+
+def run_generate_job(payload: dict, job):
+    """Job handler: one /api/generate request, with the pipeline stages as job progress."""
+    def on_progress(stage, **info):
+        job.progress(stage, STREAM_STAGE_PROGRESS.get(stage))
+    return {"output": generate_material(SimpleNamespace(**payload), progress=on_progress)}
+
+def run_export_job(payload: dict, job):
+    job.progress("exporting", 10)
+    artifact = get_artifact_store().export(payload["text"], payload.get("filetype", "pdf"), payload.get("use_pandoc", False))
+    return artifact.to_dict()
+
+def job_client_id(request: Request) -> str:
+    """Fairness key of the caller: the X-Client-Id header, else the client address."""
+    return request.headers.get("X-Client-Id") or (request.client.host if request.client else "anonymous")
+
+def submit_job(kind: str, payload: dict, request: Request) -> dict:
+    try:
+        job_id = get_job_queue().submit(kind, payload, job_client_id(request))
+    except QueueFull as excep:
+        raise HTTPException(status_code=429, detail=str(excep))
+    return get_job_queue().get(job_id)
+
+@app.post("/api/jobs/generate")
+def submit_generate_job(generate_req: GenerateRequest, request: Request):
+    """Queues a generation and returns its job id at once; poll /api/jobs/{job_id} for the result."""
+    return submit_job("generate", normalize_generate_request(generate_req).dict(), request)
+
+@app.post("/api/jobs/export")
+def submit_export_job(export_req: ExportRequest, request: Request):
+    return submit_job("export", export_req.dict(), request)
+
+@app.get("/api/jobs/metrics")
+def job_queue_metrics():
+    """Queue depth (total and per client), running jobs and outcome counters."""
+    return get_job_queue().stats()
+
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: str):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return job
+
+@app.delete("/api/jobs/{job_id}")
+def cancel_job(job_id: str):
+    """Cancels a queued job; a running job stops at its next pipeline stage."""
+    status = get_job_queue().cancel(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return {"job_id": job_id, "status": status}
 
 # ----------- STREAMING PROGRESS ENDPOINT -----------
 
+# Progress bar position reported once each generate_material stage has finished
+STREAM_STAGE_PROGRESS = {
+    "started": 2,
+    "cache_hit": 95,
+    "vectorstore_load": 15,
+    "embed": 25,
+    "retrieve": 35,
+    "prompt_built": 40,
+    "llm_request": 45,
+    "llm_response": 95,
+}
+
 @app.get("/api/generate_stream")
 async def generate_stream(
     grade: str = Query(..., description="Grade number, e.g. '10'"),
@@ -158,53 +549,109 @@ async def generate_stream(
     material_type: str = Query(..., description="Material type (Question Paper, Worksheet, Lesson Plan)"),
     difficulty: str = Query(..., description="Difficulty (Easy, Medium, Difficult)"),
     stream: Optional[str] = Query(None, description="Stream for 11/12"),
-    max_marks: Optional[int] = Query(None, description="Maximum marks for Question Paper")
+    max_marks: Optional[int] = Query(None, description="Maximum marks for Question Paper"),
+    top_k: Optional[int] = Query(None, description="Context chunks retrieved per chapter"),
+    fresh: bool = Query(False, description="Skip the generation cache"),
+    scope: str = Query("chapter", description="chapter, book (whole textbook) or grade (whole grade)"),
+    provider: Optional[str] = Query(None, description="LLM provider: deepseek or ollama (default LLM_PROVIDER)"),
+    sectioned: Optional[bool] = Query(None, description="Grade 10 question papers: generate the sections concurrently")
 ):
     """
     Streams progress updates and the final output for the progress bar.
     On the frontend, use EventSource to listen to /api/generate_stream and update the progress bar accordingly.
+    Each event carries the pipeline "stage" that just finished and its "progress" percentage.
+    While DeepSeek is writing, "tokens" events carry each new piece of text in "delta";
+    the last event has stage "done" and the full assembled "output".
+    Sectioned Grade 10 papers send a "paper_section" event as each section is emitted.
     """
-    import asyncio
+    # DEBUG: log the value and type of chapter
+    logger.debug("chapter type is %s, value is %s", type(chapter), chapter)
+
+    # Robust handling of chapter
+    chapter_list = []
+    if isinstance(chapter, str):
+        # Single string: split by comma
+        chapter_list = [c.strip() for c in chapter.split(",") if c.strip()]
+    elif isinstance(chapter, list):
+        # List of strings: flatten and split each by comma
+        for item in chapter:
+            if isinstance(item, str):
+                chapter_list.extend([c.strip() for c in item.split(",") if c.strip()])
+    else:
+        # Unexpected type, try to cast to string then split
+        chapter_list = [str(chapter).strip()] if chapter else []
+
+    logger.debug("parsed chapter_list is %s", chapter_list)
+
+    req = SimpleNamespace(
+        grade=grade,
+        chapter=chapter_list,
+        material_type=material_type,
+        difficulty=difficulty,
+        stream=stream,
+        max_marks=max_marks,
+        top_k=top_k,
+        fresh=fresh,
+        scope=scope,
+        provider=provider,
+        sectioned=sectioned
+    )
+
+    # Rejected with an HTTP error before the stream starts, like /api/generate
+    check_scope(scope, chapter_list)
+    check_provider(provider)
+
     async def event_generator():
-        total_steps = 8
-        for i in range(total_steps):
-            progress = int((i / (total_steps - 1)) * 90)
-            yield f"data: {json.dumps({'progress': progress})}\n\n"
-            await asyncio.sleep(0.8)
-
-        # DEBUG: log the value and type of chapter
-        print(f"DEBUG: chapter type is {type(chapter)}, value is {chapter}")
-
-        # Robust handling of chapter
-        chapter_list = []
-        if isinstance(chapter, str):
-            # Single string: split by comma
-            chapter_list = [c.strip() for c in chapter.split(",") if c.strip()]
-        elif isinstance(chapter, list):
-            # List of strings: flatten and split each by comma
-            for item in chapter:
-                if isinstance(item, str):
-                    chapter_list.extend([c.strip() for c in item.split(",") if c.strip()])
-        else:
-            # Unexpected type, try to cast to string then split
-            chapter_list = [str(chapter).strip()] if chapter else []
-
-        print(f"DEBUG: parsed chapter_list is {chapter_list}")
-
-        from types import SimpleNamespace
-        req = SimpleNamespace(
-            grade=grade,
-            chapter=chapter_list,
-            material_type=material_type,
-            difficulty=difficulty,
-            stream=stream,
-            max_marks=max_marks
-        )
+        loop = asyncio.get_running_loop()
+        events: asyncio.Queue = asyncio.Queue()
+
+        def on_progress(stage, **info):
+            # Called from the worker thread; hand the event over to the event loop
+            event = {"stage": stage, "progress": STREAM_STAGE_PROGRESS.get(stage), **info}
+            loop.call_soon_threadsafe(events.put_nowait, event)
+
+        # Set when the client goes away, so the worker stops reading the upstream stream
+        disconnected = threading.Event()
+
+        def run_generation():
+            # Forward every content delta to the client as soon as DeepSeek sends it
+            parts = []
+            pieces = stream_material(req, progress=on_progress)
+            try:
+                for delta in pieces:
+                    if disconnected.is_set():
+                        logger.info("Stream client disconnected, abandoning generation")
+                        break
+                    parts.append(delta)
+                    loop.call_soon_threadsafe(events.put_nowait, {"stage": "tokens", "delta": delta})
+            finally:
+                # Releases the upstream response (and any paper section calls still queued)
+                pieces.close()
+            return "".join(parts)
+
+        yield f"data: {json.dumps({'stage': 'started', 'progress': STREAM_STAGE_PROGRESS['started']})}\n\n"
+
         try:
-            output = generate_material(req)
-            yield f"data: {json.dumps({'progress': 100, 'output': output})}\n\n"
-        except Exception as ex:
-            yield f"data: {json.dumps({'error': str(ex)})}\n\n"
+            # Retrieval and the LLM call block, so run them on the threadpool to keep the event loop free
+            task = loop.run_in_executor(None, run_generation)
+            while not task.done():
+                getter = asyncio.ensure_future(events.get())
+                done, _ = await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+                if getter in done:
+                    yield f"data: {json.dumps(getter.result())}\n\n"
+                else:
+                    getter.cancel()
+            # Events queued just before the worker returned
+            while not events.empty():
+                yield f"data: {json.dumps(events.get_nowait())}\n\n"
+
+            try:
+                output = task.result()
+                yield f"data: {json.dumps({'stage': 'done', 'progress': 100, 'output': output})}\n\n"
+            except Exception as ex:
+                yield f"data: {json.dumps({'error': str(ex)})}\n\n"
+        finally:
+            disconnected.set()
 
     return StreamingResponse(event_generator(), media_type="text/event-stream")
 
@@ -0,0 +1,228 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .catalog import Chapter, get_chapter_catalog
+from .embeddings import EMBEDDING_MODEL
+from .models import DIFFICULTY_LEVEL_OPTIONS, GRADE_OPTIONS, MATERIAL_TYPE_OPTIONS
+from .retrieval import MAX_TOP_K, resolve_top_k
+from .vectorstore import VECTORSTORE_DIR, vectorstore_mtime
+
+# Ranked chunk ids of every single-chapter request, precomputed by `python -m app.materialized`
+MATERIALIZED_PATH = os.getenv("MATERIALIZED_PATH", os.path.join(VECTORSTORE_DIR, "materialized", "retrieval.json"))
+MATERIALIZED_RETRIEVAL = os.getenv("MATERIALIZED_RETRIEVAL", "1") != "0"
+FORMAT_VERSION = 2
+
+logger = logging.getLogger(__name__)
+
+Hits = List[Tuple[int, float]]
+
+
+def chapter_key(chapter: Chapter) -> str:
+    return f"{chapter.grade}|{chapter.name}"
+
+
+def chapter_source(chapter: Chapter) -> list:
+    """Where the catalog puts a chapter's rows: [file, page range or None], as stored in the table."""
+    return [chapter.file, list(chapter.pages) if chapter.pages else None]
+
+
+def entry_key(chapter: Chapter, material_type: str, difficulty: str) -> str:
+    return f"{chapter_key(chapter)}|{material_type.strip().lower()}|{difficulty.strip().lower()}"
+
+
+def query_fingerprint() -> str:
+    """The retrieval query of a fixed request: a different value means the query wording changed."""
+    from .rag_pipeline import RetrievalPlan  # imported here: rag_pipeline uses this module
+    return RetrievalPlan(SimpleNamespace(grade="Grade 0", chapter=["x"], material_type="M", difficulty="D")).user_query
+
+
+class MaterializedRetrieval:
+    """
+    Lookup table of precomputed retrieval results: for every (grade, chapter, material type,
+    difficulty) of the fixed option lists, the best MAX_TOP_K (vectorstore row, score) pairs of
+    the chapter for its templated query. Serves a request without loading the embedding model
+    or scoring; any chapter that is missing, whose vectorstore changed since the build or that
+    the catalog now maps to another file or page range sends the whole request back to live retrieval.
+    """
+
+    def __init__(self, entries: Optional[Dict[str, Hits]] = None, files: Optional[Dict[str, float]] = None,
+                 chapters: Optional[Dict[str, list]] = None, path: Optional[str] = None):
+        self.entries = entries or {}
+        self.files = files or {}
+        self.chapters = chapters or {}  # chapter_key -> chapter_source at build time
+        self.path = path
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _ranked(self, chapter: Chapter, material_type: str, difficulty: str) -> Optional[Hits]:
+        ranked = self.entries.get(entry_key(chapter, material_type, difficulty))
+        if ranked is None:
+            return None
+        try:
+            current = vectorstore_mtime(os.path.join(VECTORSTORE_DIR, chapter.file))
+        except OSError:
+            current = None
+        if self.files.get(chapter.file) != current or self.chapters.get(chapter_key(chapter)) != chapter_source(chapter):
+            with self._lock:
+                self.stale += 1
+            return None
+        return ranked
+
+    def lookup(self, plan) -> Optional[List[Hits]]:
+        """
+        Search results for every entry of plan.chapter_indexes, in order, like retrieve_chunks'
+        `chapter_hits`; None when the plan has to be retrieved live. Each chapter gets its own
+        top k, as in live retrieval; chapters that resolve to the same pages share the best k of their union.
+        """
+        if not self.entries or plan.scope != "chapter" or not plan.chapter_indexes:
+            return None
+        results = []
+        for _, chapters, index in plan.chapter_indexes:
+            k = resolve_top_k(plan.requested_k, chunked=index.store.is_chunked)
+            merged: Dict[int, float] = {}
+            for chapter in chapters:
+                ranked = self._ranked(chapter, plan.material_type, plan.difficulty)
+                if ranked is None:
+                    with self._lock:
+                        self.misses += 1
+                    return None
+                for row, score in ranked[:k]:
+                    if score > merged.get(row, float("-inf")):
+                        merged[row] = score
+            results.append(sorted(merged.items(), key=lambda hit: -hit[1])[:k])
+        with self._lock:
+            self.hits += 1
+        return results
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": MATERIALIZED_RETRIEVAL,
+                "path": self.path,
+                "entries": len(self.entries),
+                "files": len(self.files),
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+            }
+
+
+def build_materialized(path: str = MATERIALIZED_PATH, grades: Sequence[str] = GRADE_OPTIONS,
+                       material_types: Sequence[str] = MATERIAL_TYPE_OPTIONS,
+                       difficulties: Sequence[str] = DIFFICULTY_LEVEL_OPTIONS) -> MaterializedRetrieval:
+    """
+    Runs the live retrieval of every single-chapter request of the option lists (plans built by
+    plan_retrieval, all queries embedded in one batch) and writes the ranked rows to `path`.
+    """
+    from .rag_pipeline import plan_retrieval
+    from .embeddings import get_embedding_service
+
+    catalog = get_chapter_catalog()
+    jobs = []  # (key, chapter, plan)
+    for grade in grades:
+        for chapter in catalog.list_chapters(grade):
+            try:
+                for material_type in material_types:
+                    for difficulty in difficulties:
+                        request = SimpleNamespace(grade=grade, chapter=[chapter.name], material_type=material_type,
+                                                  difficulty=difficulty, top_k=MAX_TOP_K, sectioned=False)
+                        jobs.append((entry_key(chapter, material_type, difficulty), chapter, plan_retrieval(request)))
+            except (FileNotFoundError, ValueError) as ex:
+                logger.warning("Materialize: skipping %s / %s: %s", grade, chapter.name, ex)
+
+    entries: Dict[str, Hits] = {}
+    files: Dict[str, float] = {}
+    chapters: Dict[str, list] = {}
+    if jobs:
+        query_vecs = get_embedding_service().encode([plan.user_query for _, _, plan in jobs])
+        for (key, chapter, plan), query_vec in zip(jobs, query_vecs):
+            _, _, index = plan.chapter_indexes[0]
+            entries[key] = [(row, round(score, 6)) for row, score in index.search(query_vec, MAX_TOP_K)]
+            files[chapter.file] = vectorstore_mtime(os.path.join(VECTORSTORE_DIR, chapter.file))
+            chapters[chapter_key(chapter)] = chapter_source(chapter)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "version": FORMAT_VERSION,
+            "model": EMBEDDING_MODEL,
+            "query": query_fingerprint(),
+            "top_k": MAX_TOP_K,
+            "built_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "files": files,
+            "chapters": chapters,
+            "entries": entries,
+        }, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return MaterializedRetrieval(entries, files, chapters, path)
+
+
+def load_materialized(path: str = MATERIALIZED_PATH) -> MaterializedRetrieval:
+    """The table at `path`; an empty one (every lookup misses) if it is absent or out of date."""
+    if not MATERIALIZED_RETRIEVAL or not os.path.exists(path):
+        return MaterializedRetrieval(path=path)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as ex:
+        logger.warning("Cannot read materialized retrieval %s: %s", path, ex)
+        return MaterializedRetrieval(path=path)
+    problem = None
+    if data.get("version") != FORMAT_VERSION:
+        problem = f"format version {data.get('version')}"
+    elif data.get("model") != EMBEDDING_MODEL:
+        problem = f"built with embedding model {data.get('model')}"
+    elif data.get("query") != query_fingerprint():
+        problem = "built for a different retrieval query wording"
+    elif data.get("top_k", 0) < MAX_TOP_K:
+        problem = f"holds {data.get('top_k')} results per chapter, RETRIEVAL_MAX_TOP_K is {MAX_TOP_K}"
+    if problem:
+        logger.warning("Ignoring materialized retrieval %s: %s; rebuild it with `python -m app.materialized`",
+                       path, problem)
+        return MaterializedRetrieval(path=path)
+    entries = {key: [(int(row), float(score)) for row, score in hits] for key, hits in data["entries"].items()}
+    logger.info("Materialized retrieval: %d entries from %s", len(entries), path)
+    return MaterializedRetrieval(entries, data.get("files", {}), data.get("chapters", {}), path)
+
+
+_materialized: Optional[MaterializedRetrieval] = None
+_materialized_lock = threading.Lock()
+
+
+def get_materialized_retrieval() -> MaterializedRetrieval:
+    """Returns the process-wide lookup table, loading it on first use."""
+    global _materialized
+    if _materialized is None:
+        with _materialized_lock:
+            if _materialized is None:
+                _materialized = load_materialized()
+    return _materialized
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Precompute the retrieval results of every single-chapter request.")
+    parser.add_argument("--out", default=MATERIALIZED_PATH, help="File to write the lookup table to")
+    parser.add_argument("--grades", nargs="+", default=GRADE_OPTIONS, help="Grades to materialize (default: all)")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    table = build_materialized(args.out, grades=args.grades)
+    print(f"Materialized {len(table)} requests over {len(table.files)} vectorstores "
+          f"in {time.perf_counter() - start:.1f}s: {args.out}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,208 @@
+import os
+import re
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from .metrics import span
+from .prompts import (CBSE10_SECTIONS, CBSE10_TOTAL_MARKS, ContextBudgeter, ContextChunk, PaperSection,
+                      build_section_prompt, get_token_accounting, is_cbse10)
+
+# Whether Grade 10 question papers are written section by section when a request does not say (off: opt in per request)
+PAPER_SECTIONED = os.getenv("PAPER_SECTIONED", "0").strip().lower() not in ("0", "false", "no")
+PAPER_SECTION_CONCURRENCY = int(os.getenv("PAPER_SECTION_CONCURRENCY", "6"))
+# Context tokens per section prompt; each section gets its own slice of the retrieved passages
+PAPER_SECTION_CONTEXT_TOKENS = int(os.getenv("PAPER_SECTION_CONTEXT_TOKENS", "3000"))
+# Passages retrieved per chapter for a sectioned paper when the request does not set top_k
+PAPER_SECTION_TOP_K = int(os.getenv("PAPER_SECTION_TOP_K", "8"))
+# Extra attempts for a section that comes back with fewer questions than required (e.g. truncated)
+PAPER_SECTION_RETRIES = int(os.getenv("PAPER_SECTION_RETRIES", "1"))
+
+logger = logging.getLogger(__name__)
+
+# A numbered line: "12. ", "12) ", "Q12. ", "Question 12: "; not every one starts a question (see question_starts)
+_QUESTION = re.compile(r"^[ \t]*(?:Q\.?[ \t]*|Question[ \t]+)?(\d{1,3})[ \t]*[.):][ \t]+", re.MULTILINE | re.IGNORECASE)
+_MARKS = re.compile(r"[\[(][ \t]*(\d+)[ \t]*marks?[ \t]*[\])]", re.IGNORECASE)
+
+
+def use_sections(grade: str, material_type: str, max_marks: Optional[int], sectioned: Optional[bool] = None) -> bool:
+    """
+    Whether a request is generated as a sectioned paper: CBSE Class 10 question papers of the
+    standard 80 marks, when the request asks for it, or when it does not say and PAPER_SECTIONED is on.
+    """
+    if not is_cbse10(grade, material_type) or max_marks not in (None, 0, CBSE10_TOTAL_MARKS):
+        return False
+    return PAPER_SECTIONED if sectioned is None else bool(sectioned)
+
+
+def slice_context(chunks: Sequence[ContextChunk],
+                  sections: Sequence[PaperSection] = CBSE10_SECTIONS) -> Dict[str, List[ContextChunk]]:
+    """
+    Deals the retrieved passages out to the sections so they write about different material:
+    each chapter's passages go round-robin by score, starting one section further on for every
+    chapter, so each section sees every chapter when there are enough passages. A section left
+    without any passage gets all of them.
+    """
+    by_source: Dict[str, List[ContextChunk]] = {}
+    for chunk in chunks:
+        by_source.setdefault(chunk.source, []).append(chunk)
+    slices: Dict[str, List[ContextChunk]] = {section.key: [] for section in sections}
+    for offset, source_chunks in enumerate(by_source.values()):
+        for i, chunk in enumerate(sorted(source_chunks, key=lambda c: -c.score)):
+            slices[sections[(offset + i) % len(sections)].key].append(chunk)
+    for key, chosen in slices.items():
+        if not chosen:
+            slices[key] = list(chunks)
+        else:
+            # Back in retrieval order, so passages stay grouped by chapter
+            order = {id(chunk): i for i, chunk in enumerate(chunks)}
+            chosen.sort(key=lambda c: order[id(c)])
+    return slices
+
+
+def question_starts(text: str) -> List["re.Match"]:
+    """
+    The numbered lines of a section that start a question. A question runs until its marks trailer,
+    so a numbered line inside an unfinished question (a list in a case-study passage, say) only
+    starts a new one if it carries the next number in the section's own numbering.
+    """
+    starts: List["re.Match"] = []
+    for match in _QUESTION.finditer(text):
+        if starts:
+            previous = starts[-1]
+            finished = _MARKS.search(text, previous.end(), match.start()) is not None
+            if not finished and int(match.group(1)) != int(previous.group(1)) + 1:
+                continue
+        starts.append(match)
+    return starts
+
+
+def renumber(text: str, first: int) -> Tuple[str, int]:
+    """Renumbers the questions of a section first, first + 1, ... and returns (text, question count)."""
+    text = text.strip()
+    starts = question_starts(text)
+    parts = []
+    position = 0
+    for i, match in enumerate(starts):
+        parts.append(text[position:match.start()])
+        parts.append(f"{first + i}. ")
+        position = match.end()
+    parts.append(text[position:])
+    return "".join(parts), len(starts)
+
+
+def question_marks(text: str) -> List[Optional[int]]:
+    """The marks shown on each question of a section (the largest bracketed value, None if none is shown)."""
+    starts = [m.start() for m in question_starts(text)]
+    marks = []
+    for start, end in zip(starts, starts[1:] + [len(text)]):
+        values = [int(v) for v in _MARKS.findall(text, start, end)]
+        marks.append(max(values) if values else None)
+    return marks
+
+
+class SectionResult:
+    """One generated section after renumbering, with any problems found by check()."""
+
+    def __init__(self, section: PaperSection, text: str, attempts: int):
+        self.section = section
+        self.text, self.questions = renumber(text, section.first)
+        self.marks = question_marks(self.text)
+        self.attempts = attempts
+        self.problems = self.check()
+
+    def check(self) -> List[str]:
+        section = self.section
+        problems = []
+        if self.questions != section.count:
+            problems.append(f"{section.count} questions expected, {self.questions} found")
+        wrong = [section.first + i for i, m in enumerate(self.marks) if m is not None and m != section.marks]
+        if wrong:
+            problems.append(f"questions {', '.join(map(str, wrong))} not marked {section.marks_label}")
+        return problems
+
+    @property
+    def total_marks(self) -> int:
+        """Marks of the questions written, counting each at the section's marks per question."""
+        return min(self.questions, self.section.count) * self.section.marks
+
+
+def generate_section(llm, grade: str, chapter_label: str, difficulty: str, section: PaperSection,
+                     chunks: Sequence[ContextChunk]) -> SectionResult:
+    """Writes one section with one LLM call, retried when it comes back short of questions."""
+    budgeter = ContextBudgeter(max_tokens=PAPER_SECTION_CONTEXT_TOKENS)
+    prompt = build_section_prompt(grade, chapter_label, difficulty, section, chunks, budgeter)
+    result = None
+    for attempt in range(1, PAPER_SECTION_RETRIES + 2):
+        with span("paper_section", section=section.key, attempt=attempt, prompt_tokens=prompt.prompt_tokens):
+            text = llm.complete(prompt.text)
+        if not text:
+            raise ValueError(f"{llm.name} returned an empty response for {section.label}, {section.title}.")
+        get_token_accounting().record(prompt, text, label=f"section {section.key}")
+        result = SectionResult(section, text, attempt)
+        if result.questions >= section.count:
+            break
+        logger.warning("%s (%s) attempt %d: %s", section.label, section.key, attempt, "; ".join(result.problems))
+    return result
+
+
+def paper_header(grade: str, chapter_label: str, sections: Sequence[PaperSection] = CBSE10_SECTIONS) -> str:
+    questions = sum(section.count for section in sections)
+    labels = sorted({section.label.split()[-1] for section in sections})
+    return (
+        f"{grade} Question Paper\n"
+        f"Chapters: {chapter_label}\n"
+        f"Maximum Marks: {sum(section.total for section in sections)}\n\n"
+        "General Instructions:\n"
+        f"1. This question paper contains {questions} questions in {len(labels)} sections, "
+        f"Section {labels[0]} to Section {labels[-1]}.\n"
+        "2. All questions are compulsory. Internal choice is provided in some questions.\n"
+    )
+
+
+def section_concurrency(sections: Sequence[PaperSection] = CBSE10_SECTIONS,
+                        limit: int = PAPER_SECTION_CONCURRENCY) -> int:
+    """Number of section calls a paper has in flight at once."""
+    return max(1, min(limit, len(sections)))
+
+
+def iter_sectioned_paper(grade: str, chapter_label: str, difficulty: str, chunks: Sequence[ContextChunk], llm,
+                         progress=None, sections: Sequence[PaperSection] = CBSE10_SECTIONS,
+                         concurrency: int = PAPER_SECTION_CONCURRENCY) -> Iterator[str]:
+    """
+    Writes every section concurrently, each from its own slice of the context, and yields the
+    paper in order: the header, then each section as soon as it and all sections before it are
+    done. Wall-clock time is about that of the slowest section. The questions are renumbered to
+    the pattern and the mark total is checked; mismatches are logged (the paper is still returned).
+    `progress`, if given, is called as progress("paper_section", ...) as each section is emitted.
+    At most `concurrency` section calls run at once.
+    """
+    slices = slice_context(chunks, sections)
+    results: List[SectionResult] = []
+    with ThreadPoolExecutor(max_workers=section_concurrency(sections, concurrency),
+                            thread_name_prefix="paper-section") as pool:
+        futures = [pool.submit(generate_section, llm, grade, chapter_label, difficulty, section, slices[section.key])
+                   for section in sections]
+        try:
+            yield paper_header(grade, chapter_label, sections)
+            for i, future in enumerate(futures):
+                result = future.result()
+                results.append(result)
+                if progress is not None:
+                    progress("paper_section", section=result.section.key, done=i + 1, total=len(sections),
+                             progress=45 + 50 * (i + 1) // len(sections))
+                heading = result.section.heading
+                if i and sections[i - 1].label == result.section.label:
+                    heading = heading.replace(result.section.label, result.section.label + " (continued)", 1)
+                yield f"\n{heading}\n\n{result.text}\n"
+        finally:
+            for future in futures:
+                future.cancel()
+
+    expected = sum(section.total for section in sections)
+    written = sum(result.total_marks for result in results)
+    problems = [f"{r.section.key}: {p}" for r in results for p in r.problems]
+    if written != expected or problems:
+        logger.warning("Sectioned paper: %d of %d marks written; %s", written, expected, "; ".join(problems) or "ok")
+    else:
+        logger.info("Sectioned paper: %d questions, %d marks", sum(r.questions for r in results), written)
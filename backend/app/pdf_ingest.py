@@ -1,14 +1,32 @@
 import os
+import sys
 import json
-from typing import List, Dict, Any
+import time
+import hashlib
+import argparse
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, List, Dict, Any, Optional, Tuple
 from PyPDF2 import PdfReader
 from sentence_transformers import SentenceTransformer
 from tqdm import tqdm
+from .vectorstore import save_vectorstore_binary, vectorstore_exists
+from .utils import estimate_word_tokens, split_text_into_token_chunks
 
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))  # backend/
 DATA_DIR = os.path.join(BASE_DIR, "data")
 VECTORSTORE_DIR = os.path.join(BASE_DIR, "vectorstores")
 EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+# "float16" halves the on-disk size of the embedding matrices
+VECTORSTORE_DTYPE = os.getenv("VECTORSTORE_DTYPE", "float32")
+# Source hash of every ingested PDF, so unchanged files are skipped on the next run
+MANIFEST_PATH = os.path.join(VECTORSTORE_DIR, "ingest_manifest.json")
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 1)))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "64"))
+# Pages are split into chunks of at most this many word pieces (MiniLM truncates at 256);
+# 0 embeds whole pages as before
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "200"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "40"))
 
 def extract_text_by_page(pdf_path: str) -> List[str]:
     reader = PdfReader(pdf_path)
@@ -19,23 +37,16 @@ def vectorize_chunks(chunks: List[str], model) -> List[List[float]]:
 
 def process_pdf(pdf_path: str, model) -> List[Dict[str, Any]]:
     file_name = os.path.basename(pdf_path)
-    pages = extract_text_by_page(pdf_path)
-    embeddings = vectorize_chunks(pages, model)
-    records = []
-    for i, (text, emb) in enumerate(zip(pages, embeddings)):
-        if text.strip():
-            records.append({
-                "file_name": file_name,
-                "page": i + 1,
-                "text": text,
-                "embedding": emb
-            })
-    return records
-
-def save_vectorstore(records: List[Dict[str, Any]], out_path: str):
-    os.makedirs(os.path.dirname(out_path), exist_ok=True)
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(records, f, ensure_ascii=False, indent=2)
+    units = chunk_pages(extract_text_by_page(pdf_path), count_tokens=make_token_counter(model))
+    embeddings = vectorize_chunks([unit["text"] for unit in units], model)
+    return [{"file_name": file_name, **unit, "embedding": emb} for unit, emb in zip(units, embeddings)]
+
+def save_vectorstore(records: List[Dict[str, Any]], out_path: str) -> str:
+    """
+    Saves records in the memory-mapped binary vectorstore format (see app.vectorstore).
+    `out_path` may still be the legacy '<name>_vectors.json' name; it is used as the base name.
+    """
+    return save_vectorstore_binary(records, out_path, dtype=VECTORSTORE_DTYPE)
 
 def find_pdfs_recursively(root_dir: str) -> List[str]:
     pdf_files = []
@@ -45,21 +56,180 @@ def find_pdfs_recursively(root_dir: str) -> List[str]:
                 pdf_files.append(os.path.join(dirpath, f))
     return pdf_files
 
-def main():
+def make_token_counter(model) -> Callable[[str], int]:
+    """Counts word pieces with the embedding model's own tokenizer (cached per word)."""
+    tokenizer = getattr(model, "tokenizer", None)
+    if tokenizer is None:
+        return estimate_word_tokens
+
+    @lru_cache(maxsize=200000)
+    def count(word: str) -> int:
+        return max(1, len(tokenizer.tokenize(word)))
+    return count
+
+def chunk_pages(pages: List[str], chunk_tokens: int = CHUNK_TOKENS, overlap: int = CHUNK_OVERLAP,
+                count_tokens: Optional[Callable[[str], int]] = None) -> List[Dict[str, Any]]:
+    """
+    Turns extracted pages into the units that get embedded: token-bounded, overlapping chunks
+    carrying page and character-offset provenance, or whole pages when chunk_tokens is 0.
+    Empty pages are dropped.
+    """
+    units = []
+    for page_no, text in enumerate(pages, start=1):
+        if not text.strip():
+            continue
+        if chunk_tokens <= 0:
+            units.append({"page": page_no, "text": text})
+            continue
+        for chunk_no, (chunk, start, end) in enumerate(
+                split_text_into_token_chunks(text, chunk_tokens, overlap, count_tokens)):
+            units.append({"page": page_no, "chunk": chunk_no, "char_start": start, "char_end": end, "text": chunk})
+    return units
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_manifest(path: str = MANIFEST_PATH) -> Dict[str, Dict[str, Any]]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_manifest(manifest: Dict[str, Dict[str, Any]], path: str = MANIFEST_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def output_path_for(pdf_path: str) -> str:
+    # Create a relative path for output, e.g. evs/4/grade4_evs_part1_vectors.json
+    rel_path = os.path.relpath(pdf_path, DATA_DIR)
+    return os.path.join(VECTORSTORE_DIR, rel_path[:-len(".pdf")] + "_vectors.json")
+
+def _extract_job(pdf_path: str) -> Tuple[str, List[str]]:
+    """Process-pool worker: returns the text of every page of one PDF."""
+    return pdf_path, extract_text_by_page(pdf_path)
+
+class _PendingDoc:
+    """A PDF whose chunks are waiting for (or partway through) embedding."""
+
+    def __init__(self, pdf_path: str, units: List[Dict[str, Any]], sha256: str):
+        self.pdf_path = pdf_path
+        self.units = units
+        self.sha256 = sha256
+        self.embeddings: List[Optional[List[float]]] = [None] * len(units)
+        self.remaining = len(units)
+
+    def records(self) -> List[Dict[str, Any]]:
+        file_name = os.path.basename(self.pdf_path)
+        return [
+            {"file_name": file_name, **unit, "embedding": emb}
+            for unit, emb in zip(self.units, self.embeddings)
+        ]
+
+def ingest(pdf_files: List[str], model, workers: int = INGEST_WORKERS, batch_size: int = INGEST_BATCH_SIZE,
+           force: bool = False, chunk_tokens: int = CHUNK_TOKENS, chunk_overlap: int = CHUNK_OVERLAP) -> Dict[str, Any]:
+    """
+    Extracts text from new or changed PDFs on a process pool, splits pages into chunks and
+    embeds them in batches of `batch_size` (chunks of several PDFs share a batch).
+    Returns run statistics.
+    """
+    manifest = load_manifest()
+    chunking = {"tokens": chunk_tokens, "overlap": chunk_overlap}
+    count_tokens = make_token_counter(model)
+    todo = []
+    skipped = 0
+    for pdf_path in pdf_files:
+        rel = os.path.relpath(pdf_path, DATA_DIR).replace(os.sep, "/")
+        sha = file_sha256(pdf_path)
+        entry = manifest.get(rel)
+        # A PDF without extractable text (a scan) is recorded with 0 chunks and no vectorstore
+        if (not force and entry and entry.get("sha256") == sha and entry.get("chunking") == chunking
+                and (entry.get("chunks") == 0 or vectorstore_exists(output_path_for(pdf_path)))):
+            skipped += 1
+            continue
+        todo.append((pdf_path, rel, sha))
+    print(f"{len(todo)} new or changed PDF(s), {skipped} unchanged.")
+
+    stats = {"pdfs": len(todo), "skipped": skipped, "pages": 0, "embeddings": 0, "embed_seconds": 0.0}
+    if not todo:
+        return stats
+
+    started = time.perf_counter()
+    queue: List[Tuple[_PendingDoc, int]] = []  # (document, index into its units) awaiting embedding
+
+    def flush(limit: Optional[int] = None):
+        while queue and (limit is None or len(queue) >= limit):
+            batch = queue[:batch_size]
+            del queue[:batch_size]
+            t0 = time.perf_counter()
+            vectors = model.encode([doc.units[i]["text"] for doc, i in batch], batch_size=batch_size,
+                                   convert_to_numpy=True)
+            stats["embed_seconds"] += time.perf_counter() - t0
+            stats["embeddings"] += len(batch)
+            for (doc, i), vec in zip(batch, vectors):
+                doc.embeddings[i] = vec.tolist()
+                doc.remaining -= 1
+                if doc.remaining == 0:
+                    finish(doc)
+
+    def finish(doc: _PendingDoc):
+        out_base = save_vectorstore(doc.records(), output_path_for(doc.pdf_path))
+        rel = os.path.relpath(doc.pdf_path, DATA_DIR).replace(os.sep, "/")
+        manifest[rel] = {"sha256": doc.sha256, "output": os.path.relpath(out_base, VECTORSTORE_DIR).replace(os.sep, "/"),
+                         "chunks": len(doc.units), "chunking": chunking, "ingested_at": time.time()}
+        save_manifest(manifest)
+        print(f"Processed {doc.pdf_path} → {out_base} ({len(doc.units)} chunks embedded)")
+
+    sha_by_path = {pdf_path: sha for pdf_path, _, sha in todo}
+    rel_by_path = {pdf_path: rel for pdf_path, rel, _ in todo}
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(_extract_job, pdf_path) for pdf_path, _, _ in todo]
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Processing PDFs"):
+            pdf_path, pages = future.result()
+            stats["pages"] += len(pages)
+            units = chunk_pages(pages, chunk_tokens, chunk_overlap, count_tokens)
+            if not units:
+                print(f"Skipped {pdf_path}: No extractable text.")
+                manifest[rel_by_path[pdf_path]] = {"sha256": sha_by_path[pdf_path], "output": None, "chunks": 0,
+                                                   "chunking": chunking, "ingested_at": time.time()}
+                save_manifest(manifest)
+                continue
+            doc = _PendingDoc(pdf_path, units, sha_by_path[pdf_path])
+            queue.extend((doc, i) for i in range(len(units)))
+            flush(limit=batch_size)
+    flush()
+    stats["total_seconds"] = time.perf_counter() - started
+    return stats
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Embed the PDFs under data/ into vectorstores/.")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS, help="Processes used for text extraction")
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE, help="Pages per embedding call")
+    parser.add_argument("--force", action="store_true", help="Re-ingest PDFs even if they are unchanged")
+    parser.add_argument("--chunk-tokens", type=int, default=CHUNK_TOKENS,
+                        help="Max word pieces per chunk (0 = embed whole pages)")
+    parser.add_argument("--chunk-overlap", type=int, default=CHUNK_OVERLAP,
+                        help="Word pieces shared by neighbouring chunks")
+    args = parser.parse_args(argv)
+
     os.makedirs(VECTORSTORE_DIR, exist_ok=True)
-    model = SentenceTransformer(EMBEDDING_MODEL)
     pdf_files = find_pdfs_recursively(DATA_DIR)
-    for pdf_path in tqdm(pdf_files, desc="Processing PDFs"):
-        records = process_pdf(pdf_path, model)
-        if not records:
-            print(f"Skipped {pdf_path}: No extractable text.")
-            continue
-        # Create a relative path for output, e.g. evs/4/grade4_evs_part1_vectors.json
-        rel_path = os.path.relpath(pdf_path, DATA_DIR)
-        out_filename = rel_path.replace(".pdf", "_vectors.json")
-        out_path = os.path.join(VECTORSTORE_DIR, out_filename)
-        save_vectorstore(records, out_path)
-        print(f"Processed {pdf_path} → {out_path} ({len(records)} pages embedded)")
+    model = SentenceTransformer(EMBEDDING_MODEL)
+    stats = ingest(pdf_files, model, workers=args.workers, batch_size=args.batch_size, force=args.force,
+                   chunk_tokens=args.chunk_tokens, chunk_overlap=args.chunk_overlap)
+
+    total = stats.get("total_seconds", 0.0)
+    if total:
+        print(f"Ingested {stats['pdfs']} PDF(s), {stats['pages']} pages, {stats['embeddings']} embeddings "
+              f"in {total:.1f}s")
+        print(f"  {stats['pages'] / total:.1f} pages/sec overall, "
+              f"{stats['embeddings'] / max(stats['embed_seconds'], 1e-9):.1f} embeddings/sec while embedding")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main(sys.argv[1:])
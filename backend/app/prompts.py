@@ -0,0 +1,423 @@
+import os
+import re
+import logging
+import threading
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Context tokens sent per request at most (DeepSeek bills and waits on every prompt token)
+PROMPT_CONTEXT_TOKENS = int(os.getenv("PROMPT_CONTEXT_TOKENS", "8000"))
+# Passages whose word shingles overlap this much with an already chosen one are dropped
+PROMPT_DEDUPE_THRESHOLD = float(os.getenv("PROMPT_DEDUPE_THRESHOLD", "0.85"))
+SHINGLE_WORDS = 3
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r"[A-Za-z]+")
+_OTHER = re.compile(r"[^\sA-Za-z]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Fast local estimate of the DeepSeek token count of text, without loading a tokenizer:
+    one token per English word plus one per further 6 letters of long words, and one per
+    digit, punctuation mark or non-Latin character. Within ~10% on textbook prose.
+    """
+    if not text:
+        return 0
+    words = _WORD.findall(text)
+    return len(words) + sum((len(w) - 1) // 6 for w in words if len(w) > 6) + len(_OTHER.findall(text))
+
+
+# ---- TEMPLATES ----
+
+CBSE10_PATTERN = """
+For Class 10 Question Papers, strictly follow this structure for the entire paper:
+
+Section A: Multiple Choice Questions (MCQs): Questions 1-18, 1 mark each, no internal choice.
+Section A: Assertion-Reason Questions: Questions 19-20, 1 mark each, no internal choice.
+Section B: Very Short Answer (VSA) Questions: Questions 21-25, 2 marks each, 2 questions have internal choice.
+Section C: Short Answer (SA) Questions: Questions 26-31, 3 marks each, 2 questions have internal choice.
+Section D: Long Answer (LA) Questions: Questions 32-35, 5 marks each, 2 questions have internal choice.
+Section E: Case Study-Based Questions: Questions 36-38, 4 marks each, all have internal choice.
+
+Show section labels, marks per section, question numbers, and clearly specify internal choice as per the above structure. The sum of marks must match the total.
+""".strip()
+
+
+class PaperSection:
+    """One part of the CBSE Class 10 pattern that can be written on its own: questions first..last, `marks` each."""
+
+    def __init__(self, key: str, label: str, title: str, first: int, last: int, marks: int, choice: str, guidance: str):
+        self.key = key
+        self.label = label
+        self.title = title
+        self.first = first
+        self.last = last
+        self.marks = marks
+        self.choice = choice
+        self.guidance = guidance
+
+    @property
+    def count(self) -> int:
+        return self.last - self.first + 1
+
+    @property
+    def total(self) -> int:
+        return self.count * self.marks
+
+    @property
+    def marks_label(self) -> str:
+        return f"{self.marks} mark" + ("s" if self.marks != 1 else "")
+
+    @property
+    def heading(self) -> str:
+        return (f"{self.label}: {self.title} (Questions {self.first}-{self.last}, "
+                f"{self.marks_label} each, {self.total} marks)")
+
+
+# CBSE10_PATTERN split into the parts a sectioned paper generates concurrently
+CBSE10_SECTIONS = (
+    PaperSection("mcq", "Section A", "Multiple Choice Questions (MCQs)", 1, 18, 1, "No internal choice.",
+                 "Each question has exactly four options labelled (a), (b), (c) and (d), one of them correct."),
+    PaperSection("assertion_reason", "Section A", "Assertion-Reason Questions", 19, 20, 1, "No internal choice.",
+                 "Each question states an Assertion (A) and a Reason (R), followed by these four options: "
+                 "(a) Both A and R are true and R is the correct explanation of A. "
+                 "(b) Both A and R are true but R is not the correct explanation of A. "
+                 "(c) A is true but R is false. (d) A is false but R is true."),
+    PaperSection("vsa", "Section B", "Very Short Answer (VSA) Questions", 21, 25, 2,
+                 "Exactly 2 questions have an internal choice.", "Each question can be answered in two or three sentences."),
+    PaperSection("sa", "Section C", "Short Answer (SA) Questions", 26, 31, 3,
+                 "Exactly 2 questions have an internal choice.", "Each question needs an answer of about 50 to 80 words."),
+    PaperSection("la", "Section D", "Long Answer (LA) Questions", 32, 35, 5,
+                 "Exactly 2 questions have an internal choice.", "Each question needs an answer of about 120 words."),
+    PaperSection("case_study", "Section E", "Case Study-Based Questions", 36, 38, 4,
+                 "Every question has an internal choice in its last sub-part.",
+                 "Each question starts with a short case or passage taken from the context, followed by sub-parts "
+                 "(i), (ii) and (iii) worth 1, 1 and 2 marks."),
+)
+CBSE10_TOTAL_MARKS = sum(section.total for section in CBSE10_SECTIONS)
+
+
+class PromptTemplate:
+    """
+    The static text of one prompt variant, joined once: a head and a tail around the context,
+    with {field} placeholders for the per-request values. render() is two str.format calls.
+    """
+
+    def __init__(self, name: str, head: str, tail: str):
+        self.name = name
+        self.head = head
+        self.tail = tail
+        # Tokens of the fixed wording, for reporting how much of a prompt is boilerplate
+        self.static_tokens = estimate_tokens(re.sub(r"\{\w+\}", "", head + tail))
+
+    def render(self, context: str, **values) -> str:
+        return self.head.format(**values) + context + self.tail.format(**values)
+
+
+def material_kind(material_type: str) -> str:
+    kind = material_type.strip().lower()
+    return kind if kind in ("question paper", "lesson plan") else "other"
+
+
+def is_cbse10(grade: str, material_type: str) -> bool:
+    return material_kind(material_type) == "question paper" and grade in ("10", "Grade 10")
+
+
+@lru_cache(maxsize=None)
+def compile_template(kind: str, cbse10: bool = False, with_marks: bool = False) -> PromptTemplate:
+    """
+    The context-aware, anti-hallucination prompt for a material kind ("question paper",
+    "lesson plan" or "other"), the CBSE Class 10 paper pattern and whether max marks are set.
+    """
+    question_paper = kind == "question paper"
+    lesson_plan = kind == "lesson plan"
+    marks = question_paper and with_marks
+    head = [
+        "You are an expert educator. "
+        "Based ONLY on the following material provided from the backend/data/ directory of the project, "
+        "which is the {grade} textbook, Chapters: '{chapter_label}', "
+        "generate a {material} suitable for students. "
+        "Distribute the questions and content across ALL the listed chapters, ensuring each chapter is represented in the final output. "
+    ]
+    if marks:
+        head.append("For question papers, the total maximum marks is {max_marks}. ")
+    if question_paper and cbse10:
+        head.append("\n" + CBSE10_PATTERN + "\n")
+    elif marks:
+        head.append(
+            "Divide the paper into sections as follows: "
+            "SECTION-A should be worth 10% of total marks ({section_a} marks), "
+            "SECTION-B should be 50% of total marks ({section_b} marks), "
+            "SECTION-C should be 40% of total marks ({section_c} marks). "
+            "Distribute the questions and marks accordingly. Clearly mention the marks for each section and each question. "
+        )
+    if lesson_plan:
+        head.append(
+            "For lesson plans, provide a clear sequence of teaching objectives, key points, teaching steps, activities, and assessment, but use ONLY content from the provided context. "
+            "The lesson plan MUST align with the principles and guidelines of the Government of India's NEW EDUCATION POLICY (NEP), 2020, explicitly mentioning inclusive education. "
+            "All activities should be designed to be accessible and supportive for students with disabilities, focusing on universal design for learning, differentiated instruction, and reasonable accommodations. "
+            "Highlight how each activity addresses diverse learning needs and promotes participation by students with disabilities. "
+        )
+    head.append(
+        "The questions, activities, or plan should be at a {difficulty} difficulty level, "
+        "and must be strictly derived ONLY from the provided context. "
+        "Do NOT use your own knowledge or add facts that are not in the context. "
+        "Do not hallucinate or invent information. "
+        "If the context does not provide enough material, only use what is available and do not make up content.\n\n"
+        "IMPORTANT: Do NOT skip, summarize, or combine questions. Write out every question in full. Placeholders, continuations, or summaries (such as 'questions 11-18 continue similarly...' or 'remaining questions follow the same pattern') are strictly NOT allowed.\n"
+        "For Class 10 and Class 12: It is absolutely critical to provide EVERY required question in FULL, without omission or summarization, as these are board-level papers. No skipping, summarizing, or use of placeholders is permitted under any circumstances. Every question must be explicitly written out.\n\n"
+        "---\n"
+        "Context:\n"
+    )
+    tail = ["\n---\nInstructions:\n"]
+    if lesson_plan:
+        tail.append("- If material type is lesson plan, structure as: Objectives, Key Points, Teaching Steps, Activities, Assessment, based ONLY on context.\n")
+    if marks:
+        tail.append("- If material type is question paper, ensure each section and each question has marks shown, and the total matches the given maximum marks.\n")
+    tail.append(
+        "- Generate only the {material}, not answers.\n"
+        "- Cover all main concepts found in the context, and ensure questions/content are distributed across ALL listed chapters.\n"
+        "- Ensure alignment with {difficulty} level.\n"
+        "- Number the questions or activities clearly.\n"
+        "- Do not repeat instructions or context in output.\n"
+        "- Do not hallucinate or use any information outside the provided context.\n"
+        "- Do not use any markdown syntax (e.g., *, **, ---, etc.); output must be in plain text only.\n"
+    )
+    name = kind + (" cbse10" if question_paper and cbse10 else "") + (" marks" if marks else "")
+    return PromptTemplate(name, "".join(head), "".join(tail))
+
+
+@lru_cache(maxsize=None)
+def compile_section_template() -> PromptTemplate:
+    """The prompt for one PaperSection of a sectioned CBSE Class 10 question paper."""
+    head = (
+        "You are an expert educator. "
+        "Based ONLY on the following material provided from the backend/data/ directory of the project, "
+        "which is the {grade} textbook, Chapters: '{chapter_label}', "
+        "write one section of a CBSE Class 10 board question paper: {label}, {title}. "
+        "The other sections are written separately, so write ONLY this section.\n\n"
+        "Write exactly {count} questions, numbered {first} to {last}, each worth {marks_label}. {choice} {guidance}\n"
+        "The questions should be at a {difficulty} difficulty level, "
+        "and must be strictly derived ONLY from the provided context. "
+        "Do NOT use your own knowledge or add facts that are not in the context. "
+        "Do not hallucinate or invent information. "
+        "Distribute the questions across ALL the listed chapters.\n\n"
+        "IMPORTANT: Do NOT skip, summarize, or combine questions. Write out every question in full. Placeholders, continuations, or summaries are strictly NOT allowed.\n\n"
+        "---\n"
+        "Context:\n"
+    )
+    tail = (
+        "\n---\nInstructions:\n"
+        "- Do not write a section heading or general instructions; start directly with question {first}.\n"
+        "- Start every question on a new line with its number and a period, e.g. '{first}. '.\n"
+        "- Label sub-parts (i), (ii), (iii) and options (a), (b), (c), (d); never start a sub-part or option with a digit.\n"
+        "- End every question with its marks in square brackets: [{marks_label}].\n"
+        "- For an internal choice, write OR on its own line between the two alternatives, both under the same question number.\n"
+        "- Generate only the questions, not answers.\n"
+        "- Do not repeat instructions or context in output.\n"
+        "- Do not use any markdown syntax (e.g., *, **, ---, etc.); output must be in plain text only.\n"
+    )
+    return PromptTemplate("question paper cbse10 section", head, tail)
+
+
+# ---- CONTEXT BUDGET ----
+
+class ContextChunk:
+    """One retrieved passage: its text, similarity score, source vectorstore and chunk ids."""
+
+    __slots__ = ("text", "score", "source", "ids", "_tokens", "_shingles")
+
+    def __init__(self, text: str, score: float, source: str, ids: Sequence[str]):
+        self.text = text
+        self.score = float(score)
+        self.source = source
+        self.ids = list(ids)
+        self._tokens: Optional[int] = None
+        self._shingles: Optional[frozenset] = None
+
+    @property
+    def tokens(self) -> int:
+        if self._tokens is None:
+            self._tokens = estimate_tokens(self.text)
+        return self._tokens
+
+    @property
+    def shingles(self) -> frozenset:
+        if self._shingles is None:
+            words = self.text.lower().split()
+            self._shingles = frozenset(
+                hash(tuple(words[i:i + SHINGLE_WORDS])) for i in range(max(1, len(words) - SHINGLE_WORDS + 1))
+            )
+        return self._shingles
+
+
+def overlap(a: ContextChunk, b: ContextChunk) -> float:
+    """Share of the smaller passage's word shingles that also occur in the other one."""
+    smaller = min(len(a.shingles), len(b.shingles))
+    if not smaller:
+        return 0.0
+    return len(a.shingles & b.shingles) / smaller
+
+
+class ContextBudgeter:
+    """
+    Chooses the context of a prompt: near-duplicate passages are dropped (the higher-priority
+    copy is kept) and passages are added by priority until max_tokens is reached. The best
+    passage of every source comes first so each requested chapter stays represented, then the
+    rest by score. The chosen passages keep their retrieval order (grouped by chapter).
+    """
+
+    def __init__(self, max_tokens: int = PROMPT_CONTEXT_TOKENS, dedupe_threshold: float = PROMPT_DEDUPE_THRESHOLD):
+        self.max_tokens = max_tokens
+        self.dedupe_threshold = dedupe_threshold
+
+    def select(self, chunks: Sequence[ContextChunk]) -> Tuple[List[ContextChunk], Dict[str, int]]:
+        """Returns (chosen chunks, counts of "duplicates" and "over_budget" chunks left out)."""
+        leaders: Dict[str, int] = {}
+        for i, chunk in enumerate(chunks):
+            best = leaders.get(chunk.source)
+            if best is None or chunk.score > chunks[best].score:
+                leaders[chunk.source] = i
+        first = sorted(leaders.values(), key=lambda i: -chunks[i].score)
+        leading = set(first)
+        rest = sorted((i for i in range(len(chunks)) if i not in leading), key=lambda i: -chunks[i].score)
+
+        chosen: List[int] = []
+        tokens = 0
+        duplicates = over_budget = 0
+        for i in first + rest:
+            chunk = chunks[i]
+            if any(overlap(chunk, chunks[j]) >= self.dedupe_threshold for j in chosen):
+                duplicates += 1
+                continue
+            if chosen and tokens + chunk.tokens > self.max_tokens:
+                over_budget += 1
+                continue
+            chosen.append(i)
+            tokens += chunk.tokens
+        return [chunks[i] for i in sorted(chosen)], {"duplicates": duplicates, "over_budget": over_budget}
+
+
+# ---- PROMPTS ----
+
+class BuiltPrompt:
+    """A rendered prompt with the chunks it contains and its token estimates."""
+
+    def __init__(self, text: str, template: PromptTemplate, chunks: List[ContextChunk], dropped: Dict[str, int]):
+        self.text = text
+        self.template = template
+        self.chunks = chunks
+        self.dropped = dropped
+        self.prompt_tokens = estimate_tokens(text)
+        self.context_tokens = sum(chunk.tokens for chunk in chunks)
+
+    @property
+    def chunk_ids(self) -> List[str]:
+        return [chunk_id for chunk in self.chunks for chunk_id in chunk.ids]
+
+
+def build_prompt(grade: str, chapter_label: str, material_type: str, difficulty: str,
+                 max_marks: Optional[int], chunks: Sequence[ContextChunk],
+                 budgeter: Optional[ContextBudgeter] = None) -> BuiltPrompt:
+    """Budgets the retrieved chunks and renders them into the precompiled template for the request."""
+    template = compile_template(material_kind(material_type), is_cbse10(grade, material_type), bool(max_marks))
+    chosen, dropped = (budgeter or ContextBudgeter()).select(chunks)
+    marks = max_marks or 0
+    text = template.render(
+        "\n".join(chunk.text for chunk in chosen),
+        grade=grade,
+        chapter_label=chapter_label,
+        material=material_type.lower(),
+        difficulty=difficulty.lower(),
+        max_marks=max_marks,
+        section_a=int(0.1 * marks),
+        section_b=int(0.5 * marks),
+        section_c=int(0.4 * marks),
+    )
+    return BuiltPrompt(text, template, chosen, dropped)
+
+
+def build_section_prompt(grade: str, chapter_label: str, difficulty: str, section: PaperSection,
+                         chunks: Sequence[ContextChunk], budgeter: Optional[ContextBudgeter] = None) -> BuiltPrompt:
+    """Budgets a section's slice of the retrieved chunks and renders the section template."""
+    template = compile_section_template()
+    chosen, dropped = (budgeter or ContextBudgeter()).select(chunks)
+    text = template.render(
+        "\n".join(chunk.text for chunk in chosen),
+        grade=grade,
+        chapter_label=chapter_label,
+        difficulty=difficulty.lower(),
+        label=section.label,
+        title=section.title,
+        count=section.count,
+        first=section.first,
+        last=section.last,
+        marks_label=section.marks_label,
+        choice=section.choice,
+        guidance=section.guidance,
+    )
+    return BuiltPrompt(text, template, chosen, dropped)
+
+
+# ---- TOKEN ACCOUNTING ----
+
+class TokenAccounting:
+    """Running totals of the estimated tokens sent to and received from the LLM."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.cached = 0
+        self.prompt_tokens = 0
+        self.context_tokens = 0
+        self.completion_tokens = 0
+        self.saved_prompt_tokens = 0  # prompts not sent because the generation cache answered
+        self.dropped_duplicates = 0
+        self.dropped_over_budget = 0
+
+    def record(self, prompt: BuiltPrompt, completion: str, cached: bool = False, label: str = "") -> None:
+        completion_tokens = estimate_tokens(completion)
+        with self._lock:
+            self.requests += 1
+            self.dropped_duplicates += prompt.dropped.get("duplicates", 0)
+            self.dropped_over_budget += prompt.dropped.get("over_budget", 0)
+            if cached:
+                self.cached += 1
+                self.saved_prompt_tokens += prompt.prompt_tokens
+            else:
+                self.prompt_tokens += prompt.prompt_tokens
+                self.context_tokens += prompt.context_tokens
+                self.completion_tokens += completion_tokens
+        logger.info(
+            "Tokens%s: prompt=%d context=%d completion=%d chunks=%d dropped=%d dup/%d budget template='%s'%s",
+            " " + label if label else "", prompt.prompt_tokens, prompt.context_tokens, completion_tokens,
+            len(prompt.chunks), prompt.dropped.get("duplicates", 0), prompt.dropped.get("over_budget", 0),
+            prompt.template.name, " (cached)" if cached else "",
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            sent = self.requests - self.cached
+            return {
+                "requests": self.requests,
+                "cached": self.cached,
+                "prompt_tokens": self.prompt_tokens,
+                "context_tokens": self.context_tokens,
+                "completion_tokens": self.completion_tokens,
+                "avg_prompt_tokens": round(self.prompt_tokens / sent, 1) if sent else 0.0,
+                "avg_completion_tokens": round(self.completion_tokens / sent, 1) if sent else 0.0,
+                "saved_prompt_tokens": self.saved_prompt_tokens,
+                "dropped_duplicates": self.dropped_duplicates,
+                "dropped_over_budget": self.dropped_over_budget,
+                "context_budget": PROMPT_CONTEXT_TOKENS,
+            }
+
+
+_accounting = TokenAccounting()
+
+
+def get_token_accounting() -> TokenAccounting:
+    """Returns the process-wide token counters."""
+    return _accounting
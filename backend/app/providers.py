@@ -0,0 +1,288 @@
+import os
+import json
+import time
+import queue
+import logging
+import threading
+from collections import deque
+from typing import Dict, Iterator, Optional
+
+from . import llm_client
+from .deepseek_infer import MODEL_NAME, ask_deepseek, stream_deepseek
+from .metrics import REGISTRY, Counter
+
+# Provider used when a request does not name one, and the one raced against it for slow requests
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "deepseek").strip().lower()
+LLM_HEDGE_PROVIDER = os.getenv("LLM_HEDGE_PROVIDER", "").strip().lower() or None
+# The secondary is started once the primary has gone this percentile of its recent first-token latencies
+# without a token, clamped to [LLM_HEDGE_MIN_DELAY, LLM_HEDGE_MAX_DELAY] seconds
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "1"))
+LLM_HEDGE_MAX_DELAY = float(os.getenv("LLM_HEDGE_MAX_DELAY", "60"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))  # below this, wait LLM_HEDGE_MAX_DELAY
+LLM_HEDGE_WINDOW = int(os.getenv("LLM_HEDGE_WINDOW", "200"))  # recent first-token latencies kept per provider
+
+OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434").rstrip("/")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "deepseek-r1:7b")
+
+HEDGES = REGISTRY.register(Counter(
+    "diro_llm_hedges_total", "Hedged LLM requests that started the secondary, by winner", ["primary", "secondary", "winner"]))
+
+logger = logging.getLogger(__name__)
+
+
+class LLMProvider:
+    """One LLM backend: complete() returns the whole answer, stream() yields content deltas."""
+
+    name = "base"
+    model = ""
+
+    def complete(self, prompt: str, system_prompt: Optional[str] = None, max_tokens: int = 2048) -> str:
+        return "".join(self.stream(prompt, system_prompt, max_tokens))
+
+    def stream(self, prompt: str, system_prompt: Optional[str] = None, max_tokens: int = 2048) -> Iterator[str]:
+        raise NotImplementedError
+
+
+class DeepSeekProvider(LLMProvider):
+    """The DeepSeek cloud chat-completions API (app.deepseek_infer)."""
+
+    name = "deepseek"
+    model = MODEL_NAME
+
+    def complete(self, prompt: str, system_prompt: Optional[str] = None, max_tokens: int = 2048) -> str:
+        return ask_deepseek(prompt, system_prompt=system_prompt, max_tokens=max_tokens)
+
+    def stream(self, prompt: str, system_prompt: Optional[str] = None, max_tokens: int = 2048) -> Iterator[str]:
+        return stream_deepseek(prompt, system_prompt=system_prompt, max_tokens=max_tokens)
+
+
+class OllamaProvider(LLMProvider):
+    """A local Ollama server's /api/chat endpoint (streamed as newline-delimited JSON)."""
+
+    name = "ollama"
+
+    def __init__(self, base_url: str = OLLAMA_URL, model: str = OLLAMA_MODEL):
+        self.url = f"{base_url}/api/chat"
+        self.model = model
+
+    def _payload(self, prompt: str, system_prompt: Optional[str], max_tokens: int, stream: bool) -> dict:
+        messages = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        messages.append({"role": "user", "content": prompt})
+        return {"model": self.model, "messages": messages, "stream": stream, "options": {"num_predict": max_tokens}}
+
+    def complete(self, prompt: str, system_prompt: Optional[str] = None, max_tokens: int = 2048) -> str:
+        data = llm_client.post_json(self.url, self._payload(prompt, system_prompt, max_tokens, False))
+        if data.get("error"):
+            raise RuntimeError(f"Ollama error: {data['error']}")
+        return (data.get("message") or {}).get("content") or ""
+
+    def stream(self, prompt: str, system_prompt: Optional[str] = None, max_tokens: int = 2048) -> Iterator[str]:
+        for line in llm_client.stream_lines(self.url, self._payload(prompt, system_prompt, max_tokens, True)):
+            if not line:
+                continue
+            chunk = json.loads(line)
+            if chunk.get("error"):
+                raise RuntimeError(f"Ollama error: {chunk['error']}")
+            delta = (chunk.get("message") or {}).get("content") or ""
+            if delta:
+                yield delta
+            if chunk.get("done"):
+                break
+
+
+class LatencyTracker:
+    """Recent first-token latencies of one provider, for the hedging deadline."""
+
+    def __init__(self, window: int = LLM_HEDGE_WINDOW):
+        self._samples = deque(maxlen=max(1, window))
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * q / 100.0))]
+
+    def deadline(self) -> float:
+        with self._lock:
+            enough = len(self._samples) >= LLM_HEDGE_MIN_SAMPLES
+        if not enough:
+            return LLM_HEDGE_MAX_DELAY
+        return min(LLM_HEDGE_MAX_DELAY, max(LLM_HEDGE_MIN_DELAY, self.percentile(LLM_HEDGE_PERCENTILE)))
+
+
+_trackers: Dict[str, LatencyTracker] = {}
+_trackers_lock = threading.Lock()
+
+
+def get_latency_tracker(provider_name: str) -> LatencyTracker:
+    with _trackers_lock:
+        tracker = _trackers.get(provider_name)
+        if tracker is None:
+            tracker = _trackers[provider_name] = LatencyTracker()
+        return tracker
+
+
+class _Racer(threading.Thread):
+    """Runs one provider's stream on its own thread and posts (racer, kind, value) events to a queue."""
+
+    def __init__(self, provider: LLMProvider, events: "queue.Queue", prompt: str,
+                 system_prompt: Optional[str], max_tokens: int):
+        super().__init__(name=f"llm-{provider.name}", daemon=True)
+        self.provider = provider
+        self.events = events
+        self.args = (prompt, system_prompt, max_tokens)
+        self.started_at = 0.0
+        # Upstream calls made on this thread: cancelling it keeps a queued call from being sent
+        # and shuts down the connection of one in progress
+        self.scope = llm_client.CancelScope()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.scope.cancelled.is_set()
+
+    def cancel(self) -> None:
+        self.scope.cancel()
+
+    def run(self) -> None:
+        self.started_at = time.perf_counter()
+        first = True
+        try:
+            with self.scope:
+                stream = self.provider.stream(*self.args)
+                try:
+                    for delta in stream:
+                        if first:
+                            # Recorded even for a cancelled loser, so slow samples keep the p95 honest
+                            get_latency_tracker(self.provider.name).observe(time.perf_counter() - self.started_at)
+                            first = False
+                        if self.cancelled:
+                            break
+                        self.events.put((self, "delta", delta))
+                finally:
+                    close = getattr(stream, "close", None)
+                    if close is not None:
+                        close()  # releases the in-flight slot and the connection of a cancelled stream
+            self.events.put((self, "done", None))
+        except Exception as ex:
+            self.events.put((self, "error", ex))
+
+
+class HedgedProvider(LLMProvider):
+    """
+    Races a secondary provider against a slow primary. The primary starts alone; if it has not
+    produced its first token by the deadline (the primary's recent p95 first-token latency) or
+    fails before producing one, the secondary is started too and whichever yields a token first
+    wins. The loser is cancelled at once: if it is still queued for an in-flight slot it never
+    sends its request, and if it is waiting for its first token its connection is shut down.
+    """
+
+    def __init__(self, primary: LLMProvider, secondary: LLMProvider):
+        self.primary = primary
+        self.secondary = secondary
+        self.name = f"{primary.name}+{secondary.name}"
+        self.model = f"{primary.model}|{secondary.model}"
+
+    def stream(self, prompt: str, system_prompt: Optional[str] = None, max_tokens: int = 2048) -> Iterator[str]:
+        events: "queue.Queue" = queue.Queue()
+        primary = _Racer(self.primary, events, prompt, system_prompt, max_tokens)
+        secondary = _Racer(self.secondary, events, prompt, system_prompt, max_tokens)
+        primary.start()
+        hedge_at = time.monotonic() + get_latency_tracker(self.primary.name).deadline()
+        running = {primary}
+        hedged = False
+        errors = []
+        winner = None
+        first = None
+
+        def start_secondary(reason: str) -> None:
+            logger.info("Hedging %s with %s (%s)", self.primary.name, self.secondary.name, reason)
+            secondary.start()
+            running.add(secondary)
+
+        try:
+            while winner is None:
+                timeout = None if hedged else max(0.0, hedge_at - time.monotonic())
+                try:
+                    racer, kind, value = events.get(timeout=timeout)
+                except queue.Empty:
+                    hedged = True
+                    start_secondary("first-token deadline passed")
+                    continue
+                if kind in ("delta", "done"):
+                    winner, first = racer, value
+                    continue
+                running.discard(racer)
+                errors.append(value)
+                if not hedged:
+                    hedged = True
+                    start_secondary(f"primary failed: {value}")
+                elif not running:
+                    raise errors[0]
+
+            if hedged:
+                HEDGES.inc(primary=self.primary.name, secondary=self.secondary.name, winner=winner.provider.name)
+            for racer in (primary, secondary):
+                if racer is not winner:
+                    racer.cancel()
+
+            if first is None:
+                return  # the winner finished without producing any content
+            yield first
+            while True:
+                racer, kind, value = events.get()
+                if racer is not winner:
+                    continue
+                if kind == "delta":
+                    yield value
+                elif kind == "done":
+                    return
+                else:
+                    raise value
+        finally:
+            # Also stops the winner when the caller abandons the stream
+            primary.cancel()
+            secondary.cancel()
+
+
+PROVIDERS: Dict[str, LLMProvider] = {
+    "deepseek": DeepSeekProvider(),
+    "ollama": OllamaProvider(),
+}
+
+
+def get_provider(name: Optional[str] = None) -> LLMProvider:
+    """
+    The provider for a request: `name` ("deepseek" or "ollama") or LLM_PROVIDER by default, hedged
+    with LLM_HEDGE_PROVIDER when that is set to a different provider.
+    """
+    name = (name or LLM_PROVIDER).strip().lower()
+    provider = PROVIDERS.get(name)
+    if provider is None:
+        raise ValueError(f"Unknown LLM provider '{name}'. Choose one of: {', '.join(PROVIDERS)}")
+    if LLM_HEDGE_PROVIDER and LLM_HEDGE_PROVIDER != name:
+        secondary = PROVIDERS.get(LLM_HEDGE_PROVIDER)
+        if secondary is None:
+            raise ValueError(f"Unknown LLM_HEDGE_PROVIDER '{LLM_HEDGE_PROVIDER}'")
+        return HedgedProvider(provider, secondary)
+    return provider
+
+
+def stats() -> dict:
+    with _trackers_lock:
+        trackers = dict(_trackers)
+    return {
+        "default": LLM_PROVIDER,
+        "hedge": LLM_HEDGE_PROVIDER,
+        "first_token_p50": {name: t.percentile(50) for name, t in trackers.items()},
+        "first_token_p95": {name: t.percentile(95) for name, t in trackers.items()},
+        "hedge_deadline": {name: t.deadline() for name, t in trackers.items()},
+    }
@@ -1,315 +1,329 @@
 import os
-import json
-import numpy as np
-from sentence_transformers import SentenceTransformer
-from .deepseek_infer import ask_deepseek
+import time
+import logging
+from typing import Iterator, List, Optional, Tuple
+from .providers import get_provider
+from .embeddings import get_embedding_service
+from .vectorstore import base_path, vectorstore_exists
+from .vectorstore_cache import get_vectorstore_cache
+from .retrieval import DEFAULT_SCOPE_TOP_K, merge_chunk_passages, resolve_top_k
+from .generation_cache import get_generation_cache, make_cache_key
+from .catalog import get_chapter_catalog, grade_key, normalize_chapter
+from .ann_index import get_ann_index
+from .prompts import BuiltPrompt, ContextChunk, build_prompt, get_token_accounting
+from .paper import PAPER_SECTION_TOP_K, iter_sectioned_paper, use_sections
+from .materialized import get_materialized_retrieval
+from .metrics import STAGE_SECONDS, span
+
+logger = logging.getLogger(__name__)
 
 VECTORSTORE_DIR = os.path.join(os.path.dirname(__file__), "..", "vectorstores")
-EMBEDDING_MODEL = "all-MiniLM-L6-v2"
-
-# Explicit mapping of chapter names (normalized) to vectorstore files
-# Update these mappings as per your actual chapters and files!
-CHAPTER_FILE_MAP = {
-    # Grade 1 EVS
-    ("1", "myself"): "evs/1/G1EVS-01_vectors.json",
-    ("1", "my body"): "evs/1/G1EVS-01_vectors.json",
-    ("1", "keeping clean"): "evs/1/G1EVS-02_vectors.json",
-    ("1", "my family"): "evs/1/G1EVS-02_vectors.json",
-    ("1", "food we eat"): "evs/1/G1EVS-03_vectors.json",
-    ("1", "my home"): "evs/1/G1EVS-03_vectors.json",
-    ("1", "water"): "evs/1/G1EVS-03_vectors.json",
-    ("1", "clothes we wear"): "evs/1/G1EVS-03_vectors.json",
-    ("1", "my neighbourhood"): "evs/1/G1EVS-04_vectors.json",
-    ("1", "neighbourhood helpers"): "evs/1/G1EVS-04_vectors.json",
-    ("1", "festivals"): "evs/1/G1EVS-04_vectors.json",
-    ("1", "good habits and manners"): "evs/1/G1EVS-04_vectors.json",
-    ("1", "means of transport and communication"): "evs/1/G1EVS-04_vectors.json",
-    ("1", "plants around us"): "evs/1/G1EVS-05_vectors.json",
-    ("1", "animals around us"): "evs/1/G1EVS-05_vectors.json",
-    ("1", "earth and sky"): "evs/1/G1EVS-05_vectors.json",
-    # Grade 4 EVS
-    ("4", "our family"): "evs/4/G4EVS-01_vectors.json",
-    ("4", "know your tongue and teeth"): "evs/4/G4EVS-01_vectors.json",
-    ("4", "animals around us"): "evs/4/G4EVS-02_vectors.json",
-    ("4", "birds: beaks and claws"): "evs/4/G4EVS-02_vectors.json",
-    ("4", "parts of a plant"): "evs/4/G4EVS-03_vectors.json",
-    ("4", "food and health"): "evs/4/G4EVS-03_vectors.json",
-    ("4", "from farm to our plate"): "evs/4/G4EVS-03_vectors.json",
-    ("4", "means of recreation"): "evs/4/G4EVS-04_vectors.json",
-    ("4", "travel and money"): "evs/4/G4EVS-04_vectors.json",
-    ("4", "transport and communication"): "evs/4/G4EVS-04_vectors.json",
-    ("4", "safety first"): "evs/4/G4EVS-05_vectors.json",
-    ("4", "india: a land of rich culture"): "evs/4/G4EVS-05_vectors.json",
-    ("4", "we need each-other"): "evs/4/G4EVS-05_vectors.json",
-    ("4", "water for living"): "evs/4/G4EVS-06_vectors.json",
-    ("4", "waste management"): "evs/4/G4EVS-06_vectors.json",
-    ("4", "know about matter"): "evs/4/G4EVS-07_vectors.json",
-    ("4", "measurement"): "evs/4/G4EVS-07_vectors.json",
-    # Grade 5 EVS (example, update as needed)
-    ("5", "the changing families"): "evs/5/G5EVS-01_vectors.json",
-    ("5", "breathing in, breathing out"): "evs/5/G5EVS-01_vectors.json",
-    ("5", "wellness: health and hygiene"): "evs/5/G5EVS-01_vectors.json",
-    ("5", "super senses of animals"): "evs/5/G5EVS-02_vectors.json",
-    ("5", "adaptation in plants"): "evs/5/G5EVS-02_vectors.json",
-    ("5", "from taste to digestion"): "evs/5/G5EVS-02_vectors.json",
-    ("5", "life in water"): "evs/5/G5EVS-03_vectors.json",
-    ("5", "preservation of food"): "evs/5/G5EVS-03_vectors.json",
-    ("5", "games we play"): "evs/5/G5EVS-04_vectors.json",
-    ("5", "safety during calamities"): "evs/5/G5EVS-04_vectors.json",
-    ("5", "save fuels"): "evs/5/G5EVS-05_vectors.json",
-    ("5", "dignity of labour"): "evs/5/G5EVS-05_vectors.json",
-    ("5", "our heritage buildings"): "evs/5/G5EVS-05_vectors.json",
-    ("5", "every drop is precious"): "evs/5/G5EVS-05_vectors.json",
-    ("5", "force: push or pull"): "evs/5/G5EVS-06_vectors.json",
-    ("5", "simple machines"): "evs/5/G5EVS-06_vectors.json",
-    ("5", "shelter for all"): "evs/5/G5EVS-06_vectors.json",
-    ("5", "forest and tribal life"): "evs/5/G5EVS-06_vectors.json",
-    ("5", "the spirit of adventure"): "evs/5/G5EVS-07_vectors.json",
-    ("5", "adventure in space"): "evs/5/G5EVS-07_vectors.json",
-    # Grade 9 English (example, update as needed)
-    # --- BEEHIVE TEXTBOOK ---
-    ("9", "beehive: the fun they had"): "Grade 9/English/iebe101_vectors.json",
-    ("9", "beehive: the road not taken"): "Grade 9/English/iebe101_vectors.json",
-    ("9", "beehive: the sound of music"): "Grade 9/English/iebe102_vectors.json",
-    ("9", "beehive: wind"): "Grade 9/English/iebe102_vectors.json",
-    ("9", "beehive: the little girl"): "Grade 9/English/iebe103_vectors.json",
-    ("9", "beehive: rain on the roof"): "Grade 9/English/iebe103_vectors.json",
-    ("9", "beehive: a truly beautiful mind"): "Grade 9/English/iebe104_vectors.json",
-    ("9", "beehive: the lake isle of innisfree"): "Grade 9/English/iebe104_vectors.json",
-    ("9", "beehive: the snake and the mirror"): "Grade 9/English/iebe105_vectors.json",
-    ("9", "beehive: a legend of the northland"): "Grade 9/English/iebe105_vectors.json",
-    ("9", "beehive: my childhood"): "Grade 9/English/iebe106_vectors.json",
-    ("9", "beehive: no men are foreign"): "Grade 9/English/iebe106_vectors.json",
-    ("9", "beehive: reach for the top"): "Grade 9/English/iebe107_vectors.json",
-    ("9", "beehive: on killing a tree"): "Grade 9/English/iebe107_vectors.json",
-    ("9", "beehive: kathmandu"): "Grade 9/English/iebe108_vectors.json",
-    ("9", "beehive: a slumber did my spirit seal"): "Grade 9/English/iebh108_vectors.json",
-    ("9", "beehive: if i were you"): "Grade 9/English/iebe109_vectors.json",
-
-    # --- MOMENTS TEXTBOOK ---
-    ("9", "moments: the lost child"): "Grade 9/English/iemo101_vectors.json",
-    ("9", "moments: the adventures of toto"): "Grade 9/English/iemo102_vectors.json",
-    ("9", "moments: iswaran the storyteller"): "Grade 9/English/iemo103_vectors.json",
-    ("9", "moments: in the kingdom of fools"): "Grade 9/English/iemo104_vectors.json",
-    ("9", "moments: the happy prince"): "Grade 9/English/iemo105_vectors.json",
-    ("9", "moments: weathering the storm in ersama"): "Grade 9/English/iemo106_vectors.json",
-    ("9", "moments: the last leaf"): "Grade 9/English/iemo107_vectors.json",
-    ("9", "moments: a house is not a home"): "Grade 9/English/iemo108_vectors.json",
-    ("9", "moments: the accidental tourist"): "Grade 9/English/iemo109_vectors.json",
-    ("9", "moments: the beggar"): "Grade 9/English/iemo110_vectors.json",
-
-    # Grade 10 English (example, update as needed)
-    # --- FIRST FLIGHT TEXTBOOK ---
-    ("10", "first flight: a letter to god"): "Grade 10/English/jeff101_vectors.json",
-    ("10", "first flight: dust of snow"): "Grade 10/English/jeff101_vectors.json",
-    ("10", "first flight: fire and ice"): "Grade 10/English/jeff101_vectors.json",
-    ("10", "first flight: nelson mandela: long walk to freedom"): "Grade 10/English/jeff102_vectors.json",
-    ("10", "first flight: a tiger in the zoo"): "Grade 10/English/jeff102_vectors.json",
-    ("10", "first flight: two stories about flying"): "Grade 10/English/jeff103_vectors.json",
-    ("10", "first flight: his first flight"): "Grade 10/English/jeff103_vectors.json",
-    ("10", "first flight: black aeroplane"): "Grade 10/English/jeff103_vectors.json",
-    ("10", "first flight: how to tell wild animals"): "Grade 10/English/jeff103_vectors.json",
-    ("10", "first flight: the ball poem"): "Grade 10/English/jeff103_vectors.json",
-    ("10", "first flight: from the diary of anne frank"): "Grade 10/English/jeff104_vectors.json",
-    ("10", "first flight: amanda!"): "Grade 10/English/jeff104_vectors.json",
-    ("10", "first flight: glimpses of india"): "Grade 10/English/jeff105_vectors.json",
-    ("10", "first flight: a baker from goa"): "Grade 10/English/jeff105_vectors.json",
-    ("10", "first flight: coorg"): "Grade 10/English/jeff105_vectors.json",
-    ("10", "first flight: tea from assam"): "Grade 10/English/jeff105_vectors.json",
-    ("10", "first flight: the trees"): "Grade 10/English/jeff105_vectors.json",
-    ("10", "first flight: mijbil the otter"): "Grade 10/English/jeff106_vectors.json",
-    ("10", "first flight: fog"): "Grade 10/English/jeff106_vectors.json",
-    ("10", "first flight: madam rides the bus"): "Grade 10/English/jeff107_vectors.json",
-    ("10", "first flight: the tale of custard the dragon"): "Grade 10/English/jeff107_vectors.json",
-    ("10", "first flight: the sermon at benares"): "Grade 10/English/jeff108_vectors.json",
-    ("10", "first flight: for anne gregory"): "Grade 10/English/jeff108_vectors.json",
-    ("10", "first flight: the proposal"): "Grade 10/English/jeff109_vectors.json",
-
-    # --- FOOTPRINTS WITHOUT FEET TEXTBOOK ---
-    ("10", "footprints: a triumph of surgery"): "Grade 10/English/jefp101_vectors.json",
-    ("10", "footprints: the thief's story"): "Grade 10/English/jefp102_vectors.json",
-    ("10", "footprints: the midnight visitor"): "Grade 10/English/jefp103_vectors.json",
-    ("10", "footprints: a question of trust"): "Grade 10/English/jefp104_vectors.json",
-    ("10", "footprints: footprints without feet"): "Grade 10/English/jefp105_vectors.json",
-    ("10", "footprints: the making of a scientist"): "Grade 10/English/jefp106_vectors.json",
-    ("10", "footprints: the necklace"): "Grade 10/English/jefp107_vectors.json",
-    ("10", "footprints: the hack driver"): "Grade 10/English/jefp108_vectors.json",
-    ("10", "footprints: bholi"): "Grade 10/English/jefp109_vectors.json",
-    ("10", "footprints: the book that saved the earth"): "Grade 10/English/jefp110_vectors.json",
-
-    # --- Grade 1 English Grammar
-    ("1", "nouns"): "eng/1/noun 1_vectors.json",
-    ("1", "prepositions"): "eng/1/preposition 1_vectors.json",
-
-    # --- Grade 5 English Grammar
-    ("5", "adverbs"): "eng/5/adverb 5_vectors.json",
-    ("5", "tenses"): "eng/5/tenses 5_vectors.json",
-    # Add more mappings as needed for other grades/subjects
-}
-
-def normalize_chapter(text):
-    return text.strip().lower().replace("’", "'").replace("‘", "'").replace("–", "-").replace("—", "-")
+
+# Bump whenever the prompt wording below changes, so cached generations of the old prompt are not reused
+PROMPT_TEMPLATE_VERSION = "1"
 
 def get_vectorstore_filename(grade: str, chapter: str) -> str:
-    grade_num = ''.join(filter(str.isdigit, grade))
-    chapter_key = normalize_chapter(chapter)
-    key = (grade_num, chapter_key)
-    if key in CHAPTER_FILE_MAP:
-        return CHAPTER_FILE_MAP[key]
-    for (g, ch), filename in CHAPTER_FILE_MAP.items():
-        if g == grade_num and chapter_key in ch:
-            return filename
-    raise ValueError(f"Cannot match chapter name to any vectorstore file: {chapter}")
-
-def generate_material(request):
-    print("Starting generation...")
-    grade = request.grade
-
-    # ---- Handle chapters as list ----
-    chapters = request.chapter
-    if isinstance(chapters, str):
-        chapters = [c.strip() for c in chapters.split(",") if c.strip()]
-    elif isinstance(chapters, list):
-        chapters = [c.strip() for c in chapters if isinstance(c, str) and c.strip()]
-    else:
-        chapters = []
-
-    material_type = request.material_type
-    difficulty = request.difficulty
-    max_marks = getattr(request, "max_marks", None)
-
-    # Gather vectorstore files for all chapters
-    vectorstore_files = []
-    for chapter in chapters:
-        vectorstore_files.append(get_vectorstore_filename(grade, chapter))
-
-    # Collect vectors from all relevant files, tagging chapter
-    vectors = []
-    for chapter, vectorstore_file in zip(chapters, vectorstore_files):
-        vectorstore_path = os.path.join(VECTORSTORE_DIR, vectorstore_file)
-        if not os.path.exists(vectorstore_path):
-            raise FileNotFoundError(f"Vectorstore file not found for {grade}, {chapter}: {vectorstore_file}")
-        with open(vectorstore_path, "r", encoding="utf-8") as f:
-            file_vectors = json.load(f)
-            # Tag the chapter in each vector if not already present
-            for v in file_vectors:
-                if "source_chapter" not in v:
-                    v["source_chapter"] = chapter
-            vectors.extend(file_vectors)
-    print(f"Loaded vectors: {len(vectors)} from chapters: {chapters}")
-
-    model = SentenceTransformer(EMBEDDING_MODEL)
-    print("Loaded embedding model.")
-    user_query = (
-        f"Create a {material_type.lower()} for {grade}, Chapters: '{', '.join(chapters)}', with {difficulty.lower()} difficulty."
-    )
-    query_vec = model.encode([user_query])[0]
-    print("Encoded query.")
-
-    def cosine_sim(a, b):
-        a = np.array(a)
-        b = np.array(b)
-        return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
-
-    # NEW: For each chapter, get top N chunks
-    top_chunks = []
-    N = 2  # Number of top chunks per chapter
-    for chapter in chapters:
-        chapter_vectors = [entry for entry in vectors if entry.get("source_chapter", "").lower() == chapter.lower()]
-        if chapter_vectors:
-            scored = sorted(
-                [(cosine_sim(query_vec, entry["embedding"]), entry["text"]) for entry in chapter_vectors],
-                reverse=True, key=lambda x: x[0]
-            )
-            top_chunks.extend([text for _, text in scored[:N]])
-
-    print(f"Selected top {N} chunks per chapter for {len(chapters)} chapters.")
-
-    # ---- CONTEXT-AWARE, ANTI-HALLUCINATION PROMPT ----
-    cbse10_pattern = """
-For Class 10 Question Papers, strictly follow this structure for the entire paper:
-
-Section A: Multiple Choice Questions (MCQs): Questions 1-18, 1 mark each, no internal choice.
-Section A: Assertion-Reason Questions: Questions 19-20, 1 mark each, no internal choice.
-Section B: Very Short Answer (VSA) Questions: Questions 21-25, 2 marks each, 2 questions have internal choice.
-Section C: Short Answer (SA) Questions: Questions 26-31, 3 marks each, 2 questions have internal choice.
-Section D: Long Answer (LA) Questions: Questions 32-35, 5 marks each, 2 questions have internal choice.
-Section E: Case Study-Based Questions: Questions 36-38, 4 marks each, all have internal choice.
-
-Show section labels, marks per section, question numbers, and clearly specify internal choice as per the above structure. The sum of marks must match the total.
-""".strip()
-
-    prompt = (
-        f"You are an expert educator. "
-        f"Based ONLY on the following material provided from the backend/data/ directory of the project, "
-        f"which is the {grade} textbook, Chapters: '{', '.join(chapters)}', "
-        f"generate a {material_type.lower()} suitable for students. "
-        f"Distribute the questions and content across ALL the listed chapters, ensuring each chapter is represented in the final output. "
-        +
-        (
-            f"For question papers, the total maximum marks is {max_marks}. "
-            if material_type.strip().lower() == "question paper" and max_marks else ""
-        )
-        +
-        (
-            "\n" + cbse10_pattern + "\n"
-            if material_type.strip().lower() == "question paper" and (grade == "10" or grade == "Grade 10")
-            else
-            (
-                f"Divide the paper into sections as follows: "
-                f"SECTION-A should be worth 10% of total marks ({int(0.1*max_marks)} marks), "
-                f"SECTION-B should be 50% of total marks ({int(0.5*max_marks)} marks), "
-                f"SECTION-C should be 40% of total marks ({int(0.4*max_marks)} marks). "
-                "Distribute the questions and marks accordingly. Clearly mention the marks for each section and each question. "
-                if material_type.strip().lower() == "question paper" and max_marks else ""
-            )
-        )
-        +
-        (
-            "For lesson plans, provide a clear sequence of teaching objectives, key points, teaching steps, activities, and assessment, but use ONLY content from the provided context. "
-            "The lesson plan MUST align with the principles and guidelines of the Government of India's NEW EDUCATION POLICY (NEP), 2020, explicitly mentioning inclusive education. "
-            "All activities should be designed to be accessible and supportive for students with disabilities, focusing on universal design for learning, differentiated instruction, and reasonable accommodations. "
-            "Highlight how each activity addresses diverse learning needs and promotes participation by students with disabilities. "
-            if material_type.strip().lower() == "lesson plan" else ""
-        )
-        +
-        f"The questions, activities, or plan should be at a {difficulty.lower()} difficulty level, "
-        f"and must be strictly derived ONLY from the provided context. "
-        f"Do NOT use your own knowledge or add facts that are not in the context. "
-        f"Do not hallucinate or invent information. "
-        f"If the context does not provide enough material, only use what is available and do not make up content.\n\n"
-        "IMPORTANT: Do NOT skip, summarize, or combine questions. Write out every question in full. Placeholders, continuations, or summaries (such as 'questions 11-18 continue similarly...' or 'remaining questions follow the same pattern') are strictly NOT allowed.\n"
-        "For Class 10 and Class 12: It is absolutely critical to provide EVERY required question in FULL, without omission or summarization, as these are board-level papers. No skipping, summarizing, or use of placeholders is permitted under any circumstances. Every question must be explicitly written out.\n\n"
-        f"---\n"
-        f"Context:\n"
-        f"{chr(10).join(top_chunks)}\n"
-        f"---\n"
-        f"Instructions:\n"
-        +
-        (
-            "- If material type is lesson plan, structure as: Objectives, Key Points, Teaching Steps, Activities, Assessment, based ONLY on context.\n"
-            if material_type.strip().lower() == "lesson plan" else ""
-        )
-        +
-        (
-            "- If material type is question paper, ensure each section and each question has marks shown, and the total matches the given maximum marks.\n"
-            if material_type.strip().lower() == "question paper" and max_marks else ""
+    """Vectorstore file (relative to VECTORSTORE_DIR) of a chapter, via the chapter catalog."""
+    return get_chapter_catalog().resolve(grade, chapter).file
+
+def _report(progress, stage: str, **info):
+    """Calls the optional progress callback of generate_material."""
+    if progress is not None:
+        progress(stage, **info)
+
+def _load_chapter_indexes(grade: str, chapters):
+    """
+    Resolves chapters through the catalog and fetches one index per vectorstore file from the
+    shared cache. Chapters that share a file get their own page view of it, so each is searched
+    for its own top k. Returns [((file, page ranges), [catalog entries], ChapterIndex)]; chapters
+    that resolve to the same pages share one entry.
+    """
+    catalog = get_chapter_catalog()
+    groups = {}
+    with span("chapter_resolve", chapters=len(chapters)):
+        for chapter in chapters:
+            entry = catalog.resolve(grade, chapter)
+            groups.setdefault((entry.file, (entry.pages,) if entry.pages else None), []).append(entry)
+
+    cache = get_vectorstore_cache()
+    files = {}  # vectorstore file -> whole-file index
+    chapter_indexes = []
+    with span("vectorstore_load", files=len({key[0] for key in groups})):
+        for (vectorstore_file, pages), entries in groups.items():
+            whole = files.get(vectorstore_file)
+            if whole is None:
+                vectorstore_path = os.path.join(VECTORSTORE_DIR, vectorstore_file)
+                if not vectorstore_exists(vectorstore_path):
+                    raise FileNotFoundError(
+                        f"Vectorstore file not found for {grade}, {', '.join(e.name for e in entries)}: {vectorstore_file}"
+                    )
+                whole = files[vectorstore_file] = cache.get(vectorstore_path)
+            # A chapter without a page range (or whose pages hold no rows) covers the whole file
+            index = whole.page_view(pages) if pages else whole
+            if len(index) == 0:
+                index = whole
+            chapter_indexes.append(((vectorstore_file, pages), entries, index))
+    return chapter_indexes
+
+class RetrievalPlan:
+    """
+    A parsed request with its vectorstores resolved: everything retrieval needs except the
+    embedded query. Built by plan_retrieval; generate_batch plans many requests and embeds
+    and searches them together.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.grade = request.grade
+
+        # ---- Handle chapters as list ----
+        chapters = request.chapter
+        if isinstance(chapters, str):
+            chapters = [c.strip() for c in chapters.split(",") if c.strip()]
+        elif isinstance(chapters, list):
+            chapters = [c.strip() for c in chapters if isinstance(c, str) and c.strip()]
+        else:
+            chapters = []
+        self.chapters = chapters
+
+        self.material_type = request.material_type
+        self.difficulty = request.difficulty
+        self.max_marks = getattr(request, "max_marks", None)
+        # "chapter" (default) searches the named chapters; "book" and "grade" search every
+        # vectorstore of the named books/subjects or of the whole grade through the ANN index
+        self.scope = (getattr(request, "scope", None) or "chapter").strip().lower()
+        self.requested_k = getattr(request, "top_k", None)
+        # Grade 10 question papers may be written section by section (app.paper), each section from
+        # its own slice of the context, so more passages are retrieved for them
+        self.sectioned = use_sections(self.grade, self.material_type, self.max_marks, getattr(request, "sectioned", None))
+        if self.sectioned and not self.requested_k:
+            self.requested_k = PAPER_SECTION_TOP_K
+        self.chapter_indexes = []  # [((file, pages), catalog entries, ChapterIndex)] for scope "chapter"
+        self.ann_index = None
+        self.ann_filters = None
+        self.total_rows = 0
+
+    @property
+    def chapter_label(self) -> str:
+        if self.scope == "book":
+            return f"all chapters of {', '.join(self.chapters)}"
+        if self.scope == "grade":
+            return "all chapters"
+        return ', '.join(self.chapters)
+
+    @property
+    def user_query(self) -> str:
+        return (
+            f"Create a {self.material_type.lower()} for {self.grade}, Chapters: '{self.chapter_label}', with {self.difficulty.lower()} difficulty."
         )
-        +
-        f"- Generate only the {material_type.lower()}, not answers.\n"
-        f"- Cover all main concepts found in the context, and ensure questions/content are distributed across ALL listed chapters.\n"
-        f"- Ensure alignment with {difficulty.lower()} level.\n"
-        f"- Number the questions or activities clearly.\n"
-        f"- Do not repeat instructions or context in output.\n"
-        f"- Do not hallucinate or use any information outside the provided context.\n"
-        f"- Do not use any markdown syntax (e.g., *, **, ---, etc.); output must be in plain text only.\n"
+
+def plan_retrieval(request) -> RetrievalPlan:
+    """Parses a request and fetches the indexes it will search (from the shared caches)."""
+    plan = RetrievalPlan(request)
+    if plan.scope == "chapter":
+        plan.chapter_indexes = _load_chapter_indexes(plan.grade, plan.chapters)
+        plan.total_rows = sum(len(index) for _, _, index in plan.chapter_indexes)
+        logger.info("Loaded %d vectors from chapters: %s", plan.total_rows, plan.chapters)
+    else:
+        plan.ann_index = get_ann_index()
+        plan.ann_filters = plan.ann_index.scope_filters(plan.scope, plan.grade, plan.chapters)
+        mask = plan.ann_index.filter_mask(plan.ann_filters)
+        plan.total_rows = int(mask.sum()) if mask is not None else len(plan.ann_index)
+        logger.info("ANN index: %d rows in scope %s %s", plan.total_rows, plan.scope, plan.ann_filters)
+    return plan
+
+def chapter_top_k(plan: RetrievalPlan, index) -> int:
+    # k is per chapter; chapters sharing a file are searched separately, each over its own pages
+    return resolve_top_k(plan.requested_k, chunked=index.store.is_chunked)
+
+def retrieve_chunks(plan: RetrievalPlan, query_vec=None, chapter_hits=None) -> List[ContextChunk]:
+    """
+    Returns the retrieved passages of a plan with their scores and chunk ids. `chapter_hits`,
+    if given, holds the precomputed search results of every entry of plan.chapter_indexes, in order.
+    """
+    chunks = []
+    if plan.scope == "chapter":
+        # For each chapter, get the top k chunks (k is configurable per request)
+        for i, ((_, pages), _, index) in enumerate(plan.chapter_indexes):
+            if chapter_hits is not None:
+                hits = chapter_hits[i]
+            else:
+                hits = index.search(query_vec, chapter_top_k(plan, index))
+            source = os.path.relpath(index.store.path, VECTORSTORE_DIR).replace(os.sep, "/")
+            group = f"{source}:{pages}" if pages else source
+            for text, rows, score in merge_chunk_passages(index.store, [row for row, _ in hits], [s for _, s in hits]):
+                chunks.append(ContextChunk(text, score, group, [f"{source}#{row}" for row in rows]))
+    else:
+        top_k = resolve_top_k(plan.requested_k) if plan.requested_k else DEFAULT_SCOPE_TOP_K
+        hits = plan.ann_index.search(query_vec, top_k, plan.ann_filters)
+        # Texts are read from the (cached) vectorstores the hits came from, best file first
+        cache = get_vectorstore_cache()
+        by_file = {}
+        for vectorstore_file, row, score in hits:
+            by_file.setdefault(vectorstore_file, []).append((row, score))
+        for vectorstore_file, file_hits in by_file.items():
+            store = cache.get(os.path.join(VECTORSTORE_DIR, vectorstore_file)).store
+            source = base_path(vectorstore_file)
+            for text, rows, score in merge_chunk_passages(store, [r for r, _ in file_hits], [s for _, s in file_hits]):
+                chunks.append(ContextChunk(text, score, source, [f"{source}#{row}" for row in rows]))
+    logger.debug("Selected %d passages for %d chapters.", len(chunks), len(plan.chapters))
+    return chunks
+
+def retrieve_for_request(request, progress=None) -> Tuple[RetrievalPlan, List[ContextChunk]]:
+    """
+    Resolves the chapters of a request and retrieves their top chunks.
+    `progress`, if given, is called as progress(stage, **info) after the
+    "vectorstore_load", "embed" and "retrieve" stages.
+    Chapter-scope requests covered by the materialized lookup table skip the embedding and scoring.
+    """
+    plan = plan_retrieval(request)
+    _report(progress, "vectorstore_load", chapters=len(plan.chapters), rows=plan.total_rows)
+
+    chapter_hits = get_materialized_retrieval().lookup(plan)
+    if chapter_hits is not None:
+        _report(progress, "embed", materialized=True)
+        chunks = retrieve_chunks(plan, chapter_hits=chapter_hits)
+        _report(progress, "retrieve", chunks=len(chunks), materialized=True)
+        return plan, chunks
+
+    embedder = get_embedding_service()
+    query_vec = embedder.encode([plan.user_query])[0]
+    _report(progress, "embed")
+
+    with span("score", rows=plan.total_rows):
+        chunks = retrieve_chunks(plan, query_vec)
+    _report(progress, "retrieve", chunks=len(chunks))
+    return plan, chunks
+
+def build_generation_prompt(request, progress=None) -> Tuple[BuiltPrompt, str]:
+    """
+    Resolves the chapters of a request, retrieves their top chunks and returns
+    (LLM prompt, generation cache key).
+    `progress` gets the stages of retrieve_for_request, then "prompt_built".
+    """
+    plan, chunks = retrieve_for_request(request, progress)
+    return prompt_for_plan(plan, chunks, progress)
+
+def prompt_for_plan(plan: RetrievalPlan, chunks: List[ContextChunk], progress=None) -> Tuple[BuiltPrompt, str]:
+    """Renders the single-call prompt of a plan and returns (prompt, generation cache key)."""
+    with span("prompt_build", chunks=len(chunks)):
+        prompt = render_prompt(plan, chunks)
+    _report(progress, "prompt_built", prompt_chars=len(prompt.text), prompt_tokens=prompt.prompt_tokens)
+    return prompt, plan_cache_key(plan, prompt.chunk_ids)
+
+def render_prompt(plan: RetrievalPlan, chunks: List[ContextChunk]) -> BuiltPrompt:
+    """The LLM prompt for a plan: its retrieved context within the token budget, in the precompiled template."""
+    return build_prompt(plan.grade, plan.chapter_label, plan.material_type, plan.difficulty, plan.max_marks, chunks)
+
+def plan_cache_key(plan: RetrievalPlan, chunk_ids) -> str:
+    """Generation cache key of a plan and the chunks retrieved for it."""
+    return make_cache_key(
+        {
+            "grade": grade_key(plan.grade),
+            "chapters": [normalize_chapter(c) for c in plan.chapters],
+            **({"scope": plan.scope} if plan.scope != "chapter" else {}),
+            **({"sectioned": True} if plan.sectioned else {}),
+            "material_type": plan.material_type.strip().lower(),
+            "difficulty": plan.difficulty.strip().lower(),
+            "max_marks": plan.max_marks,
+            "stream": (getattr(plan.request, "stream", None) or "").strip().lower(),
+            "model": get_provider(getattr(plan.request, "provider", None)).model,
+        },
+        chunk_ids,
+        PROMPT_TEMPLATE_VERSION,
     )
 
-    print("Sending to Deepseek...")
-    response = ask_deepseek(prompt)
-    print("Deepseek returned: ", response)
+def _cached_generation(request, prompt: Optional[BuiltPrompt], cache_key: str, progress=None):
+    """Returns the cached text for a key unless the request asked for a fresh generation."""
+    if getattr(request, "fresh", False):
+        return None
+    cached = get_generation_cache().get(cache_key)
+    if cached is not None:
+        logger.info("Serving generation from cache.")
+        if prompt is not None:
+            get_token_accounting().record(prompt, cached, cached=True)
+        _report(progress, "cache_hit", chars=len(cached))
+    return cached
+
+def generate_material(request, progress=None):
+    """
+    Runs retrieval and the LLM call for one request and returns the generated text.
+    Repeat requests with the same retrieved context are served from the generation cache
+    unless `request.fresh` is set.
+    `progress` receives the retrieval stages of build_generation_prompt, then either
+    "cache_hit" or "llm_request" and "llm_response" (with "paper_section" events in between
+    for a sectioned Grade 10 paper).
+    """
+    plan, chunks = retrieve_for_request(request, progress)
+    if plan.sectioned:
+        return "".join(_sectioned_paper(plan, chunks, progress))
+    prompt, cache_key = prompt_for_plan(plan, chunks, progress)
+    cached = _cached_generation(request, prompt, cache_key, progress)
+    if cached is not None:
+        return cached
+
+    llm = get_provider(getattr(request, "provider", None))
+    _report(progress, "llm_request", provider=llm.name)
+    with span("llm_call", provider=llm.name, prompt_tokens=prompt.prompt_tokens):
+        response = llm.complete(prompt.text)
+    _report(progress, "llm_response", chars=len(response or ""))
     if not response:
-        raise ValueError("Deepseek returned an empty response. Please check the prompt and context.")
+        raise ValueError(f"{llm.name} returned an empty response. Please check the prompt and context.")
 
+    get_token_accounting().record(prompt, response)
+    get_generation_cache().set(cache_key, response)
     return response
 
+def stream_material(request, progress=None) -> Iterator[str]:
+    """
+    Like generate_material, but yields the generated text in pieces as DeepSeek streams it.
+    A sectioned paper is yielded section by section, in order.
+    """
+    plan, chunks = retrieve_for_request(request, progress)
+    if plan.sectioned:
+        yield from _sectioned_paper(plan, chunks, progress)
+        return
+    prompt, cache_key = prompt_for_plan(plan, chunks, progress)
+    cached = _cached_generation(request, prompt, cache_key, progress)
+    if cached is not None:
+        yield cached
+        return
+
+    llm = get_provider(getattr(request, "provider", None))
+    _report(progress, "llm_request", provider=llm.name)
+    parts = []
+    with span("llm_call", provider=llm.name, prompt_tokens=prompt.prompt_tokens, stream=True):
+        start = time.perf_counter()
+        for delta in llm.stream(prompt.text):
+            if not parts:
+                STAGE_SECONDS.observe(time.perf_counter() - start, stage="llm_first_token")
+            parts.append(delta)
+            yield delta
+    response = "".join(parts)
+    _report(progress, "llm_response", chars=len(response))
+    if not response:
+        raise ValueError(f"{llm.name} returned an empty response. Please check the prompt and context.")
+    get_token_accounting().record(prompt, response)
+    get_generation_cache().set(cache_key, response)
+
+def _sectioned_paper(plan: RetrievalPlan, chunks: List[ContextChunk], progress=None) -> Iterator[str]:
+    """
+    A Grade 10 question paper written as concurrent section calls (app.paper) and stitched in
+    order, through the generation cache like a single-call generation.
+    """
+    cache_key = plan_cache_key(plan, [chunk_id for chunk in chunks for chunk_id in chunk.ids])
+    cached = _cached_generation(plan.request, None, cache_key, progress)
+    if cached is not None:
+        yield cached
+        return
+
+    llm = get_provider(getattr(plan.request, "provider", None))
+    _report(progress, "llm_request", provider=llm.name, sectioned=True)
+    parts = []
+    with span("llm_call", provider=llm.name, sectioned=True):
+        for piece in iter_sectioned_paper(plan.grade, plan.chapter_label, plan.difficulty, chunks, llm, progress):
+            parts.append(piece)
+            yield piece
+    response = "".join(parts)
+    _report(progress, "llm_response", chars=len(response))
+    get_generation_cache().set(cache_key, response)
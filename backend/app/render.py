@@ -0,0 +1,163 @@
+import os
+import shutil
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from .export import PANDOC_PATH, PANDOC_PDF_ENGINE, export_to_docx, export_to_pdf, export_with_pandoc
+from .metrics import span
+
+logger = logging.getLogger(__name__)
+
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "2"))  # concurrent pandoc/xelatex processes
+RENDER_QUEUE_MAX = int(os.getenv("RENDER_QUEUE_MAX", "32"))  # renders waiting for a worker before we refuse
+PANDOC_PDF_TEMPLATE = os.getenv("PANDOC_PDF_TEMPLATE") or None
+PANDOC_DOCX_TEMPLATE = os.getenv("PANDOC_DOCX_TEMPLATE") or None
+PRELOAD_PANDOC = os.getenv("PRELOAD_PANDOC", "1") != "0"
+
+EXTENSIONS = {"pdf": ".pdf", "docx": ".docx", "word": ".docx"}
+
+
+class RenderQueueFull(RuntimeError):
+    """More renders are waiting than RENDER_QUEUE_MAX allows."""
+
+
+def template_for(filetype: str) -> Optional[str]:
+    return PANDOC_PDF_TEMPLATE if filetype == "pdf" else PANDOC_DOCX_TEMPLATE
+
+
+def template_fingerprint(filetype: str) -> str:
+    """Identifies the pandoc template of a format, so stored renderings made with another one are not reused."""
+    template = template_for(filetype)
+    if not template:
+        return ""
+    try:
+        return f"{template}:{os.path.getmtime(template)}"
+    except OSError:
+        return template
+
+
+class RenderService:
+    """
+    Pandoc rendering behind a bounded worker pool.
+
+    Pandoc and XeLaTeX are command-line programs, so a "worker" is a pool thread that runs one
+    pandoc process at a time; at most RENDER_WORKERS run at once and at most RENDER_QUEUE_MAX
+    more may wait. warm() renders a tiny document once at startup so XeLaTeX's font and format
+    caches are built before the first real export. Outputs are written straight to the caller's
+    path: the artifact store keeps them and shares identical renders.
+    Without pandoc (or the PDF engine) exports fall back to the plain PDF/DOCX writers.
+    """
+
+    def __init__(self, workers: int = RENDER_WORKERS, queue_max: int = RENDER_QUEUE_MAX):
+        self.workers = max(1, workers)
+        self.capacity = self.workers + max(0, queue_max)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pandoc")
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.pandoc = shutil.which(PANDOC_PATH)
+        self.pdf_engine = shutil.which(PANDOC_PDF_ENGINE)
+        self.warm = False
+        self.renders = 0
+        self.fallbacks = 0
+        if self.pandoc is None:
+            logger.warning("Pandoc not found (%s); math exports use the plain PDF/DOCX writers.", PANDOC_PATH)
+
+    def available(self, filetype: str) -> bool:
+        if self.pandoc is None:
+            return False
+        return filetype != "pdf" or self.pdf_engine is not None
+
+    def warm_in_background(self) -> None:
+        """Runs one throwaway PDF render on the pool so the first user export skips the TeX cold start."""
+        if not self.available("pdf"):
+            return
+
+        def warm_up():
+            with tempfile.TemporaryDirectory() as tmp:
+                try:
+                    export_with_pandoc("Warm-up $x^2$", os.path.join(tmp, "warm.pdf"), "pdf", template_for("pdf"))
+                    self.warm = True
+                except Exception as ex:
+                    logger.warning("Pandoc warm-up failed: %s", ex)
+
+        self._pool.submit(warm_up)
+
+    def render(self, text: str, filetype: str, filename: str) -> str:
+        """Renders text to filename on the worker pool and waits for it."""
+        if filetype not in EXTENSIONS:
+            raise ValueError(f"Unsupported file type: choose 'pdf' or 'docx' (or 'word'). Got: {filetype}")
+        with self._lock:
+            if self.pending >= self.capacity:
+                raise RenderQueueFull(f"Render queue is full ({self.capacity} renders pending), try again shortly.")
+            self.pending += 1
+        try:
+            future = self._pool.submit(self._render, text, filetype, filename)
+        except BaseException:
+            self._done()
+            raise
+        future.add_done_callback(lambda _: self._done())
+        return future.result()
+
+    def _done(self) -> None:
+        with self._lock:
+            self.pending -= 1
+
+    def _render(self, text: str, filetype: str, filename: str) -> str:
+        with span("pandoc_render", filetype=filetype):
+            export_with_pandoc(text, filename, filetype, template_for(filetype))
+        with self._lock:
+            self.renders += 1
+        return filename
+
+    def export(self, text: str, filetype: str = "pdf", filename: Optional[str] = None) -> str:
+        """
+        export_text(use_pandoc=True): the pandoc rendering at filename (a new temporary file when
+        None), or the plain export when pandoc cannot render this format.
+        """
+        suffix = EXTENSIONS.get(filetype)
+        if suffix is None:
+            raise ValueError(f"Unsupported file type: choose 'pdf' or 'docx' (or 'word'). Got: {filetype}")
+        if filename is None:
+            with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
+                filename = temp_file.name
+        if not self.available(filetype):
+            with self._lock:
+                self.fallbacks += 1
+            return export_to_pdf(text, filename) if filetype == "pdf" else export_to_docx(text, filename)
+        try:
+            self.render(text, filetype, filename)
+        except Exception:
+            if os.path.exists(filename):
+                os.unlink(filename)
+            raise
+        return filename
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "pandoc": self.pandoc,
+                "pdf_engine": self.pdf_engine,
+                "warm": self.warm,
+                "workers": self.workers,
+                "pending": self.pending,
+                "capacity": self.capacity,
+                "renders": self.renders,
+                "fallbacks": self.fallbacks,
+            }
+
+
+_service: Optional[RenderService] = None
+_service_lock = threading.Lock()
+
+
+def get_render_service() -> RenderService:
+    """Returns the process-wide render service."""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = RenderService()
+    return _service
@@ -0,0 +1,163 @@
+import os
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .vectorstore import Vectorstore
+
+DEFAULT_TOP_K = 2  # Number of top chunks per chapter for whole-page vectorstores
+# Sub-page chunks are ~4x smaller than a page, so more of them fit the same context budget
+DEFAULT_CHUNK_TOP_K = int(os.getenv("RETRIEVAL_CHUNK_TOP_K", "4"))
+MAX_TOP_K = int(os.getenv("RETRIEVAL_MAX_TOP_K", "20"))
+# Whole-book / whole-grade requests draw from many chapters, so they get a larger total budget
+DEFAULT_SCOPE_TOP_K = int(os.getenv("RETRIEVAL_SCOPE_TOP_K", "8"))
+
+
+def resolve_top_k(top_k: Optional[int], chunked: bool = False) -> int:
+    """Returns the per-chapter k for a request, clamped to [1, MAX_TOP_K]."""
+    if not top_k:
+        return DEFAULT_CHUNK_TOP_K if chunked else DEFAULT_TOP_K
+    return max(1, min(int(top_k), MAX_TOP_K))
+
+
+def merge_chunk_passages(store: Vectorstore, rows: Sequence[int],
+                         scores: Optional[Sequence[float]] = None) -> List[Tuple[str, List[int], float]]:
+    """
+    (text, rows, best score) of the selected rows, in rank order, with overlapping chunks of
+    the same page joined into one passage so the overlap is not sent to the LLM twice.
+    Whole-page rows are returned one per passage.
+    """
+    texts = store.texts(rows)
+    scores = list(scores) if scores is not None else [0.0] * len(texts)
+    if not store.is_chunked:
+        return [(text, [row], score) for row, text, score in zip(rows, texts, scores)]
+    passages: List[list] = []  # [page, char_start, char_end, text, rows, score]
+    for row, text, score in zip(rows, texts, scores):
+        meta = store.records[row]
+        page, start, end = meta.get("page"), meta.get("char_start", 0), meta.get("char_end", 0)
+        for passage in passages:
+            if passage[0] == page and start <= passage[2] and end >= passage[1]:
+                if start < passage[1]:
+                    passage[3] = text[:max(0, passage[1] - start)] + passage[3]
+                    passage[1] = start
+                if end > passage[2]:
+                    passage[3] = passage[3] + text[max(0, passage[2] - start):]
+                    passage[2] = end
+                passage[4].append(row)
+                passage[5] = max(passage[5], score)
+                break
+        else:
+            passages.append([page, start, end, text, [row], score])
+    return [(p[3], p[4], p[5]) for p in passages]
+
+
+def merge_chunk_texts(store: Vectorstore, rows: Sequence[int]) -> List[str]:
+    """Texts of merge_chunk_passages: overlapping chunks of a page joined, in rank order."""
+    return [text for text, _, _ in merge_chunk_passages(store, rows)]
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Returns a contiguous float32 copy of `matrix` with every row scaled to unit length."""
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    if matrix.size == 0:
+        return matrix
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def normalize_query(query_vec: np.ndarray) -> np.ndarray:
+    query_vec = np.asarray(query_vec, dtype=np.float32).ravel()
+    norm = float(np.linalg.norm(query_vec))
+    return query_vec / norm if norm else query_vec
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first, using argpartition instead of a full sort."""
+    n = scores.shape[0]
+    if n == 0 or k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if k >= n:
+        return np.argsort(-scores, kind="stable")
+    part = np.argpartition(-scores, k - 1)[:k]
+    return part[np.argsort(-scores[part], kind="stable")]
+
+
+class ChapterIndex:
+    """
+    Pre-normalized embeddings of one chapter as a single contiguous matrix.
+    Scoring a query is one matrix-vector product; `rows` maps matrix rows back to vectorstore rows.
+    """
+
+    def __init__(self, store: Vectorstore, rows: Optional[np.ndarray] = None, matrix: Optional[np.ndarray] = None):
+        self.store = store
+        if rows is None:
+            self.rows = np.arange(len(store), dtype=np.int64)
+        else:
+            self.rows = np.asarray(rows, dtype=np.int64)
+        if matrix is not None:
+            # Already-normalized rows shared with another index
+            self.matrix = matrix
+        elif rows is None:
+            self.matrix = normalize_rows(store.embeddings)
+        else:
+            self.matrix = normalize_rows(store.embeddings[self.rows])
+        self._pages: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return int(self.rows.shape[0])
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.matrix.nbytes + self.rows.nbytes)
+
+    @property
+    def pages(self) -> np.ndarray:
+        """Page number of every row (computed once; a benign race if two threads get here first)."""
+        if self._pages is None:
+            self._pages = np.asarray([self.store.records[r].get("page", 0) for r in self.rows], dtype=np.int64)
+        return self._pages
+
+    def page_view(self, ranges: Sequence[Tuple[int, int]]) -> "ChapterIndex":
+        """
+        Index over the rows whose page lies in one of the inclusive (first, last) page ranges,
+        for files that hold several chapters. Rows are stored in page order, so a single range
+        is a slice of the same matrix rather than a copy.
+        """
+        pages = self.pages
+        if len(ranges) == 1 and pages.size and np.all(pages[1:] >= pages[:-1]):
+            first, last = ranges[0]
+            lo = int(np.searchsorted(pages, first, side="left"))
+            hi = int(np.searchsorted(pages, last, side="right"))
+            return ChapterIndex(self.store, self.rows[lo:hi], self.matrix[lo:hi])
+        keep = np.zeros(pages.shape[0], dtype=bool)
+        for first, last in ranges:
+            keep |= (pages >= first) & (pages <= last)
+        return ChapterIndex(self.store, self.rows[keep], self.matrix[keep])
+
+    def scores(self, query_vec: np.ndarray) -> np.ndarray:
+        """Cosine similarity of the query against every row."""
+        return self.matrix @ normalize_query(query_vec)
+
+    def search(self, query_vec: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        """Returns up to k (vectorstore row, score) pairs, best first."""
+        if len(self) == 0:
+            return []
+        scores = self.scores(query_vec)
+        best = top_k_indices(scores, k)
+        return [(int(self.rows[i]), float(scores[i])) for i in best]
+
+    def search_many(self, query_vecs: np.ndarray, ks: Sequence[int]) -> List[List[Tuple[int, float]]]:
+        """search() for several queries at once: one matrix product, then a top-k per query."""
+        if len(self) == 0:
+            return [[] for _ in ks]
+        queries = normalize_rows(np.atleast_2d(query_vecs))
+        scores = self.matrix @ queries.T  # (rows, queries)
+        results = []
+        for j, k in enumerate(ks):
+            column = scores[:, j]
+            results.append([(int(self.rows[i]), float(column[i])) for i in top_k_indices(column, k)])
+        return results
+
+    def top_texts(self, query_vec: np.ndarray, k: int) -> List[str]:
+        return merge_chunk_texts(self.store, [row for row, _ in self.search(query_vec, k)])
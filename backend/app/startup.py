@@ -0,0 +1,123 @@
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional, Set
+
+from .metrics import REGISTRY, Gauge
+
+STARTUP_SECONDS = REGISTRY.register(Gauge(
+    "diro_startup_seconds", "Startup timings: warm-up durations, and seconds from import of the app until "
+    "\"imported\", \"serving\" and \"ready\"", ["phase"]))
+
+logger = logging.getLogger(__name__)
+
+
+class StartupReport:
+    """
+    How long this process took to start: milestones are seconds since app.main began importing
+    ("imported", "serving" once the startup hooks have run, "ready" once the warm-ups readiness
+    waits for are done); phases are the durations of the individual startup steps and warm-ups.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.milestones: Dict[str, float] = {}
+        self.phases: Dict[str, float] = {}
+        self.errors: Dict[str, str] = {}
+        self._pending: Set[str] = set()
+        self._serving = False
+        self._lock = threading.Lock()
+
+    def since_start(self) -> float:
+        return time.perf_counter() - self.started
+
+    def milestone(self, name: str) -> float:
+        seconds = self.since_start()
+        with self._lock:
+            self.milestones[name] = seconds
+        STARTUP_SECONDS.set(seconds, phase=name)
+        return seconds
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Times one startup step; a step that raises is recorded in errors and re-raised."""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as ex:
+            with self._lock:
+                self.errors[name] = str(ex)
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                self.phases[name] = seconds
+            STARTUP_SECONDS.set(seconds, phase=name)
+
+    def warm_in_background(self, name: str, function: Callable[[], object]) -> threading.Thread:
+        """Runs a warm-up on a daemon thread; the process is not ready until it has succeeded."""
+        with self._lock:
+            self._pending.add(name)
+
+        def run():
+            try:
+                with self.phase(name):
+                    function()
+            except Exception:
+                logger.exception("Startup warm-up %s failed", name)
+            finally:
+                with self._lock:
+                    self._pending.discard(name)
+                self._check_ready()
+
+        thread = threading.Thread(target=run, name=f"warmup-{name}", daemon=True)
+        thread.start()
+        return thread
+
+    def serving(self) -> None:
+        """Called by the last startup hook: the app accepts requests from now on."""
+        self.milestone("serving")
+        with self._lock:
+            self._serving = True
+        self._check_ready()
+
+    def _check_ready(self) -> None:
+        with self._lock:
+            if not self._serving or self._pending or self.errors or "ready" in self.milestones:
+                return
+        seconds = self.milestone("ready")
+        with self._lock:
+            details = " ".join(f"{name}={value:.2f}s" for name, value in self.phases.items())
+            imported = self.milestones.get("imported", 0.0)
+        logger.info("Ready %.2fs after start (imports %.2fs, %s)", seconds, imported, details or "no warm-ups")
+
+    @property
+    def ready(self) -> bool:
+        with self._lock:
+            return "ready" in self.milestones
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "ready": "ready" in self.milestones,
+                "uptime": self.since_start(),
+                "milestones": dict(self.milestones),
+                "phases": dict(self.phases),
+                "pending": sorted(self._pending),
+                "errors": dict(self.errors),
+            }
+
+
+_report: Optional[StartupReport] = None
+_report_lock = threading.Lock()
+
+
+def get_startup_report() -> StartupReport:
+    """Returns the process-wide startup report; the first call starts its clock."""
+    global _report
+    if _report is None:
+        with _report_lock:
+            if _report is None:
+                _report = StartupReport()
+    return _report
@@ -1,6 +1,6 @@
 import os
 import re
-from typing import List, Optional
+from typing import Callable, List, Optional, Tuple
 
 def clean_text(text: str) -> str:
      """
@@ -36,6 +36,40 @@ def split_text_into_chunks(text: str, chunk_size: int = 1000, overlap: int = 100
           i += chunk_size - overlap
      return chunks
 
+def estimate_word_tokens(word: str) -> int:
+     """
+     Rough word-piece count of a single word (about 4 characters per piece) for when no tokenizer is at hand.
+     """
+     return max(1, (len(word) + 3) // 4)
+
+def split_text_into_token_chunks(text: str, max_tokens: int = 200, overlap: int = 40,
+                                 count_tokens: Optional[Callable[[str], int]] = None) -> List[Tuple[str, int, int]]:
+     """
+     Splits text into chunks of at most `max_tokens` tokens, with about `overlap` tokens repeated
+     between neighbouring chunks. Chunks never split a word.
+     Returns (chunk_text, char_start, char_end) tuples, offsets pointing into the original text.
+     """
+     count_tokens = count_tokens or estimate_word_tokens
+     words = [(m.start(), m.end(), count_tokens(m.group())) for m in re.finditer(r'\S+', text)]
+     chunks = []
+     i = 0
+     while i < len(words):
+          j, used = i, 0
+          while j < len(words) and (j == i or used + words[j][2] <= max_tokens):
+               used += words[j][2]
+               j += 1
+          start, end = words[i][0], words[j - 1][1]
+          chunks.append((text[start:end], start, end))
+          if j >= len(words):
+               break
+          # Step back from the end of this chunk until `overlap` tokens are covered
+          k, back = j, 0
+          while k - 1 > i and back + words[k - 1][2] <= overlap:
+               k -= 1
+               back += words[k][2]
+          i = k
+     return chunks
+
 def is_valid_filetype(filename: str, allowed_types: Optional[List[str]] = None) -> bool:
      """
      Checks if a filename has a valid file extension.
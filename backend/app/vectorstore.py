@@ -0,0 +1,197 @@
+import os
+import sys
+import json
+import argparse
+from typing import List, Dict, Any, Optional, Sequence
+
+import numpy as np
+
+VECTORSTORE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "vectorstores")
+
+# On-disk layout of a binary vectorstore "<name>_vectors":
+#   <name>_vectors.npy        embedding matrix (float32 or float16), opened with mmap
+#   <name>_vectors.texts      UTF-8 texts of all rows, concatenated
+#   <name>_vectors.meta.json  per-row metadata with byte offset/length into the .texts file
+FORMAT_VERSION = 1
+MATRIX_SUFFIX = ".npy"
+TEXTS_SUFFIX = ".texts"
+META_SUFFIX = ".meta.json"
+LEGACY_SUFFIX = ".json"
+
+
+def base_path(path: str) -> str:
+    """Strips any vectorstore suffix so legacy '.json' names and binary names resolve the same way."""
+    for suffix in (META_SUFFIX, MATRIX_SUFFIX, TEXTS_SUFFIX, LEGACY_SUFFIX):
+        if path.endswith(suffix):
+            return path[:-len(suffix)]
+    return path
+
+
+def has_binary(path: str) -> bool:
+    base = base_path(path)
+    return all(os.path.exists(base + s) for s in (MATRIX_SUFFIX, TEXTS_SUFFIX, META_SUFFIX))
+
+
+def vectorstore_exists(path: str) -> bool:
+    return has_binary(path) or os.path.exists(base_path(path) + LEGACY_SUFFIX)
+
+
+def vectorstore_mtime(path: str) -> float:
+    """Modification time of the file a load would actually read (binary sidecar or legacy JSON)."""
+    base = base_path(path)
+    if has_binary(base):
+        return max(os.path.getmtime(base + s) for s in (MATRIX_SUFFIX, TEXTS_SUFFIX, META_SUFFIX))
+    return os.path.getmtime(base + LEGACY_SUFFIX)
+
+
+class Vectorstore:
+    """
+    Read-only view of one vectorstore file.
+    `embeddings` is a (rows, dim) matrix, memory-mapped when loaded from the binary format,
+    and texts are only read from disk for the rows that are asked for.
+    """
+
+    def __init__(self, path: str, embeddings: np.ndarray, records: List[Dict[str, Any]],
+                 texts: Optional[List[str]] = None, texts_path: Optional[str] = None):
+        self.path = path
+        self.embeddings = embeddings
+        self.records = records
+        self._texts = texts
+        self._texts_path = texts_path
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.embeddings.nbytes)
+
+    @property
+    def is_chunked(self) -> bool:
+        """True when rows are sub-page chunks (with page/char offsets) rather than whole pages."""
+        return bool(self.records) and "chunk" in self.records[0]
+
+    @property
+    def resident_bytes(self) -> int:
+        """Approximate heap memory held by this object (memory-mapped matrices are not counted)."""
+        size = 0 if isinstance(self.embeddings, np.memmap) else self.nbytes
+        if self._texts is not None:
+            size += sum(len(t) for t in self._texts)
+        return size
+
+    def texts(self, rows: Sequence[int]) -> List[str]:
+        """Returns the texts of the given rows, in the same order."""
+        if self._texts is not None:
+            return [self._texts[i] for i in rows]
+        out = []
+        with open(self._texts_path, "rb") as f:
+            for i in rows:
+                rec = self.records[i]
+                f.seek(rec["offset"])
+                out.append(f.read(rec["length"]).decode("utf-8"))
+        return out
+
+    def text(self, row: int) -> str:
+        return self.texts([row])[0]
+
+    def metadata(self, row: int) -> Dict[str, Any]:
+        """Row metadata without the storage offsets."""
+        return {k: v for k, v in self.records[row].items() if k not in ("offset", "length")}
+
+
+def load_vectorstore(path: str, mmap: bool = True) -> Vectorstore:
+    """
+    Opens a vectorstore by its '<name>_vectors.json' (or extension-less) path.
+    The binary format is used when present; otherwise the legacy JSON file is parsed.
+    """
+    base = base_path(path)
+    if has_binary(base):
+        with open(base + META_SUFFIX, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        embeddings = np.load(base + MATRIX_SUFFIX, mmap_mode="r" if mmap else None)
+        return Vectorstore(base, embeddings, meta["records"], texts_path=base + TEXTS_SUFFIX)
+
+    legacy = base + LEGACY_SUFFIX
+    if not os.path.exists(legacy):
+        raise FileNotFoundError(f"Vectorstore not found: {path}")
+    with open(legacy, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    embeddings = np.asarray([e["embedding"] for e in entries], dtype=np.float32)
+    records = [{k: v for k, v in e.items() if k not in ("embedding", "text")} for e in entries]
+    texts = [e.get("text", "") for e in entries]
+    return Vectorstore(base, embeddings, records, texts=texts)
+
+
+def save_vectorstore_binary(records: List[Dict[str, Any]], out_path: str, dtype: str = "float32") -> str:
+    """
+    Writes records (dicts with 'text', 'embedding' and any extra metadata) in the binary format.
+    Returns the base path of the written vectorstore.
+    """
+    base = base_path(out_path)
+    os.makedirs(os.path.dirname(base) or ".", exist_ok=True)
+
+    if records:
+        matrix = np.asarray([r["embedding"] for r in records], dtype=dtype)
+    else:
+        matrix = np.zeros((0, 0), dtype=dtype)
+
+    meta_records = []
+    offset = 0
+    with open(base + TEXTS_SUFFIX, "wb") as f:
+        for r in records:
+            data = r.get("text", "").encode("utf-8")
+            f.write(data)
+            row = {k: v for k, v in r.items() if k not in ("embedding", "text")}
+            row["offset"] = offset
+            row["length"] = len(data)
+            meta_records.append(row)
+            offset += len(data)
+
+    np.save(base + MATRIX_SUFFIX, matrix)
+    with open(base + META_SUFFIX, "w", encoding="utf-8") as f:
+        json.dump({
+            "version": FORMAT_VERSION,
+            "dtype": str(matrix.dtype),
+            "count": len(meta_records),
+            "dim": int(matrix.shape[1]) if matrix.ndim == 2 else 0,
+            "records": meta_records,
+        }, f, ensure_ascii=False)
+    return base
+
+
+def convert_tree(root_dir: str = VECTORSTORE_DIR, dtype: str = "float32", remove_json: bool = False,
+                 force: bool = False) -> List[str]:
+    """Converts every legacy '*_vectors.json' under root_dir to the binary format."""
+    converted = []
+    for dirpath, _, filenames in os.walk(root_dir):
+        for name in sorted(filenames):
+            if not name.endswith("_vectors" + LEGACY_SUFFIX):
+                continue
+            json_path = os.path.join(dirpath, name)
+            if has_binary(json_path) and not force:
+                continue
+            with open(json_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+            save_vectorstore_binary(entries, json_path, dtype=dtype)
+            if remove_json:
+                os.unlink(json_path)
+            converted.append(json_path)
+            print(f"Converted {json_path} ({len(entries)} rows, {dtype})")
+    return converted
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Convert JSON vectorstores to the memory-mapped binary format.")
+    parser.add_argument("root", nargs="?", default=VECTORSTORE_DIR, help="Vectorstore directory to convert")
+    parser.add_argument("--float16", action="store_true", help="Store embeddings as float16 (half the size)")
+    parser.add_argument("--remove-json", action="store_true", help="Delete the JSON files after converting")
+    parser.add_argument("--force", action="store_true", help="Re-convert files that already have a binary copy")
+    args = parser.parse_args(argv)
+
+    converted = convert_tree(args.root, dtype="float16" if args.float16 else "float32",
+                             remove_json=args.remove_json, force=args.force)
+    print(f"Converted {len(converted)} vectorstore(s).")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
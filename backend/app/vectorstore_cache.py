@@ -0,0 +1,117 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Sequence, Tuple
+
+from .vectorstore import base_path, load_vectorstore, vectorstore_mtime
+from .retrieval import ChapterIndex
+from .metrics import span
+
+# Memory budget for loaded vectorstores (normalized matrices + in-memory texts)
+VECTORSTORE_CACHE_MAX_BYTES = int(os.getenv("VECTORSTORE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+
+class VectorstoreCache:
+    """
+    Process-level LRU cache of loaded vectorstores, keyed by (path, mtime) so that a
+    re-ingested file is picked up on the next request. Entries are evicted least recently
+    used first once the byte budget is exceeded.
+
+    Cached ChapterIndex objects have read-only matrices and are never mutated after they are
+    built, so the same entry can be shared by concurrent requests.
+    """
+
+    def __init__(self, max_bytes: int = VECTORSTORE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[float, ChapterIndex, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, path: str, pages: Optional[Sequence[Tuple[int, int]]] = None) -> ChapterIndex:
+        """
+        Returns the ChapterIndex for a vectorstore path, loading it on a miss.
+        With `pages`, a list of inclusive (first, last) page ranges, only those pages of the file
+        are searched; the result is a view on the cached file, so chapters sharing a file share one load.
+        """
+        index = self._get_file(path)
+        if pages:
+            return index.page_view(pages)
+        return index
+
+    def _get_file(self, path: str) -> ChapterIndex:
+        key = os.path.normpath(base_path(path))
+        mtime = vectorstore_mtime(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == mtime:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        # Load outside the lock so one slow file doesn't stall every other request
+        with span("vectorstore_read", file=key):
+            index = ChapterIndex(load_vectorstore(path))
+        index.matrix.setflags(write=False)
+        index.rows.setflags(write=False)
+        size = index.nbytes + index.store.resident_bytes
+
+        with self._lock:
+            current = self._entries.get(key)
+            if current is not None and current[0] == mtime:
+                # Another request loaded it meanwhile; keep a single shared copy
+                self._entries.move_to_end(key)
+                return current[1]
+            if current is not None:
+                self._remove(key)
+            if size <= self.max_bytes:
+                self._entries[key] = (mtime, index, size)
+                self._bytes += size
+                self._evict()
+        return index
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+    def _remove(self, key: str) -> None:
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def _evict(self) -> None:
+        # Caller must hold self._lock
+        while self._bytes > self.max_bytes and self._entries:
+            key = next(iter(self._entries))
+            self._remove(key)
+            self.evictions += 1
+
+
+_cache: Optional[VectorstoreCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_vectorstore_cache() -> VectorstoreCache:
+    """Returns the process-wide vectorstore cache."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = VectorstoreCache()
+    return _cache
@@ -0,0 +1,68 @@
+"""
+Recall and latency of the IVF index against exact brute-force search.
+
+Run from backend/ after building the index (python -m app.ann_index):
+    python -m benchmarks.bench_ann [--k 8] [--queries 200] [--nprobe 1 2 4 8 16 32]
+
+Queries are stored rows plus Gaussian noise, so no embedding model is needed and every
+query has real neighbours. Recall@k is the fraction of the exact top k the index returns.
+"""
+import sys
+import time
+import argparse
+
+import numpy as np
+
+from app.ann_index import load_index
+
+
+def recall_at_k(approx, exact) -> float:
+    exact_ids = {(f, r) for f, r, _ in exact}
+    if not exact_ids:
+        return 1.0
+    return len(exact_ids & {(f, r) for f, r, _ in approx}) / len(exact_ids)
+
+
+def run(index, queries, k, nprobe, filters):
+    start = time.perf_counter()
+    results = [index.search(q, k, filters, nprobe=nprobe) for q in queries]
+    return results, (time.perf_counter() - start) / len(queries) * 1000.0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--k", type=int, default=8)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--noise", type=float, default=0.05, help="Std-dev of the noise added to each query row")
+    parser.add_argument("--grade", default=None, help="Also measure with a grade filter, e.g. 10")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    index = load_index()
+    # Always go through the inverted lists, even where the backend would search a small scope exactly
+    index.exact_threshold = 0
+    rng = np.random.default_rng(args.seed)
+    picks = rng.choice(len(index), size=min(args.queries, len(index)), replace=False)
+    queries = np.asarray(index.vectors[np.sort(picks)], dtype=np.float32)
+    queries = queries + rng.standard_normal(queries.shape).astype(np.float32) * args.noise
+
+    print(f"Index: {index.stats()}")
+    scopes = [("all", None)]
+    if args.grade:
+        scopes.append((f"grade {args.grade}", {"grade": args.grade}))
+
+    for label, filters in scopes:
+        start = time.perf_counter()
+        exact = [index.search(q, args.k, filters, exact=True) for q in queries]
+        exact_ms = (time.perf_counter() - start) / len(queries) * 1000.0
+        print(f"\n[{label}] brute force: {exact_ms:8.3f} ms/query")
+        print(f"{'nprobe':>8} {'recall@' + str(args.k):>10} {'ms/query':>10} {'speedup':>8}")
+        for nprobe in args.nprobe:
+            approx, ms = run(index, queries, args.k, nprobe, filters)
+            recall = float(np.mean([recall_at_k(a, e) for a, e in zip(approx, exact)]))
+            print(f"{nprobe:>8} {recall:>10.3f} {ms:>10.3f} {exact_ms / ms:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,125 @@
+"""
+Benchmark: the old reportlab canvas export vs. the streaming PDF layout in app.export.
+
+Run from backend/:
+    python -m benchmarks.bench_export [--pages 10 20 30 40 50] [--repeats 3]
+
+Builds synthetic question papers of roughly the requested length and reports ms/page
+and peak Python memory (tracemalloc) for both engines. Output goes to a sink that only counts
+bytes, so the peak is what the engine itself holds rather than the finished file.
+"""
+import sys
+import time
+import random
+import argparse
+import tracemalloc
+
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+from app.export import render_pdf
+
+WORDS = ("the chapter describes how water evaporates from rivers and oceans forms clouds and returns "
+         "as rain which plants animals and people depend on explain why with two examples from the "
+         "text and compare the poet's view of nature with the author's account").split()
+LINES_PER_PAGE = 50
+
+
+def legacy_export_to_pdf(text: str, out) -> int:
+    """The previous export_to_pdf: whole document in memory, re-measuring the remaining line per wrap."""
+    c = canvas.Canvas(out, pagesize=A4)
+    width, height = A4
+    margin = 40
+    x = margin
+    y = height - margin
+    line_height = 14
+    for para in text.split('\n\n'):
+        for line in para.split('\n'):
+            lines = []
+            while len(line) > 0:
+                if c.stringWidth(line) < (width - 2 * margin):
+                    lines.append(line)
+                    line = ""
+                else:
+                    wrap_pos = min(len(line), int((width - 2 * margin) / 7))
+                    space_pos = line.rfind(' ', 0, wrap_pos)
+                    if space_pos == -1:
+                        space_pos = wrap_pos
+                    lines.append(line[:space_pos])
+                    line = line[space_pos:].lstrip()
+            for l in lines:
+                if y < margin + line_height:
+                    c.showPage()
+                    y = height - margin
+                c.drawString(x, y, l)
+                y -= line_height
+        y -= line_height
+    pages = c.getPageNumber()
+    c.save()
+    return pages
+
+
+def question_paper(pages: int, seed: int = 0) -> str:
+    """Sections of numbered questions with long, wrapping paragraphs, about `pages` pages long."""
+    rng = random.Random(seed)
+    parts = []
+    lines = 0
+    number = 1
+    while lines < pages * LINES_PER_PAGE:
+        if number % 10 == 1:
+            parts.append(f"SECTION {chr(ord('A') + (number // 10) % 26)} ({rng.randint(10, 30)} marks)")
+            lines += 2
+        words = rng.randint(20, 160)
+        body = " ".join(rng.choice(WORDS) for _ in range(words))
+        parts.append(f"Q{number}. {body.capitalize()}? ({rng.randint(1, 5)} marks)")
+        lines += 2 + words // 14
+        number += 1
+    return "\n\n".join(parts)
+
+
+class CountingSink:
+    """Binary stream that discards what is written to it and keeps the byte count."""
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data) -> int:
+        self.size += len(data)
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+
+def measure(fn, text, repeats):
+    best = None
+    for _ in range(repeats):
+        out = CountingSink()
+        tracemalloc.start()
+        start = time.perf_counter()
+        pages = fn(text, out)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        if best is None or elapsed < best[0]:
+            best = (elapsed, peak, pages, out.size)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 20, 30, 40, 50])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    print(f"{'engine':<10} {'pages':>6} {'ms/page':>9} {'total ms':>9} {'peak MiB':>9} {'size KiB':>9}")
+    for target in args.pages:
+        text = question_paper(target)
+        for name, fn in (("legacy", legacy_export_to_pdf), ("streaming", render_pdf)):
+            elapsed, peak, pages, size = measure(fn, text, args.repeats)
+            print(f"{name:<10} {pages:>6} {elapsed * 1000.0 / max(pages, 1):>9.2f} {elapsed * 1000.0:>9.1f} "
+                  f"{peak / 2 ** 20:>9.2f} {size / 1024:>9.1f}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
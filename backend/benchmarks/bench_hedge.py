@@ -0,0 +1,95 @@
+"""
+Benchmark: first-token and total latency of the DeepSeek provider alone vs. hedged with Ollama,
+against two local stub servers (benchmarks.stub_llm), so no API key or network is needed.
+
+Run from backend/:
+    python -m benchmarks.bench_hedge [--requests 200] [--concurrency 4]
+                                     [--primary-tail-fraction 0.1] [--primary-tail-delay 5]
+                                     [--secondary-first-token 0.5]
+
+The primary stub answers most requests after --primary-first-token but a --primary-tail-fraction
+of them only after --primary-tail-delay; the secondary is slower on average but has no tail. The
+first --warmup hedged requests fill the primary's latency window and are left out of the report.
+"""
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+from benchmarks.stub_llm import add_config_arguments, config_from_args, start_stub
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q / 100.0))]
+
+
+def timed(provider, prompt: str) -> Tuple[float, float]:
+    """(first-token seconds, total seconds) for one streamed answer."""
+    start = time.perf_counter()
+    first = None
+    for _ in provider.stream(prompt, max_tokens=64):
+        if first is None:
+            first = time.perf_counter() - start
+    total = time.perf_counter() - start
+    return (first if first is not None else total), total
+
+
+def run(provider, requests: int, concurrency: int) -> List[Tuple[float, float]]:
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(lambda i: timed(provider, f"bench request {i}"), range(requests)))
+
+
+def report(label: str, results: List[Tuple[float, float]]) -> None:
+    first = [r[0] for r in results]
+    total = [r[1] for r in results]
+    print(f"{label:<22} first token p50 {percentile(first, 50) * 1000:8.0f} ms  p95 {percentile(first, 95) * 1000:8.0f} ms"
+          f"  p99 {percentile(first, 99) * 1000:8.0f} ms  | total p95 {percentile(total, 95) * 1000:8.0f} ms")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=7)
+    add_config_arguments(parser, "primary-")
+    add_config_arguments(parser, "secondary-")
+    parser.set_defaults(primary_first_token=0.1, primary_tail_fraction=0.1, primary_tail_delay=3.0,
+                        primary_tokens=64, secondary_first_token=0.4, secondary_tokens=64)
+    args = parser.parse_args()
+
+    primary_stub = start_stub(config_from_args(args, "primary-", seed=args.seed))
+    secondary_stub = start_stub(config_from_args(args, "secondary-", seed=args.seed + 1))
+
+    # Read by app.deepseek_infer / app.providers at import time
+    os.environ["DEEPSEEK_API_URL"] = f"{primary_stub.url}/v1/chat/completions"
+    os.environ.setdefault("DEEPSEEK_API_KEY", "stub")
+    os.environ.setdefault("LLM_HEDGE_MIN_SAMPLES", str(min(20, args.warmup)))
+    os.environ.setdefault("LLM_HEDGE_MIN_DELAY", "0.05")
+    os.environ.setdefault("LLM_MAX_CONCURRENCY", str(max(8, args.concurrency * 2)))
+    from app.providers import DeepSeekProvider, HedgedProvider, OllamaProvider
+
+    primary = DeepSeekProvider()
+    hedged = HedgedProvider(primary, OllamaProvider(base_url=secondary_stub.url))
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}; primary tail "
+          f"{args.primary_tail_fraction:.0%} at {args.primary_tail_delay:.1f}s, secondary first token "
+          f"{args.secondary_first_token:.1f}s")
+    report("deepseek only", run(primary, args.requests, args.concurrency))
+    run(hedged, args.warmup, args.concurrency)
+    report("deepseek + ollama", run(hedged, args.requests, args.concurrency))
+
+    from app.providers import HEDGES, stats
+    print("hedges:", " ".join(line.split("{", 1)[1] for line in HEDGES.samples()) or "none")
+    print("hedge deadline (s):", stats()["hedge_deadline"])
+
+    primary_stub.shutdown()
+    secondary_stub.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""
+Micro-benchmark: per-entry cosine_sim loop vs. the vectorized ChapterIndex top-k.
+
+Run from backend/:
+    python -m benchmarks.bench_retrieval [--k 2] [--repeats 200]
+
+Uses the shipped Grade 9/10 English vectorstores and random unit query vectors,
+so no embedding model is needed.
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+from app.vectorstore import VECTORSTORE_DIR, load_vectorstore
+from app.retrieval import ChapterIndex
+
+STORE_DIRS = ["Grade 9/English", "Grade 10/English"]
+
+
+def legacy_top_k(entries, query_vec, k):
+    """The original rag_pipeline loop: fresh np.array + norm per entry, full Python sort."""
+    def cosine_sim(a, b):
+        a = np.array(a)
+        b = np.array(b)
+        return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+    scored = sorted(
+        [(cosine_sim(query_vec, entry["embedding"]), entry["text"]) for entry in entries],
+        reverse=True, key=lambda x: x[0]
+    )
+    return [text for _, text in scored[:k]]
+
+
+def load_stores():
+    stores = []
+    for rel_dir in STORE_DIRS:
+        full_dir = os.path.join(VECTORSTORE_DIR, rel_dir)
+        if not os.path.isdir(full_dir):
+            continue
+        for name in sorted(os.listdir(full_dir)):
+            if name.endswith("_vectors.json") or name.endswith("_vectors.meta.json"):
+                path = os.path.join(full_dir, name)
+                store = load_vectorstore(path)
+                if len(store) and store.path not in {s.path for s in stores}:
+                    stores.append(store)
+    return stores
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--k", type=int, default=2)
+    parser.add_argument("--repeats", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    stores = load_stores()
+    if not stores:
+        print("No Grade 9/10 English vectorstores found.")
+        return
+    dim = stores[0].embeddings.shape[1]
+    rng = np.random.default_rng(args.seed)
+    queries = rng.standard_normal((args.repeats, dim)).astype(np.float32)
+
+    # The legacy path scored lists of Python floats straight from json.load
+    legacy_entries = [
+        [{"embedding": store.embeddings[i].tolist(), "text": t}
+         for i, t in enumerate(store.texts(range(len(store))))]
+        for store in stores
+    ]
+    rows = sum(len(s) for s in stores)
+
+    start = time.perf_counter()
+    for q in queries:
+        for entries in legacy_entries:
+            legacy_top_k(entries, q, args.k)
+    legacy_s = time.perf_counter() - start
+
+    build_start = time.perf_counter()
+    indexes = [ChapterIndex(store) for store in stores]
+    build_s = time.perf_counter() - build_start
+
+    start = time.perf_counter()
+    for q in queries:
+        for index in indexes:
+            index.search(q, args.k)
+    vector_s = time.perf_counter() - start
+
+    # Both paths must agree on the selected rows
+    for q in queries[:10]:
+        for entries, index in zip(legacy_entries, indexes):
+            assert legacy_top_k(entries, q, args.k) == index.top_texts(q, args.k)
+
+    per_query = lambda total: total / args.repeats * 1000.0
+    print(f"Stores: {len(stores)}  rows: {rows}  dim: {dim}  k: {args.k}  queries: {args.repeats}")
+    print(f"legacy cosine_sim loop : {per_query(legacy_s):8.3f} ms/query (all stores)")
+    print(f"vectorized ChapterIndex: {per_query(vector_s):8.3f} ms/query (all stores), "
+          f"one-off normalize {build_s * 1000.0:.2f} ms")
+    print(f"speedup                : {legacy_s / vector_s:8.1f}x")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
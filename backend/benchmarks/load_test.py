@@ -0,0 +1,347 @@
+"""
+Load test: how many concurrent generations one instance of app.main:app sustains.
+
+Run from backend/:
+    python -m benchmarks.load_test [--scenarios generate generate_stream export] [--requests 50]
+                                   [--concurrency 1 4 16] [--first-token 0.5] [--tokens-per-second 50]
+                                   [--tokens 400] [--error-rate 0] [--out results.json] [--compare old.json]
+
+Starts a mock DeepSeek API (benchmarks.stub_llm: configurable first-token latency, token rate and
+error rate, SSE or JSON depending on the request) and the app under uvicorn pointed at it, with
+the generation cache off so every request reaches the mock. Then drives each scenario at each
+concurrency level:
+
+    generate         POST /api/generate          (non-streaming upstream call)
+    generate_stream  GET  /api/generate_stream   (streaming upstream call, SSE to the client)
+    export           POST /api/export            (plain PDF of --export-chars characters)
+
+and reports throughput, p50/p95/p99 latency and time to first byte, and the app's peak RSS. The
+results are written as JSON (with the git commit) so runs can be compared with --compare.
+Use --url to test an app that is already running instead (RSS is then not measured).
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import threading
+import subprocess
+import itertools
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from urllib.parse import urlencode, urlparse
+
+from benchmarks.stub_llm import add_config_arguments, config_from_args, start_stub
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ("generate", "generate_stream", "export")
+WORDS = ("the river flows past the village and the children learn how rain forms clouds and "
+         "returns to the fields explain with examples from the chapter").split()
+_export_ids = itertools.count(1)  # unique export texts across all runs, so none is served by the artifact dedupe
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q / 100.0))]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def rss_bytes(pid: int) -> Optional[int]:
+    """Resident set size of a process (Linux /proc), None where unavailable."""
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+class RSSSampler(threading.Thread):
+    """Polls the app's RSS while a scenario runs and keeps the peak."""
+
+    def __init__(self, pid: Optional[int], interval: float = 0.1):
+        super().__init__(name="rss-sampler", daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak: Optional[int] = None
+        self._done = threading.Event()
+
+    def run(self) -> None:
+        while self.pid is not None and not self._done.is_set():
+            value = rss_bytes(self.pid)
+            if value is not None and (self.peak is None or value > self.peak):
+                self.peak = value
+            self._done.wait(self.interval)
+
+    def stop(self) -> Optional[int]:
+        self._done.set()
+        self.join()
+        return self.peak
+
+
+class AppClient:
+    def __init__(self, base_url: str, timeout: float = 600.0):
+        parsed = urlparse(base_url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.timeout = timeout
+
+    def request(self, method: str, path: str, body: Optional[dict] = None) -> Dict[str, object]:
+        """One request; returns status, latency (full body read) and ttfb (first body byte) in seconds."""
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        headers = {"Content-Type": "application/json"} if data is not None else {}
+        start = time.perf_counter()
+        try:
+            conn.request(method, path, body=data, headers=headers)
+            response = conn.getresponse()
+            first = response.read(1)
+            ttfb = time.perf_counter() - start
+            rest = response.read()
+            latency = time.perf_counter() - start
+            payload = first + rest
+            ok = response.status < 400
+            if ok and path.startswith("/api/generate_stream"):
+                ok = b'"stage": "done"' in payload  # errors arrive as an SSE event with status 200
+            return {"ok": ok, "status": response.status, "latency": latency, "ttfb": ttfb, "bytes": len(payload)}
+        except (OSError, http.client.HTTPException) as ex:
+            return {"ok": False, "status": None, "latency": time.perf_counter() - start, "ttfb": None,
+                    "bytes": 0, "error": str(ex)}
+        finally:
+            conn.close()
+
+    def wait_ready(self, timeout: float) -> dict:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                conn = http.client.HTTPConnection(self.host, self.port, timeout=5)
+                conn.request("GET", "/api/ready")
+                response = conn.getresponse()
+                report = json.loads(response.read() or b"{}")
+                conn.close()
+                if response.status == 200:
+                    return report
+            except (OSError, http.client.HTTPException, ValueError):
+                report = None
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"App not ready after {timeout:.0f}s: {report}")
+            time.sleep(0.25)
+
+    def get_json(self, path: str):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        try:
+            conn.request("GET", path)
+            return json.loads(conn.getresponse().read())
+        finally:
+            conn.close()
+
+
+def export_text(chars: int, index: int) -> str:
+    words, size, i = [], 0, 0
+    while size < chars:
+        word = WORDS[(i * 7 + index) % len(WORDS)]
+        words.append(word)
+        size += len(word) + 1
+        i += 1
+        if i % 80 == 0:
+            words.append("\n\n")
+    return f"Load test export {index}\n\n" + " ".join(words)
+
+
+def make_request(scenario: str, index: int, args, chapter: dict):
+    spec = {"grade": chapter["grade"], "chapter": chapter["name"], "material_type": args.material_type,
+            "difficulty": "Medium"}
+    if scenario == "generate":
+        return "POST", "/api/generate", spec
+    if scenario == "generate_stream":
+        return "GET", "/api/generate_stream?" + urlencode(spec), None
+    text = export_text(args.export_chars, next(_export_ids) if args.export_unique else 0)
+    return "POST", "/api/export", {"text": text, "filetype": "pdf"}
+
+
+def run_scenario(client: AppClient, scenario: str, concurrency: int, args, chapter: dict, pid: Optional[int]) -> dict:
+    sampler = RSSSampler(pid)
+    rss_before = rss_bytes(pid) if pid else None
+    sampler.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda i: client.request(*make_request(scenario, i, args, chapter)),
+                                range(args.requests)))
+    duration = time.perf_counter() - start
+    peak = sampler.stop()
+
+    ok = [r for r in results if r["ok"]]
+    latency = [r["latency"] for r in ok]
+    ttfb = [r["ttfb"] for r in ok if r["ttfb"] is not None]
+    errors: Dict[str, int] = {}
+    for r in results:
+        if not r["ok"]:
+            key = str(r["status"] or r.get("error"))
+            errors[key] = errors.get(key, 0) + 1
+    summary = {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": len(results),
+        "ok": len(ok),
+        "errors": errors,
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(len(ok) / duration, 3) if duration else None,
+        "latency_s": {f"p{q}": percentile(latency, q) for q in (50, 95, 99)},
+        "ttfb_s": {f"p{q}": percentile(ttfb, q) for q in (50, 95, 99)},
+        "rss_before_bytes": rss_before,
+        "rss_peak_bytes": peak,
+    }
+    print(f"{scenario:<16} c={concurrency:<3} ok {len(ok):>4}/{len(results):<4} {summary['throughput_rps'] or 0:7.2f} req/s"
+          f"  p50 {_ms(summary['latency_s']['p50'])}  p95 {_ms(summary['latency_s']['p95'])}"
+          f"  p99 {_ms(summary['latency_s']['p99'])}  ttfb p95 {_ms(summary['ttfb_s']['p95'])}"
+          f"  rss peak {_mb(peak)}")
+    return summary
+
+
+def _ms(value: Optional[float]) -> str:
+    return f"{value * 1000:8.0f} ms" if value is not None else "       - ms"
+
+
+def _mb(value: Optional[int]) -> str:
+    return f"{value / 2 ** 20:.0f} MiB" if value is not None else "-"
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(old_path: str, results: List[dict]) -> None:
+    """Prints throughput and p95 latency changes against an earlier results file."""
+    with open(old_path, "r", encoding="utf-8") as f:
+        old = json.load(f)
+    before = {(r["scenario"], r["concurrency"]): r for r in old["results"]}
+    print(f"\nCompared with {old_path} (commit {old.get('commit')}):")
+    for r in results:
+        o = before.get((r["scenario"], r["concurrency"]))
+        if o is None:
+            continue
+        changes = []
+        for label, new, prev in (("throughput", r["throughput_rps"], o["throughput_rps"]),
+                                 ("p95", r["latency_s"]["p95"], o["latency_s"]["p95"]),
+                                 ("ttfb p95", r["ttfb_s"]["p95"], o["ttfb_s"]["p95"])):
+            if new is not None and prev:
+                changes.append(f"{label} {(new - prev) / prev:+.1%}")
+        print(f"  {r['scenario']:<16} c={r['concurrency']:<3} " + ", ".join(changes))
+
+
+def start_app(port: int, stub_url: str, args) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        "DEEPSEEK_API_URL": f"{stub_url}/v1/chat/completions",
+        "DEEPSEEK_API_KEY": env.get("DEEPSEEK_API_KEY") or "stub",
+        "LLM_PROVIDER": "deepseek",
+        "LLM_HEDGE_PROVIDER": "",
+        "GENERATION_CACHE_BACKEND": "none",  # every request reaches the mock
+        "PRELOAD_PANDOC": "0",
+        "LOG_LEVEL": args.log_level,
+        "ARTIFACT_DIR": os.path.join(BACKEND_DIR, "cache", "load-test-artifacts"),
+    })
+    command = [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+               "--log-level", "warning"]
+    return subprocess.Popen(command, cwd=BACKEND_DIR, env=env)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=50, help="requests per scenario and concurrency level")
+    parser.add_argument("--grade", default=None, help="grade of the chapter to generate for (default: first in catalog)")
+    parser.add_argument("--chapter", default=None, help="chapter name (default: first chapter of the grade)")
+    parser.add_argument("--material-type", default="Worksheet")
+    parser.add_argument("--export-chars", type=int, default=20000)
+    parser.add_argument("--export-same", dest="export_unique", action="store_false",
+                        help="export the same text every time (measures the artifact dedupe path)")
+    parser.add_argument("--url", default=None, help="test an app that is already running at this URL")
+    parser.add_argument("--ready-timeout", type=float, default=300.0)
+    parser.add_argument("--log-level", default="WARNING", help="LOG_LEVEL of the app under test")
+    parser.add_argument("--out", default=None, help="results file (default: benchmarks/results/load-<commit>-<time>.json)")
+    parser.add_argument("--compare", default=None, help="earlier results file to compare against")
+    parser.add_argument("--seed", type=int, default=0)
+    add_config_arguments(parser)
+    parser.set_defaults(first_token=0.5, tokens=400)
+    args = parser.parse_args()
+
+    stub = app = None
+    if args.url:
+        base_url, pid = args.url.rstrip("/"), None
+    else:
+        stub = start_stub(config_from_args(args, seed=args.seed))
+        port = free_port()
+        app = start_app(port, stub.url, args)
+        base_url, pid = f"http://127.0.0.1:{port}", app.pid
+    client = AppClient(base_url)
+
+    try:
+        started = time.perf_counter()
+        startup = client.wait_ready(args.ready_timeout)
+        print(f"App ready at {base_url} after {time.perf_counter() - started:.1f}s"
+              + (f" (mock DeepSeek at {stub.url})" if stub else ""))
+        query = "?" + urlencode({"grade": args.grade}) if args.grade else ""
+        chapters = client.get_json("/api/chapters" + query)
+        if args.chapter:
+            chapters = [c for c in chapters if args.chapter.lower() in (c["name"].lower(), c["title"].lower())]
+        if not chapters:
+            print("No matching chapter with a vectorstore; see GET /api/chapters")
+            return 1
+        chapter = chapters[0]
+        print(f"Generating for grade {chapter['grade']}, chapter '{chapter['name']}'")
+
+        results = []
+        for scenario in args.scenarios:
+            for concurrency in args.concurrency:
+                results.append(run_scenario(client, scenario, concurrency, args, chapter, pid))
+
+        report = {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "base_url": base_url,
+            "chapter": {"grade": chapter["grade"], "name": chapter["name"]},
+            "mock": None if stub is None else vars(stub.config),
+            "args": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+            "startup": startup,
+            "rss_end_bytes": rss_bytes(pid) if pid else None,
+            "results": results,
+        }
+        out = args.out or os.path.join(BACKEND_DIR, "benchmarks", "results",
+                                       f"load-{report['commit'] or 'nogit'}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+        with open(out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1)
+        print(f"Results written to {out}")
+        if args.compare:
+            compare(args.compare, results)
+        return 0
+    finally:
+        if app is not None:
+            app.terminate()
+            try:
+                app.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                app.kill()
+        if stub is not None:
+            stub.shutdown()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,205 @@
+"""
+Local stub of the two upstream LLM APIs, for exercising the provider layer end to end without
+network access or API keys:
+
+    POST /v1/chat/completions   DeepSeek/OpenAI style; SSE ("data: {...}" ... "data: [DONE]") when
+                                "stream" is true, a single JSON body otherwise
+    POST /api/chat              Ollama style; newline-delimited JSON chunks when "stream" is true
+                                (the default), a single JSON body otherwise
+
+Run from backend/:
+    python -m benchmarks.stub_llm [--port 8089] [--first-token 0.2] [--tail-fraction 0.1]
+                                  [--tail-delay 5] [--tokens-per-second 50] [--tokens 200] [--error-rate 0]
+
+then point the app at it, e.g.
+    DEEPSEEK_API_URL=http://127.0.0.1:8089/v1/chat/completions DEEPSEEK_API_KEY=stub \
+    OLLAMA_URL=http://127.0.0.1:8089 uvicorn app.main:app
+
+Latency is first-token delay (with `tail_fraction` of requests taking `tail_delay` instead) followed
+by `tokens` tokens at `tokens_per_second`; `error_rate` of requests get a 503 before any output.
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Tuple
+
+WORDS = ("read the passage and answer the questions that follow explain with examples from the "
+         "chapter why the author describes the river as a friend to the village").split()
+
+
+@dataclass
+class StubConfig:
+    first_token: float = 0.2
+    tail_fraction: float = 0.0
+    tail_delay: float = 5.0
+    tokens_per_second: float = 50.0
+    tokens: int = 200
+    error_rate: float = 0.0
+    seed: Optional[int] = None
+
+
+class StubLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], config: StubConfig):
+        super().__init__(address, _Handler)
+        self.config = config
+        self.random = random.Random(config.seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+
+    def draw(self) -> Tuple[bool, float]:
+        """(fail, first-token delay) for the next request."""
+        with self._lock:
+            self.requests += 1
+            fail = self.random.random() < self.config.error_rate
+            slow = self.random.random() < self.config.tail_fraction
+        return fail, self.config.tail_delay if slow else self.config.first_token
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: StubLLMServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        try:
+            payload = json.loads(body or b"{}")
+        except ValueError:
+            return self._send_json(400, {"error": "invalid JSON"})
+        if self.path == "/v1/chat/completions":
+            ollama = False
+            stream = bool(payload.get("stream"))
+            limit = payload.get("max_tokens")
+        elif self.path == "/api/chat":
+            ollama = True
+            stream = payload.get("stream", True)
+            limit = (payload.get("options") or {}).get("num_predict")
+        else:
+            return self._send_json(404, {"error": f"unknown path {self.path}"})
+
+        config = self.server.config
+        fail, delay = self.server.draw()
+        if fail:
+            return self._send_json(503, {"error": "stub: simulated upstream failure"})
+        count = min(config.tokens, int(limit)) if limit else config.tokens
+        words = [WORDS[i % len(WORDS)] + " " for i in range(count)]
+        model = payload.get("model", "stub")
+        if not stream:
+            time.sleep(delay + (count / config.tokens_per_second if config.tokens_per_second > 0 else 0))
+            text = "".join(words)
+            if ollama:
+                return self._send_json(200, {"model": model, "message": {"role": "assistant", "content": text},
+                                             "done": True, "eval_count": count})
+            return self._send_json(200, {
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": len(json.dumps(payload.get("messages", []))) // 4,
+                          "completion_tokens": count, "total_tokens": count},
+            })
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson" if ollama else "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self.wfile.flush()
+        # Like the real APIs, a stream answers with its headers at once and then thinks until the first token
+        gap = 1.0 / config.tokens_per_second if config.tokens_per_second > 0 else 0.0
+        try:
+            time.sleep(delay)
+            for i, word in enumerate(words):
+                if i and gap:
+                    time.sleep(gap)
+                if ollama:
+                    self._chunk(json.dumps({"model": model, "message": {"role": "assistant", "content": word},
+                                            "done": False}) + "\n")
+                else:
+                    self._chunk("data: " + json.dumps({"model": model, "choices": [
+                        {"index": 0, "delta": {"content": word}, "finish_reason": None}]}) + "\n\n")
+            if ollama:
+                self._chunk(json.dumps({"model": model, "message": {"role": "assistant", "content": ""},
+                                        "done": True, "eval_count": count}) + "\n")
+            else:
+                self._chunk("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client cancelled the stream
+
+    def _chunk(self, text: str) -> None:
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_json(self, status: int, payload: dict) -> None:
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_stub(config: StubConfig, host: str = "127.0.0.1", port: int = 0) -> StubLLMServer:
+    """Starts a stub server on a daemon thread (port 0 picks a free port); stop it with shutdown()."""
+    server = StubLLMServer((host, port), config)
+    threading.Thread(target=server.serve_forever, name="stub-llm", daemon=True).start()
+    return server
+
+
+def add_config_arguments(parser: argparse.ArgumentParser, prefix: str = "") -> None:
+    defaults = StubConfig()
+    parser.add_argument(f"--{prefix}first-token", type=float, default=defaults.first_token,
+                        help="seconds before the first token")
+    parser.add_argument(f"--{prefix}tail-fraction", type=float, default=defaults.tail_fraction,
+                        help="fraction of requests that wait --tail-delay instead")
+    parser.add_argument(f"--{prefix}tail-delay", type=float, default=defaults.tail_delay)
+    parser.add_argument(f"--{prefix}tokens-per-second", type=float, default=defaults.tokens_per_second)
+    parser.add_argument(f"--{prefix}tokens", type=int, default=defaults.tokens, help="tokens per answer")
+    parser.add_argument(f"--{prefix}error-rate", type=float, default=defaults.error_rate,
+                        help="fraction of requests answered with a 503")
+
+
+def config_from_args(args: argparse.Namespace, prefix: str = "", seed: Optional[int] = None) -> StubConfig:
+    prefix = prefix.replace("-", "_")
+    return StubConfig(
+        first_token=getattr(args, f"{prefix}first_token"),
+        tail_fraction=getattr(args, f"{prefix}tail_fraction"),
+        tail_delay=getattr(args, f"{prefix}tail_delay"),
+        tokens_per_second=getattr(args, f"{prefix}tokens_per_second"),
+        tokens=getattr(args, f"{prefix}tokens"),
+        error_rate=getattr(args, f"{prefix}error_rate"),
+        seed=seed,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--seed", type=int, default=None)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    server = StubLLMServer((args.host, args.port), config_from_args(args, seed=args.seed))
+    print(f"Stub LLM server on {server.url} (DeepSeek: {server.url}/v1/chat/completions, Ollama: {server.url}/api/chat)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
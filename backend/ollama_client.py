@@ -1,34 +1,15 @@
-import os
-import requests
+"""
+Compatibility wrappers for callers of the old module; the providers now live in app.providers.
+The DeepSeek key is read from DEEPSEEK_API_KEY by app.deepseek_infer.
+"""
+from typing import Optional
 
-DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"
-DEEPSEEK_MODEL = "deepseek-reasoner"
-DEEPSEEK_API_KEY = os.getenv("sk-ebe886b5b79b469f8023fad761cbb3fc")  # Set your API key in your environment variables
+from app.providers import PROVIDERS
 
-def query_deepseek(prompt: str, system_prompt: str = None, max_tokens: int = 2048, **kwargs) -> str:
-    if not DEEPSEEK_API_KEY:
-        raise ValueError("DeepSeek API key not set in environment variable DEEPSEEK_API_KEY.")
 
-    headers = {
-        "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
-        "Content-Type": "application/json"
-    }
+def query_deepseek(prompt: str, system_prompt: Optional[str] = None, max_tokens: int = 2048) -> str:
+    return PROVIDERS["deepseek"].complete(prompt, system_prompt=system_prompt, max_tokens=max_tokens)
 
-    messages = []
-    if system_prompt:
-        messages.append({"role": "system", "content": system_prompt})
-    messages.append({"role": "user", "content": prompt})
 
-    payload = {
-        "model": DEEPSEEK_MODEL,
-        "messages": messages,
-        "max_tokens": max_tokens,
-    }
-    payload.update(kwargs)
-
-    response = requests.post(DEEPSEEK_API_URL, headers=headers, json=payload)
-    if not response.ok:
-        raise RuntimeError(f"DeepSeek API response code: {response.status_code} {response.text}")
-
-    data = response.json()
-    return data["choices"][0]["message"]["content"]
\ No newline at end of file
+def query_ollama(prompt: str, system_prompt: Optional[str] = None, max_tokens: int = 2048) -> str:
+    return PROVIDERS["ollama"].complete(prompt, system_prompt=system_prompt, max_tokens=max_tokens)
@@ -0,0 +1,77 @@
+"""
+Build step for the container image, so a new instance only has to map files at startup instead
+of downloading the embedding model or reading JSON vectorstores on its first request.
+
+Run from backend/ (the Dockerfile does this after copying the app):
+    python -m scripts.prebuild [--skip-model] [--skip-index] [--float16]
+
+1. Downloads the embedding model into the Hugging Face cache (HF_HOME / SENTENCE_TRANSFORMERS_HOME)
+   and runs one encode, so the image holds everything the model needs.
+2. Converts JSON vectorstores to the memory-mapped binary format (app.vectorstore).
+3. Builds the chapter catalog and the ANN index for whole-book/whole-grade retrieval (app.ann_index).
+4. Precomputes the retrieval results of every single-chapter request (app.materialized; needs the model).
+"""
+import sys
+import time
+import argparse
+
+from app.vectorstore import VECTORSTORE_DIR, convert_tree
+
+
+def step(name: str, function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    print(f"[prebuild] {name}: {time.perf_counter() - start:.1f}s")
+    return result
+
+
+def download_model() -> None:
+    from app.embeddings import get_embedding_service
+    service = get_embedding_service()
+    service.load()
+    vectors = service.encode(["warm-up"])
+    print(f"[prebuild] embedding model {service.model_name}: dim {vectors.shape[1]}")
+
+
+def build_indexes(root: str, nlist=None) -> None:
+    from app.catalog import build_catalog
+    from app.ann_index import build_index
+    catalog = build_catalog(root_dir=root)
+    print(f"[prebuild] chapter catalog: {catalog.stats()}")
+    if not len(catalog):
+        print("[prebuild] no vectorstores, skipping the ANN index")
+        return
+    index = build_index(root, nlist=nlist)
+    print(f"[prebuild] ANN index: {index.stats()}")
+
+
+def materialize() -> None:
+    from app.materialized import build_materialized
+    table = build_materialized()
+    print(f"[prebuild] materialized retrieval: {len(table)} requests over {len(table.files)} vectorstores")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--root", default=VECTORSTORE_DIR, help="Vectorstore directory")
+    parser.add_argument("--skip-model", action="store_true", help="Do not download the embedding model")
+    parser.add_argument("--skip-index", action="store_true", help="Do not convert vectorstores or build the ANN index")
+    parser.add_argument("--float16", action="store_true", help="Convert vectorstores to float16 (half the size)")
+    parser.add_argument("--nlist", type=int, default=None, help="Inverted lists of the ANN index (default: sqrt(rows))")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    if not args.skip_model:
+        step("embedding model", download_model)
+    if not args.skip_index:
+        converted = step("vectorstore conversion", convert_tree, args.root, dtype="float16" if args.float16 else "float32")
+        print(f"[prebuild] converted {len(converted)} vectorstore(s)")
+        step("indexes", build_indexes, args.root, args.nlist)
+        if not args.skip_model:
+            step("materialized retrieval", materialize)
+    print(f"[prebuild] done in {time.perf_counter() - start:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
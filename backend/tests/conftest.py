@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+# Tests import the app and the benchmarks as backend/ does: `python -m pytest tests` from backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stub_llm import StubConfig, start_stub
+
+
+@pytest.fixture
+def stub():
+    """Starts local stub LLM servers: stub(first_token=..., tokens=..., ...) -> server with .url."""
+    servers = []
+
+    def start(**config):
+        config.setdefault("first_token", 0.0)
+        config.setdefault("tokens_per_second", 0)
+        config.setdefault("tokens", 20)
+        server = start_stub(StubConfig(seed=0, **config))
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,25 @@
+import pytest
+
+from app.artifacts import parse_range
+
+
+@pytest.mark.parametrize("header", [None, "", "items=0-10", "bytes=0-1,4-5"])
+def test_whole_file_without_a_single_byte_range(header):
+    assert parse_range(header, 100) is None
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-9", (0, 9)),
+    ("bytes=90-", (90, 99)),
+    ("bytes=50-500", (50, 99)),
+    ("bytes=-10", (90, 99)),
+    ("bytes=-500", (0, 99)),
+])
+def test_ranges(header, expected):
+    assert parse_range(header, 100) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=100-", "bytes=10-5", "bytes=-0", "bytes=a-b", "bytes=-"])
+def test_unsatisfiable_or_malformed_ranges_raise(header):
+    with pytest.raises(ValueError):
+        parse_range(header, 100)
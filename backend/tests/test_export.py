@@ -0,0 +1,45 @@
+import io
+
+import pytest
+
+PyPDF2 = pytest.importorskip("PyPDF2")
+pytest.importorskip("reportlab")
+
+from app.export import A4, PDFStreamWriter, render_pdf
+
+
+def read(data: bytes):
+    return PyPDF2.PdfReader(io.BytesIO(data), strict=True)
+
+
+def test_writer_output_parses_with_one_page_per_end_page():
+    out = io.BytesIO()
+    writer = PDFStreamWriter(out)
+    writer.draw_line(40, 800, "First page")
+    writer.end_page()
+    writer.draw_line(40, 800, r"Brackets (a) \ and (b)")
+    writer.close()
+
+    pdf = read(out.getvalue())
+    assert len(pdf.pages) == writer.page_count == 2
+    assert "First page" in pdf.pages[0].extract_text()
+    assert r"Brackets (a) \ and (b)" in pdf.pages[1].extract_text()
+    assert [float(v) for v in pdf.pages[0].mediabox] == pytest.approx([0, 0, *A4], abs=0.01)
+
+
+def test_empty_document_still_has_a_page():
+    out = io.BytesIO()
+    PDFStreamWriter(out).close()
+    assert len(read(out.getvalue()).pages) == 1
+
+
+def test_render_pdf_paginates_and_keeps_the_text(tmp_path):
+    questions = [f"Q{i}. Explain why the river matters to the village (Part {i}). (2 marks)" for i in range(1, 121)]
+    path = tmp_path / "paper.pdf"
+    pages = render_pdf("\n\n".join(questions), str(path))
+
+    pdf = read(path.read_bytes())
+    assert pages == len(pdf.pages) > 1
+    text = "".join(page.extract_text() for page in pdf.pages)
+    for question in (questions[0], questions[59], questions[-1]):
+        assert question in text
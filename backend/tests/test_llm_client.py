@@ -0,0 +1,80 @@
+import threading
+
+import pytest
+
+pytest.importorskip("requests")
+pytest.importorskip("dotenv")
+
+from app import deepseek_infer, llm_client
+from app.providers import OllamaProvider
+
+
+@pytest.fixture
+def deepseek_stub(stub, monkeypatch):
+    def start(**config):
+        server = stub(**config)
+        monkeypatch.setattr(deepseek_infer, "DEEPSEEK_API_URL", server.url + "/v1/chat/completions")
+        monkeypatch.setattr(deepseek_infer, "DEEPSEEK_API_KEY", "stub")
+        return server
+    return start
+
+
+def test_stream_deepseek_yields_every_delta(deepseek_stub):
+    deepseek_stub(tokens=12)
+    deltas = list(deepseek_infer.stream_deepseek("prompt"))
+    assert len(deltas) == 12
+    assert llm_client.limiter.in_flight == 0
+
+
+def test_ask_deepseek_respects_max_tokens(deepseek_stub):
+    deepseek_stub(tokens=50)
+    assert len(deepseek_infer.ask_deepseek("prompt", max_tokens=5).split()) == 5
+
+
+def test_ollama_stream_and_complete(stub):
+    server = stub(tokens=8)
+    provider = OllamaProvider(base_url=server.url, model="stub")
+    assert len(list(provider.stream("prompt"))) == 8
+    assert len(provider.complete("prompt").split()) == 8
+
+
+def test_retries_then_raises_on_upstream_errors(deepseek_stub, monkeypatch):
+    server = deepseek_stub(error_rate=1.0)
+    monkeypatch.setattr(llm_client, "LLM_MAX_RETRIES", 2)
+    monkeypatch.setattr(llm_client, "LLM_BACKOFF_BASE", 0.0)
+    with pytest.raises(llm_client.LLMHTTPError) as raised:
+        deepseek_infer.ask_deepseek("prompt")
+    assert raised.value.status_code == 503
+    assert server.requests == 3
+    assert llm_client.limiter.in_flight == 0
+
+
+def test_cancelled_scope_never_sends(deepseek_stub):
+    server = deepseek_stub()
+    scope = llm_client.CancelScope()
+    scope.cancel()
+    with scope:
+        with pytest.raises(llm_client.Cancelled):
+            list(deepseek_infer.stream_deepseek("prompt"))
+    assert server.requests == 0
+
+
+def test_cancel_closes_a_stream_waiting_for_its_first_token(deepseek_stub):
+    deepseek_stub(first_token=30.0)
+    scope = llm_client.CancelScope()
+    outcome = []
+
+    def run():
+        with scope:
+            try:
+                list(deepseek_infer.stream_deepseek("prompt"))
+            except llm_client.Cancelled:
+                outcome.append("cancelled")
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(0.5)
+    scope.cancel()
+    thread.join(5)
+    assert outcome == ["cancelled"]
+    assert llm_client.limiter.in_flight == 0
@@ -0,0 +1,51 @@
+from app.paper import question_marks, renumber, use_sections
+from app.prompts import CBSE10_SECTIONS
+
+CASE_STUDY = """36. Read the passage and answer the questions that follow.
+The report lists what the flood destroyed:
+1. the village
+2. the fields
+(i) What did the flood destroy first? [1 mark]
+(ii) Why were the fields lost? [1 mark]
+(iii) How could the village have been protected? [2 marks]
+[4 marks]
+37. Read the passage and answer the questions that follow.
+Rainfall was highest in July. [4 marks]
+38. Read the passage and answer the questions that follow.
+Rainfall was lowest in May. [4 marks]"""
+
+
+def test_renumber_keeps_numbered_lists_inside_a_question():
+    text, count = renumber(CASE_STUDY, 36)
+    assert count == 3
+    assert "1. the village\n2. the fields" in text
+    assert [line.split(".")[0] for line in text.splitlines() if line.startswith("3")] == ["36", "37", "38"]
+
+
+def test_renumber_fixes_numbering_from_the_section_start():
+    text, count = renumber("1. What is a tissue? [1 mark]\n2) Name one. [1 mark]\nQ3. Define it. [1 mark]", 21)
+    assert count == 3
+    assert text.splitlines() == ["21. What is a tissue? [1 mark]", "22. Name one. [1 mark]", "23. Define it. [1 mark]"]
+
+
+def test_renumber_counts_consecutive_questions_without_marks():
+    text, count = renumber("19. First\n20. Second", 19)
+    assert count == 2
+    assert text == "19. First\n20. Second"
+
+
+def test_question_marks_per_question():
+    assert question_marks(CASE_STUDY) == [4, 4, 4]
+    assert question_marks("1. One [2 marks]\n2. Two\n3. Three (3 marks)") == [2, None, 3]
+
+
+def test_sections_cover_the_pattern():
+    assert sum(section.total for section in CBSE10_SECTIONS) == 80
+    assert CBSE10_SECTIONS[0].first == 1 and CBSE10_SECTIONS[-1].last == 38
+
+
+def test_sections_are_opt_in():
+    assert not use_sections("Grade 10", "Question Paper", 80)
+    assert use_sections("Grade 10", "Question Paper", 80, sectioned=True)
+    assert not use_sections("Grade 10", "Question Paper", 40, sectioned=True)
+    assert not use_sections("Grade 9", "Question Paper", 80, sectioned=True)
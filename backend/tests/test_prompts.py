@@ -0,0 +1,27 @@
+from app.prompts import ContextBudgeter, ContextChunk
+
+RIVER = ("The river rises in the hills above the village and floods the fields every monsoon, "
+         "bringing fresh silt that the farmers depend on for their rice.")
+
+
+def chunk(text, score, source, ident):
+    return ContextChunk(text, score, source, [ident])
+
+
+def test_near_duplicates_keep_the_better_copy():
+    chunks = [chunk(RIVER, 0.7, "geo", "a"), chunk(RIVER + " ", 0.9, "geo", "b"),
+              chunk("Photosynthesis turns light into chemical energy in the leaves.", 0.5, "bio", "c")]
+    chosen, dropped = ContextBudgeter(max_tokens=10_000).select(chunks)
+    assert [c.ids[0] for c in chosen] == ["b", "c"]
+    assert dropped == {"duplicates": 1, "over_budget": 0}
+
+
+def test_budget_keeps_every_source_first_and_retrieval_order():
+    words = "alpha beta gamma delta epsilon zeta eta theta iota kappa".split()
+    chunks = [chunk(" ".join(f"{w}{i}" for w in words), score, source, f"{source}{i}")
+              for i, (score, source) in enumerate([(0.9, "one"), (0.8, "one"), (0.7, "one"), (0.2, "two")])]
+    budget = chunks[0].tokens + chunks[3].tokens
+    chosen, dropped = ContextBudgeter(max_tokens=budget).select(chunks)
+    assert [c.ids[0] for c in chosen] == ["one0", "two3"]
+    assert dropped == {"duplicates": 0, "over_budget": 2}
+    assert sum(c.tokens for c in chosen) <= budget
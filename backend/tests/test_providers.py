@@ -0,0 +1,106 @@
+import time
+import threading
+
+import pytest
+
+pytest.importorskip("requests")
+pytest.importorskip("dotenv")
+
+from app import deepseek_infer, llm_client, providers
+from app.providers import DeepSeekProvider, HedgedProvider, LatencyTracker, LLMProvider, OllamaProvider
+
+
+class FakeProvider(LLMProvider):
+    """Yields `deltas` after `first_token` seconds, or raises `error`; cancelling its racer ends the wait."""
+
+    def __init__(self, name, deltas=("one ", "two "), first_token=0.0, error=None):
+        self.name = self.model = name
+        self.deltas = deltas
+        self.first_token = first_token
+        self.error = error
+        self.calls = 0
+        self.cancelled = False
+        self.finished = threading.Event()
+
+    def stream(self, prompt, system_prompt=None, max_tokens=2048):
+        self.calls += 1
+        scope = llm_client.current_scope()
+        try:
+            if scope is not None and scope.cancelled.wait(self.first_token):
+                self.cancelled = True
+                return
+            if self.error is not None:
+                raise self.error
+            yield from self.deltas
+        finally:
+            self.finished.set()
+
+
+@pytest.fixture(autouse=True)
+def fresh_trackers(monkeypatch):
+    monkeypatch.setattr(providers, "_trackers", {})
+    monkeypatch.setattr(providers, "LLM_HEDGE_MAX_DELAY", 0.1)
+
+
+def test_fast_primary_is_not_hedged():
+    primary, secondary = FakeProvider("p"), FakeProvider("s", deltas=("other",))
+    assert list(HedgedProvider(primary, secondary).stream("prompt")) == ["one ", "two "]
+    assert secondary.calls == 0
+
+
+def test_slow_primary_is_hedged_and_cancelled():
+    primary = FakeProvider("p", first_token=5.0)
+    secondary = FakeProvider("s", deltas=("fast",))
+    started = time.perf_counter()
+    assert HedgedProvider(primary, secondary).stream("prompt").__next__() == "fast"
+    assert time.perf_counter() - started < 2.0
+    assert primary.finished.wait(2.0)
+    assert primary.cancelled
+
+
+def test_failing_primary_fails_over_without_waiting_for_the_deadline(monkeypatch):
+    monkeypatch.setattr(providers, "LLM_HEDGE_MAX_DELAY", 60.0)
+    primary = FakeProvider("p", error=RuntimeError("primary down"))
+    secondary = FakeProvider("s", deltas=("fallback",))
+    started = time.perf_counter()
+    assert list(HedgedProvider(primary, secondary).stream("prompt")) == ["fallback"]
+    assert time.perf_counter() - started < 2.0
+
+
+def test_both_failing_raises_the_primary_error():
+    primary = FakeProvider("p", error=RuntimeError("primary down"))
+    secondary = FakeProvider("s", error=RuntimeError("secondary down"))
+    with pytest.raises(RuntimeError, match="primary down"):
+        list(HedgedProvider(primary, secondary).stream("prompt"))
+
+
+def test_deadline_is_the_clamped_percentile(monkeypatch):
+    monkeypatch.setattr(providers, "LLM_HEDGE_MIN_SAMPLES", 5)
+    monkeypatch.setattr(providers, "LLM_HEDGE_MIN_DELAY", 1.0)
+    monkeypatch.setattr(providers, "LLM_HEDGE_MAX_DELAY", 10.0)
+    tracker = LatencyTracker(window=10)
+    tracker.observe(3.0)
+    assert tracker.deadline() == 10.0  # too few samples
+    for seconds in (2.0, 4.0, 5.0, 6.0):
+        tracker.observe(seconds)
+    assert tracker.deadline() == 6.0
+    for _ in range(10):
+        tracker.observe(0.2)
+    assert tracker.deadline() == 1.0
+
+
+def test_hedge_against_stub_servers_shuts_down_the_loser(stub, monkeypatch):
+    slow = stub(first_token=5.0)
+    fast = stub(tokens=8)
+    monkeypatch.setattr(deepseek_infer, "DEEPSEEK_API_URL", slow.url + "/v1/chat/completions")
+    monkeypatch.setattr(deepseek_infer, "DEEPSEEK_API_KEY", "stub")
+
+    started = time.perf_counter()
+    text = HedgedProvider(DeepSeekProvider(), OllamaProvider(base_url=fast.url)).complete("prompt")
+    assert len(text.split()) == 8
+    assert time.perf_counter() - started < 3.0
+    assert (slow.requests, fast.requests) == (1, 1)
+    deadline = time.monotonic() + 2.0
+    while llm_client.limiter.in_flight and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert llm_client.limiter.in_flight == 0
@@ -29,11 +29,9 @@ const App: React.FC = () => {
       alert("Failed to export PDF!");
       return;
     }
-    const { file_path } = await res.json();
+    const { download_url } = await res.json();
 
-    window.open(
-      `http://localhost:8000/api/download?file_path=${encodeURIComponent(file_path)}`
-    );
+    window.open(`http://localhost:8000${download_url}`);
   };
 
   const handleDownloadWord = async () => {
@@ -46,11 +44,9 @@ const App: React.FC = () => {
       alert("Failed to export Word file!");
       return;
     }
-    const { file_path } = await res.json();
+    const { download_url } = await res.json();
 
-    window.open(
-      `http://localhost:8000/api/download?file_path=${encodeURIComponent(file_path)}`
-    );
+    window.open(`http://localhost:8000${download_url}`);
   };
 
   // Generate output with LLM backend
@@ -42,7 +42,7 @@ export async function generateMaterial(params: {
 /**
  * Export the generated material in a specific format (pdf/docx).
  * @param params Object containing text and filetype ('pdf' or 'docx').
- * @returns Promise resolving to the backend's file path as a string.
+ * @returns Promise resolving to the download URL path (/api/download/{file_id}) as a string.
  */
 export async function exportMaterial(params: {
   text: string;
@@ -62,7 +62,7 @@ export async function exportMaterial(params: {
   }
 
   const data = await response.json();
-  return data.file_path;
+  return data.download_url;
 }
 
 /**